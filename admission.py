@@ -0,0 +1,157 @@
+import logging
+import math
+import os
+import socket
+from time import monotonic
+
+import psutil
+from celery.worker.autoscale import Autoscaler
+
+import metrics
+from browser_pool import process_tree_rss
+from redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', '1') == '1'
+# Memory kept free for Redis, gunicorn and the OS.
+RESERVE_BYTES = int(os.getenv('ADMISSION_RESERVE_MB', '256')) * 1024 * 1024
+# What a job is assumed to add until real browser sizes have been seen: a
+# cold browser with its first context, or one more context on a warm browser.
+BROWSER_ESTIMATE_BYTES = int(os.getenv('ADMISSION_BROWSER_MB', '700')) * 1024 * 1024
+CONTEXT_ESTIMATE_BYTES = int(os.getenv('ADMISSION_CONTEXT_MB', '150')) * 1024 * 1024
+# A booking refused for lack of memory is tried again after this long.
+DEFER_SECONDS = int(os.getenv('ADMISSION_DEFER_SECONDS', '20'))
+
+BROWSER_RSS_KEY = 'admission:browser_rss'
+# Weight of the newest sample in the running browser size estimate.
+RSS_SMOOTHING = 0.2
+
+HOSTNAME = socket.gethostname()
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _stat_value(path, field):
+    for line in (_read(path) or '').splitlines():
+        name, _, value = line.partition(' ')
+        if name == field:
+            return int(value)
+    return 0
+
+
+def memory_limit_and_usage():
+    """(limit, usage) in bytes of the container's cgroup, or of the host without one.
+
+    Page cache that can be dropped (inactive_file) does not count as used.
+    """
+    limit, current = _read('/sys/fs/cgroup/memory.max'), _read('/sys/fs/cgroup/memory.current')
+    if limit and current and limit != 'max':
+        return int(limit), int(current) - _stat_value('/sys/fs/cgroup/memory.stat', 'inactive_file')
+
+    total = psutil.virtual_memory().total
+    limit, current = (_read('/sys/fs/cgroup/memory/memory.limit_in_bytes'),
+                      _read('/sys/fs/cgroup/memory/memory.usage_in_bytes'))
+    if limit and current and int(limit) < total:
+        return int(limit), int(current) - _stat_value('/sys/fs/cgroup/memory/memory.stat', 'total_inactive_file')
+
+    vm = psutil.virtual_memory()
+    return vm.total, vm.total - vm.available
+
+
+def headroom():
+    limit, usage = memory_limit_and_usage()
+    free = limit - usage
+    metrics.set_gauge('atu_memory_headroom_bytes', free, host=HOSTNAME)
+    return free
+
+
+def learn_browser_rss(browser_type, rss):
+    """Fold the RSS of a browser process tree at the end of a job into the shared estimate."""
+    try:
+        r = get_redis()
+        previous = r.hget(BROWSER_RSS_KEY, browser_type)
+        estimate = rss if previous is None else float(previous) * (1 - RSS_SMOOTHING) + rss * RSS_SMOOTHING
+        r.hset(BROWSER_RSS_KEY, browser_type, estimate)
+    except Exception as e:
+        logger.warning('Could not record browser RSS: %s', e)
+
+
+def browser_estimate(browser_type=None):
+    """Bytes a new worker process with its own browser is expected to take."""
+    try:
+        if browser_type:
+            learned = get_redis().hget(BROWSER_RSS_KEY, browser_type)
+        else:
+            learned = max(get_redis().hvals(BROWSER_RSS_KEY), key=float, default=None)
+    except Exception:
+        learned = None
+    return float(learned) if learned else BROWSER_ESTIMATE_BYTES
+
+
+def admit(browser_type, warm):
+    """True if the container has room for one more booking.
+
+    A booking on a warm browser only adds a context; a cold one launches a browser.
+    """
+    if not ADMISSION_ENABLED:
+        return True
+    need = CONTEXT_ESTIMATE_BYTES if warm else browser_estimate(browser_type)
+    admitted = headroom() - RESERVE_BYTES >= need
+    metrics.incr('atu_admission_total', decision='admitted' if admitted else 'deferred',
+                 browser='warm' if warm else 'cold')
+    return admitted
+
+
+def process_ceiling(processes):
+    """How many browser-running worker processes the current headroom can hold."""
+    spare = headroom() - RESERVE_BYTES
+    per_process = browser_estimate()
+    if spare >= 0:
+        return processes + int(spare // per_process)
+    return processes - math.ceil(-spare / per_process)
+
+
+class MemoryAutoscaler(Autoscaler):
+    """Celery autoscaler bounded by memory as well as by --autoscale=max,min.
+
+    Grows the pool towards the number of reserved tasks only while the
+    container has room for another browser, and shrinks it right away (not
+    after the idle keepalive) when headroom drops below the reserve.
+    """
+
+    def _maybe_scale(self, req=None):
+        procs = self.processes
+        if ADMISSION_ENABLED:
+            ceiling = max(self.min_concurrency, min(self.max_concurrency, process_ceiling(procs)))
+        else:
+            ceiling = self.max_concurrency
+
+        metrics.set_gauge('atu_worker_concurrency', procs, host=HOSTNAME)
+        metrics.set_gauge('atu_worker_concurrency_ceiling', ceiling, host=HOSTNAME)
+        metrics.set_gauge('atu_worker_tree_rss_bytes', process_tree_rss(), host=HOSTNAME)
+
+        if procs > ceiling:
+            metrics.incr('atu_autoscale_total', action='down', reason='memory')
+            self._shrink(procs - ceiling)
+            return True
+
+        wanted = min(self.qty, ceiling)
+        if wanted > procs:
+            metrics.incr('atu_autoscale_total', action='up', reason='load')
+            self.scale_up(wanted - procs)
+            return True
+
+        wanted = max(self.qty, self.min_concurrency)
+        idle_long_enough = self._last_scale_up and monotonic() - self._last_scale_up > self.keepalive
+        if wanted < procs and idle_long_enough:
+            metrics.incr('atu_autoscale_total', action='down', reason='idle')
+            self.scale_down(procs - wanted)
+            return True
@@ -1,15 +1,43 @@
 # app.py
-from tasks import run_scraper
+from time import perf_counter
+_import_start = perf_counter()
+
+# Only lightweight modules here: the web process never runs a browser, so
+# Playwright, pandas and the scraper are loaded by the Celery workers alone.
+from tasks import check_availability, run_scraper, run_scraper_async, run_scraper_batch
 from datetime import datetime
-from flask import Flask, render_template, render_template_string, request, jsonify, send_from_directory, abort
+from flask import Flask, Response, render_template, stream_with_context, render_template_string, request, jsonify, send_from_directory, abort
 from threading import Thread
 from multiprocessing import Process
 
-from atu_scraper import ATUScraper
+from pacing import PROFILES
+import availability
+import ingest
+import jobs
+import log_search
+import log_store
+import metrics
+import scheduler
+import vehicle_catalog
+import json
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+log_index = log_store.LogIndex(LOG_DIR)
+log_search_index = log_search.LogSearch(LOG_DIR)
+
+
+@app.before_request
+def start_log_indexer():
+    # Started by the first request of each web process rather than on import,
+    # so importing app (tests, scripts, the gunicorn master) writes nothing to logs/.
+    log_search_index.start()
+
+logger.debug('app imports took %.2fs', perf_counter() - _import_start)
 
 
 @app.route('/')
@@ -112,8 +140,15 @@ def index():
     <label><input type="radio" name="browser" value="Camoufox"> Camoufox</label><br>
   </div>
 
+  <p>Select Pacing Profile:</p>
+  <div>
+    <label><input type="radio" name="pacing" value="stealth" checked> Stealth</label><br>
+    <label><input type="radio" name="pacing" value="balanced"> Balanced</label><br>
+    <label><input type="radio" name="pacing" value="fast"> Fast</label><br>
+  </div>
 
-    <button onclick="startScraper()">🚀 Start Scraper</button>
+
+    <button id="startButton" onclick="startScraper()">🚀 Start Scraper</button>
 
     <div id="responseBox"></div>
   </div>
@@ -124,12 +159,15 @@ def index():
       const jsonData = document.getElementById("jsonInput").value;
       
       const browserType = document.querySelector('input[name="browser"]:checked').value;
+      const pacing = document.querySelector('input[name="pacing"]:checked').value;
+      const button = document.getElementById("startButton");
 
+      button.disabled = true;
       try {
         const parsed = JSON.parse(jsonData);
         responseBox.textContent = "⏳ Sending data...";
 
-        const res = await fetch(`/run-scraper?browser_type=${encodeURIComponent(browserType)}`, {
+        const res = await fetch(`/run-scraper?browser_type=${encodeURIComponent(browserType)}&pacing=${encodeURIComponent(pacing)}`, {
           method: "POST",
           headers: {
             "Content-Type": "application/json",
@@ -141,6 +179,8 @@ def index():
         responseBox.textContent = JSON.stringify(result, null, 2);
       } catch (err) {
         responseBox.textContent = "❌ Invalid JSON or error: " + err.message;
+      } finally {
+        button.disabled = false;
       }
     }
   </script>
@@ -160,6 +200,23 @@ def webhook():
     if not data:
         return jsonify({"error": "Invalid JSON"}), 400
 
+    if request.args.get("priority"):
+        data["priority"] = request.args["priority"]
+    problems = ingest.validate(data)
+    if problems:
+        return jsonify({"error": "Invalid booking", "problems": problems}), 400
+
+    pacing = request.args.get("pacing", data.get("pacing"))
+    if pacing:
+        if pacing not in PROFILES:
+            return jsonify({"error": f"Unknown pacing profile: {pacing}", "profiles": list(PROFILES)}), 400
+        data["pacing"] = pacing
+
+    # A vehicle the site does not offer would only fail after the browser is up.
+    vehicle_problems = check_vehicle(data)
+    if vehicle_problems and vehicle_catalog.VALIDATION_MODE == "reject":
+        return jsonify({"error": "Unknown vehicle", "problems": vehicle_problems}), 422
+
     # Run scraper in a background thread
     # thread = Thread(target=run_scraper, args=(test_data,timestamp))
     # thread = Thread(target=lambda: ATUScraper(data, timestamp, browser_type).run())
@@ -169,31 +226,294 @@ def webhook():
     # p = Process(target=lambda: ATUScraper(data, timestamp, browser_type).run())
     # p.start()
 
+    # A retried or double-clicked submission gets the job of the first one.
+    key = ingest.idempotency_key(data, request.headers.get("Idempotency-Key") or data.get("idempotency_key"))
+    # The job is registered before its key is claimed, so a concurrent
+    # duplicate always finds the job the key points at.
+    job_id = jobs.create_job(timestamp, browser_type, data)
+    existing = ingest.claim(key, job_id)
+    if existing is not None:
+        jobs.discard_job(job_id)
+        return jsonify({"status": "Duplicate", "timestamp": existing.get("timestamp"),
+                        "job_id": existing["job_id"], "job_status": existing.get("status")}), 200
+
     # Use Celery instead of thread
-    run_scraper.delay(data, timestamp, browser_type)
+    # Lane and order come from data["priority"] / target_date (see scheduler.py)
+    try:
+        if request.args.get("engine") == "async":
+            _, lane = scheduler.enqueue(run_scraper_async, (data, timestamp, browser_type, job_id), data, queue="async")
+        else:
+            _, lane = scheduler.enqueue(run_scraper, (data, timestamp, browser_type, job_id), data)
+    except Exception as e:
+        ingest.release(key, job_id)
+        jobs.publish(job_id, "failed", status="failed", error=f"Could not queue: {e!r}")
+        raise
+
+    response = {"status": "Scraper started", "timestamp": timestamp, "job_id": job_id, "lane": lane}
+    if vehicle_problems:
+        response["warnings"] = vehicle_problems
+    return jsonify(response), 200
+
+
+def check_vehicle(data):
+    """Vehicle problems found in the harvested catalog (see vehicle_catalog.validate)."""
+    if vehicle_catalog.VALIDATION_MODE == "off":
+        return []
+    return vehicle_catalog.validate(data)
+
+
+def read_bookings(req):
+    """Bookings from a JSON array body, or one JSON object per line (NDJSON)."""
+    if req.mimetype in ("application/x-ndjson", "application/jsonl"):
+        bookings = []
+        for line in req.stream:
+            line = line.strip()
+            if line:
+                bookings.append(json.loads(line))
+        return bookings
+
+    bookings = req.get_json(silent=True)
+    if not isinstance(bookings, list):
+        raise ValueError("Expected a JSON array of bookings")
+    return bookings
+
+
+@app.route('/run-scraper/batch', methods=['POST'])
+def batch_webhook():
+    browser_type = request.args.get("browser_type", "Opera")
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+
+    try:
+        bookings = read_bookings(request)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid batch: {e}"}), 400
+
+    statuses = []
+    groups = {}
+    for i, data in enumerate(bookings):
+        booking_timestamp = f"{timestamp}-{i:03d}"
+        problems = ingest.validate(data)
+        if problems:
+            statuses.append({"index": i, "timestamp": booking_timestamp, "status": "rejected",
+                             "error": "Invalid booking", "problems": problems})
+            continue
+
+        pacing = request.args.get("pacing", data.get("pacing"))
+        if pacing:
+            if pacing not in PROFILES:
+                statuses.append({"index": i, "timestamp": booking_timestamp, "status": "rejected",
+                                 "error": f"Unknown pacing profile: {pacing}", "profiles": list(PROFILES)})
+                continue
+            data["pacing"] = pacing
+
+        vehicle_problems = check_vehicle(data)
+        if vehicle_problems and vehicle_catalog.VALIDATION_MODE == "reject":
+            statuses.append({"index": i, "timestamp": booking_timestamp, "status": "rejected",
+                             "error": "Unknown vehicle", "problems": vehicle_problems})
+            continue
+
+        job_id = jobs.create_job(booking_timestamp, browser_type, data)
+        existing = ingest.claim(ingest.idempotency_key(data, data.get("idempotency_key")), job_id)
+        if existing is not None:
+            jobs.discard_job(job_id)
+            statuses.append({"index": i, "timestamp": existing.get("timestamp"), "job_id": existing["job_id"],
+                             "status": "duplicate", "job_status": existing.get("status")})
+            continue
+
+        status = {"index": i, "timestamp": booking_timestamp, "job_id": job_id, "status": "queued"}
+        if vehicle_problems:
+            status["warnings"] = vehicle_problems
+        statuses.append(status)
+        groups.setdefault(scheduler.booking_group_key(data), []).append(((data, booking_timestamp, job_id), status))
+
+    # One task, and so one browser session, per branch + vehicle
+    # Batches default to the bulk lane; the group's nearest target_date sets its order.
+    for key, members in groups.items():
+        bookings = [booking for booking, _ in members]
+        lead = min((data for data, _, _ in bookings),
+                   key=lambda data: scheduler.priority_for(data, scheduler.lane_for(data, default="bulk")))
+        task, lane = scheduler.enqueue(run_scraper_batch, (bookings, browser_type), lead,
+                                       scheduler.lane_for(lead, default="bulk"))
+        for _, status in members:
+            status["group"] = "|".join(key)
+            status["task_id"] = task.id
+            status["lane"] = lane
+
+    return jsonify({"status": "Batch queued", "groups": len(groups), "bookings": statuses}), 200
+
+
+@app.route("/availability", methods=["GET", "POST"])
+def availability_lookup():
+    """Available dates and slots for a branch and service set, served from cache.
+
+    On a miss (or with ?refresh=1) a read-only availability run is queued and
+    202 is returned with its job_id; ask again once the job is done.
+    """
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+    else:
+        data = request.args.to_dict()
+        if data.get("id_target"):
+            data["id_target"] = [int(i) if i.isdigit() else i for i in data["id_target"].split(",")]
+
+    if not data.get("pin_code") or not data.get("id_target"):
+        return jsonify({"error": "pin_code and id_target are required"}), 400
+    groups = vehicle_catalog.service_groups(data)
+    missing = vehicle_catalog.missing_fields(groups, data) if groups is not None else []
+    if missing:
+        return jsonify({"error": "Missing fields for the requested services", "missing": missing}), 400
+
+    query = availability.make_query(data)
+    availability.note_request(query)
+
+    entry = availability.get(query)
+    if entry is not None and request.args.get("refresh") != "1":
+        metrics.incr("atu_availability_requests_total", result="hit")
+        return jsonify(dict(entry, status="cached"))
+
+    metrics.incr("atu_availability_requests_total", result="miss")
+    if not availability.claim(query):
+        return jsonify({"status": "pending", "cached": entry}), 202
+
+    browser_type = request.args.get("browser_type", "Opera")
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    job_id = jobs.create_job(timestamp, browser_type, data)
+    scheduler.enqueue(check_availability, (query, timestamp, browser_type, job_id), query, "normal")
+    return jsonify({"status": "queued", "job_id": job_id, "cached": entry}), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """Current status, phase and (when done) screenshot path of a job."""
+    job = jobs.get_job(job_id)
+    if job is None:
+        abort(404, description="Job not found")
+    return jsonify(job)
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """Stream a job's phase transitions and final outcome as server-sent events."""
+    if jobs.get_job(job_id) is None:
+        abort(404, description="Job not found")
+
+    return Response(
+        stream_with_context(jobs.stream_events(job_id)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Queue depth, in-flight jobs, job outcomes and per-phase latency for Prometheus."""
+    try:
+        return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+    except Exception as e:
+        return Response(f"# metrics unavailable: {e}\n", status=503, mimetype="text/plain")
 
-    return jsonify({"status": "Scraper started", "timestamp": timestamp}), 200
 
 @app.route("/logs", methods=["GET"])
 def list_log_files():
-    """List all log files in the logs/ directory."""
+    """List log files newest first, with size and mtime, one page at a time."""
     try:
-        files = [f for f in os.listdir(LOG_DIR) if f.endswith(".log")]
-        return jsonify({"log_files": files})
+        page = max(int(request.args.get("page", 1)), 1)
+        per_page = min(max(int(request.args.get("per_page", 50)), 1), 500)
+    except ValueError:
+        return jsonify({"error": "page and per_page must be integers"}), 400
+
+    try:
+        files, total = log_index.page(page, per_page)
+        return jsonify({
+            "log_files": [f["name"] for f in files],
+            "files": files,
+            "page": page,
+            "per_page": per_page,
+            "total": total,
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/logs/search", methods=["GET"])
+def search_logs():
+    """Full-text search over indexed log lines, newest first.
+
+    ?q= words to find in that order, ?level=ERROR, ?since= epoch seconds, an
+    ISO date/time or an age like 2h, ?job_id=, ?limit= (default 100).
+    """
+    try:
+        since = log_search.parse_since(request.args.get("since"))
+        limit = min(max(int(request.args.get("limit", 100)), 1), 1000)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start = perf_counter()
+    try:
+        lines = log_search_index.search(request.args.get("q"), request.args.get("level"), since,
+                                        request.args.get("job_id"), limit)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    runs = []
+    for line in lines:
+        if line["file"] not in runs:
+            runs.append(line["file"])
+    return jsonify({
+        "lines": lines,
+        "runs": runs,
+        "count": len(lines),
+        "took_ms": round((perf_counter() - start) * 1000, 2),
+    })
+
 
 @app.route("/logs/<filename>", methods=["GET"])
 def get_log_file(filename):
-    """Serve a specific log file content."""
+    """Serve a log file.
+
+    ?offset=N returns only the bytes from N on, and ?follow=1 keeps the
+    response open and pushes new lines as they are written. A Range header
+    is answered with 206 Partial Content. The body is gzip-encoded when the
+    client accepts it. X-Log-Offset is where the next incremental read starts.
+    """
     if not filename.endswith(".log") or "/" in filename or ".." in filename:
         abort(400, description="Invalid filename")
 
+    path = os.path.join(LOG_DIR, filename)
+    # Logs archived by the search indexer are served from logs/archive/*.gz;
+    # they no longer grow, so they are always read in one go.
+    archived = None
+    if not os.path.isfile(path):
+        archived = log_store.archived_path(LOG_DIR, filename)
+        if archived is None:
+            abort(404, description="Log file not found")
+
     try:
-        return send_from_directory(LOG_DIR, filename, mimetype="text/plain")
-    except FileNotFoundError:
-        abort(404, description="Log file not found")
+        offset = max(int(request.args.get("offset", 0)), 0)
+    except ValueError:
+        abort(400, description="offset must be an integer")
+    gzip_ok = log_store.accepts_gzip(request)
+
+    if archived is None and request.args.get("follow") == "1":
+        chunks = log_store.follow(path, offset)
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        if gzip_ok:
+            chunks = log_store.gzip_stream(chunks)
+            headers["Content-Encoding"] = "gzip"
+        return Response(chunks, mimetype="text/plain", headers=headers)
+
+    if archived is None and "offset" not in request.args and (request.range or not gzip_ok):
+        try:
+            return send_from_directory(LOG_DIR, filename, mimetype="text/plain")
+        except FileNotFoundError:
+            abort(404, description="Log file not found")
+
+    data, next_offset = log_store.read_from(archived or path, offset)
+    headers = {"X-Log-Offset": str(next_offset), "Vary": "Accept-Encoding"}
+    if gzip_ok:
+        data = log_store.gzip_bytes(data)
+        headers["Content-Encoding"] = "gzip"
+    return Response(data, mimetype="text/plain", headers=headers)
 
 if __name__ == '__main__':
     # app.run(debug=True)
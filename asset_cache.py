@@ -0,0 +1,316 @@
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import metrics
+from resource_filter import ALLOWED_DOMAINS
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv('ASSET_CACHE_ENABLED', '1') == '1'
+CACHE_DIR = os.getenv('ASSET_CACHE_DIR', './asset_cache')
+MAX_BYTES = int(os.getenv('ASSET_CACHE_MAX_MB', '256')) * 1024 * 1024
+
+CACHEABLE_TYPES = {'script', 'stylesheet', 'font', 'image'}
+
+# Only the site's own static assets are served from the cache. Everything
+# else, above all the anti-bot and consent hosts (resource_filter.ALLOWED_DOMAINS),
+# goes out untouched: route.fetch() would re-issue it with a different
+# fingerprint than the browser's own request.
+FIRST_PARTY_DOMAINS = {d.strip().lower() for d in os.getenv('ASSET_CACHE_DOMAINS', 'atu.de').split(',') if d.strip()}
+_booking_host = urlsplit(os.getenv('ATU_BOOKING_URL', '')).hostname
+if _booking_host:
+    FIRST_PARTY_DOMAINS.add(_booking_host.lower())
+
+
+def _host_in(host, domains):
+    return any(host == d or host.endswith('.' + d) for d in domains)
+
+
+def first_party(url):
+    host = (urlsplit(url).hostname or '').lower()
+    return _host_in(host, FIRST_PARTY_DOMAINS) and not _host_in(host, ALLOWED_DOMAINS)
+
+# Headers that must not be replayed from a shared cache: cookies belong to the
+# job that fetched the asset, and the stored body is already decoded.
+DROPPED_HEADERS = {'set-cookie', 'content-encoding', 'content-length', 'transfer-encoding', 'connection'}
+
+_MAX_AGE = re.compile(r'(?:s-maxage|max-age)\s*=\s*(\d+)')
+
+
+def _paths(cache_dir, url):
+    digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    base = os.path.join(cache_dir, digest[:2], digest)
+    return base + '.json', base + '.body'
+
+
+def freshness(headers, now=None):
+    """Expiry timestamp from Cache-Control / Expires, or None if the response must not be stored."""
+    now = now or time.time()
+    cache_control = headers.get('cache-control', '').lower()
+    if 'no-store' in cache_control or 'private' in cache_control:
+        return None
+
+    vary = {v.strip().lower() for v in headers.get('vary', '').split(',') if v.strip()}
+    if vary - {'accept-encoding'}:
+        return None
+
+    if 'no-cache' in cache_control:
+        return now  # stored, but revalidated before every use
+
+    match = _MAX_AGE.search(cache_control)
+    if match:
+        return now + int(match.group(1))
+
+    if headers.get('expires'):
+        try:
+            return parsedate_to_datetime(headers['expires']).timestamp()
+        except (TypeError, ValueError):
+            return now
+
+    # No explicit lifetime: keep it only if it can be revalidated.
+    if headers.get('etag') or headers.get('last-modified'):
+        return now
+    return None
+
+
+class AssetCache:
+    """Route-level cache of static responses shared by every job on the node.
+
+    Entries live on disk (metadata JSON + body) so all worker processes share
+    them. Freshness follows Cache-Control/Expires; stale entries are
+    revalidated with If-None-Match / If-Modified-Since. Total size is capped
+    and the least recently used entries are evicted first. Only response
+    bodies are cached, so cookies and storage stay per job.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._written_since_sweep = 0
+        self._lock = threading.Lock()
+
+    def load(self, url):
+        meta_path, body_path = _paths(self.cache_dir, url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None, None
+        # Touch for LRU ordering.
+        try:
+            os.utime(body_path)
+        except OSError:
+            pass
+        return meta, body
+
+    def store(self, url, status, headers, body, expires):
+        meta_path, body_path = _paths(self.cache_dir, url)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        meta = {
+            'url': url,
+            'status': status,
+            'headers': {k: v for k, v in headers.items() if k.lower() not in DROPPED_HEADERS},
+            'expires': expires,
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+        }
+        suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(body_path + suffix, 'wb') as f:
+                f.write(body)
+            with open(meta_path + suffix, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(body_path + suffix, body_path)
+            os.replace(meta_path + suffix, meta_path)
+        except OSError as e:
+            logger.warning('Could not store %s in asset cache: %s', url, e)
+            return
+
+        with self._lock:
+            self._written_since_sweep += len(body)
+            sweep = self._written_since_sweep > self.max_bytes // 10
+            if sweep:
+                self._written_since_sweep = 0
+        if sweep:
+            self.evict()
+
+    def refresh(self, url, meta, expires):
+        meta_path, _ = _paths(self.cache_dir, url)
+        meta['expires'] = expires
+        tmp_path = f'{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, meta_path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Drop least recently used bodies until the cache is under 90% of its cap."""
+        entries, total = [], 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.body'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(entries):
+            for victim in (path, path[:-len('.body')] + '.json'):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            total -= size
+            if total <= target:
+                break
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = AssetCache()
+    return _cache
+
+
+def _conditional_headers(request_headers, meta):
+    headers = dict(request_headers)
+    if meta.get('etag'):
+        headers['if-none-match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['if-modified-since'] = meta['last_modified']
+    return headers
+
+
+async def _off_loop(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args))
+
+
+class CachingRoute:
+    """Per-job route handler in front of the shared AssetCache, with hit/miss stats."""
+
+    def __init__(self, cache=None):
+        self.cache = cache or get_cache()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_from_cache = 0
+        self.bytes_from_network = 0
+
+    def _cacheable(self, request):
+        return (request.method == 'GET' and request.resource_type in CACHEABLE_TYPES
+                and first_party(request.url))
+
+    def handle(self, route):
+        request = route.request
+        if not self._cacheable(request):
+            route.fallback()
+            return
+
+        meta, body = self.cache.load(request.url)
+        if meta is not None and meta['expires'] > time.time():
+            self.hits += 1
+            self.bytes_from_cache += len(body)
+            route.fulfill(status=meta['status'], headers=meta['headers'], body=body)
+            return
+
+        if meta is not None and (meta.get('etag') or meta.get('last_modified')):
+            response = route.fetch(headers=_conditional_headers(request.headers, meta))
+            if response.status == 304:
+                self.revalidated += 1
+                self.bytes_from_cache += len(body)
+                self.cache.refresh(request.url, meta, freshness(response.headers) or time.time())
+                route.fulfill(status=meta['status'], headers=meta['headers'], body=body)
+                return
+        else:
+            response = route.fetch()
+
+        self.misses += 1
+        fresh_body = response.body()
+        self.bytes_from_network += len(fresh_body)
+        expires = freshness(response.headers) if response.status == 200 else None
+        if expires is not None:
+            self.cache.store(request.url, response.status, response.headers, fresh_body, expires)
+        route.fulfill(response=response, body=fresh_body)
+
+    async def handle_async(self, route):
+        request = route.request
+        if not self._cacheable(request):
+            await route.fallback()
+            return
+
+        # Disk reads and writes (and the eviction sweep) stay off the event loop.
+        meta, body = await _off_loop(self.cache.load, request.url)
+        if meta is not None and meta['expires'] > time.time():
+            self.hits += 1
+            self.bytes_from_cache += len(body)
+            await route.fulfill(status=meta['status'], headers=meta['headers'], body=body)
+            return
+
+        if meta is not None and (meta.get('etag') or meta.get('last_modified')):
+            response = await route.fetch(headers=_conditional_headers(request.headers, meta))
+            if response.status == 304:
+                self.revalidated += 1
+                self.bytes_from_cache += len(body)
+                await _off_loop(self.cache.refresh, request.url, meta, freshness(response.headers) or time.time())
+                await route.fulfill(status=meta['status'], headers=meta['headers'], body=body)
+                return
+        else:
+            response = await route.fetch()
+
+        self.misses += 1
+        fresh_body = await response.body()
+        self.bytes_from_network += len(fresh_body)
+        expires = freshness(response.headers) if response.status == 200 else None
+        if expires is not None:
+            await _off_loop(self.cache.store, request.url, response.status, response.headers, fresh_body, expires)
+        await route.fulfill(response=response, body=fresh_body)
+
+    def install(self, context):
+        if CACHE_ENABLED:
+            context.route('**/*', self.handle)
+        return self
+
+    async def install_async(self, context):
+        if CACHE_ENABLED:
+            await context.route('**/*', self.handle_async)
+        return self
+
+    def hit_rate(self):
+        total = self.hits + self.revalidated + self.misses
+        return (self.hits + self.revalidated) / total if total else 0.0
+
+    def summary(self):
+        return (f"hits={self.hits} revalidated={self.revalidated} misses={self.misses} "
+                f"hit_rate={self.hit_rate():.0%} from_cache={self.bytes_from_cache / 1024:.0f} KiB "
+                f"from_network={self.bytes_from_network / 1024:.0f} KiB")
+
+    def record_metrics(self):
+        metrics.incr('atu_asset_cache_requests_total', self.hits, result='hit')
+        metrics.incr('atu_asset_cache_requests_total', self.revalidated, result='revalidated')
+        metrics.incr('atu_asset_cache_requests_total', self.misses, result='miss')
+        metrics.incr('atu_asset_cache_bytes_total', self.bytes_from_cache, source='cache')
+        metrics.incr('atu_asset_cache_bytes_total', self.bytes_from_network, source='network')
@@ -0,0 +1,551 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+
+from playwright.async_api import Error as PlaywrightError, Locator, TimeoutError as PlaywrightTimeoutError, async_playwright
+from tenacity import *
+
+from atu_scraper import ATU_BOOKING_URL, NEXT_PHASE_MARKERS, ATUScraper
+from branch_directory import BRANCH_ENTRIES_JS
+import branch_directory
+from browser_pool import INIT_SCRIPT, USER_AGENT, find_opera_path
+from dom_select import NEXT_FRAME_JS, OPTIONS_LOADED_JS, AsyncDomSelector, describe_miss, is_page_xhr
+from failures import (BLOCK_SELECTOR, BlockedError, InputError, LayoutError, TransientError,
+                      blocked_reason, failure_kind, phase_stop, phase_wait)
+import jobs
+import reaper
+import metrics
+from pacing import READY_TIMEOUT_MS
+from asset_cache import CachingRoute
+from resource_filter import RequestFilter
+import screenshot_delivery
+from typing_engine import AsyncTypingEngine, fields_to_fill
+import vehicle_catalog
+
+
+# Bookings one worker process drives at the same time on its event loop.
+MAX_CONCURRENCY = int(os.getenv('ASYNC_MAX_BOOKINGS', '4'))
+
+engine_logger = logging.getLogger(__name__)
+
+
+class AsyncATUScraper(ATUScraper):
+    """The ATUScraper booking flow on playwright.async_api.
+
+    Runs inside a BrowserContext handed in by AsyncBookingEngine, so many
+    bookings can share one browser and one event loop.
+    """
+
+    def __init__(self, data, timestamp, browser_type, job_id=None):
+        self.job_key = f"{timestamp}-{id(self):x}"
+        super().__init__(data, timestamp, browser_type, job_id)
+
+    def setup_logger(self):
+        os.makedirs("logs", exist_ok=True)
+        os.makedirs("screenshots", exist_ok=True)
+
+        log_file = f"logs/run-{self.timestamp}.log"
+
+        # Every booking on the loop shares a thread, so the logger is keyed per job.
+        logger = logging.getLogger(f'scraper-async-{self.job_key}')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        file_handler = logging.FileHandler(log_file)
+        formatter = logging.Formatter('[%(asctime)s] %(levelname)s - %(message)s', '%Y-%m-%d %H:%M:%S')
+        file_handler.setFormatter(formatter)
+        logger.addHandler(file_handler)
+
+        return logger
+
+    async def pause(self, step):
+        await self.pacer.async_pause(step)
+
+    async def wait_for_options(self, select, step):
+        with self.pacer.timed(f'wait:{step}_options'):
+            try:
+                await select.wait_for(state='attached', timeout=READY_TIMEOUT_MS)
+                await self.page.wait_for_function(OPTIONS_LOADED_JS, arg=await select.element_handle(),
+                                                  timeout=READY_TIMEOUT_MS)
+            except PlaywrightTimeoutError:
+                self.logger.info('Options of %s did not load in time, continuing', step)
+
+    async def select_awaiting_xhr(self, select, target, mode, step, fallback=None):
+        selected = False
+        try:
+            with self.pacer.timed(f'wait:{step}_xhr'):
+                async with self.page.expect_response(lambda r: is_page_xhr(r, self.page.url),
+                                                     timeout=READY_TIMEOUT_MS) as response_info:
+                    result = await self.selector().select_option(select, target, mode, fallback=fallback)
+                    if result['index'] < 0:
+                        # Nothing was selected, so no XHR is coming.
+                        if len(result['candidates']) <= 1:
+                            raise TransientError(f"Options did not load for {target}")
+                        raise LayoutError(f"Option not found: {target}")
+                    selected = True
+                response = await response_info.value
+                await response.finished()
+                await self.page.evaluate(NEXT_FRAME_JS)
+        except PlaywrightTimeoutError:
+            if not selected:
+                raise
+            self.logger.info('No XHR after selecting %s, continuing', target)
+        return result
+
+    def typist(self):
+        return AsyncTypingEngine(self.page, self.pacer, self.typing_mode)
+
+    def selector(self):
+        if self.dom is None or self.dom.page is not self.page:
+            self.dom = AsyncDomSelector(self.page)
+        return self.dom
+
+    async def wait_ready(self, locator=None, state='visible'):
+        try:
+            if locator is not None:
+                await locator.wait_for(state=state, timeout=READY_TIMEOUT_MS)
+            else:
+                await self.page.wait_for_load_state('networkidle', timeout=READY_TIMEOUT_MS)
+        except PlaywrightTimeoutError:
+            await self.raise_if_blocked()
+            self.logger.info('Readiness wait timed out, continuing')
+
+    async def raise_if_blocked(self, response=None):
+        try:
+            reason = blocked_reason(response.status if response is not None else None,
+                                    await self.page.title(), await self.page.locator(BLOCK_SELECTOR).count() > 0)
+        except PlaywrightError:
+            return
+        if reason:
+            self.logger.error('Blocked by the site: %s', reason)
+            raise BlockedError(f'Blocked by the site: {reason}')
+
+    async def settle(self, step, locator=None, state='visible'):
+        with self.pacer.timed(f'wait:{step}'):
+            await self.wait_ready(locator, state)
+            await self.pause(step)
+
+    async def click_any_bt(self, elem: Locator):
+        for _ in range(4):
+            try:
+                await self.pause('click')
+                await elem.wait_for(state='visible', timeout=5000*3)
+                await elem.click()
+                self.logger.info('Clicked: %s', elem)
+                await self.settle('click')
+                return
+            except Exception:
+                self.logger.warning('Failed to click bt. Retrying... %s', elem)
+
+    async def fill_input_dropdown(self, select, target, catalog_path=None):
+        collect = catalog_path is not None and await self.offload(vehicle_catalog.options, catalog_path) is None
+        await self.wait_for_options(select, 'dropdown')
+        result = await self.selector().select_option(select, target, self.match_mode or 'exact', collect=collect)
+        if catalog_path is not None and (collect or not result['ok']):
+            await self.offload(vehicle_catalog.record, catalog_path, result['candidates'])
+
+        if not result['ok']:
+            self.logger.warning(describe_miss(target, result))
+            if len(result['candidates']) <= 1:
+                # Only the placeholder: the list's XHR has not answered yet.
+                raise TransientError(f"Options did not load in the dropdown for {target}")
+            raise InputError(f"Option not found: {target}")
+
+        self.logger.info(result['text'])
+        await self.settle('dropdown')
+        return result['text']
+
+    @retry(stop=phase_stop, wait=phase_wait, reraise=True)
+    async def branch_selection_part(self):
+        if self.preselected_branch and await self.branch_preselected():
+            return
+
+        await self.settle('branch', self.page.locator("#locationSearchInput").first)
+        try:
+            await self.click_any_bt(self.page.locator("button:has-text('Alle akzeptieren')").first)
+            self.logger.info("Cookies accepted")
+        except Exception:
+            self.logger.warning("No cookies found")
+
+        self.logger.info("\n###### Branch Selection ######\n")
+        location_input = self.page.locator("#locationSearchInput").first
+        await self.typist().enter(location_input, self.data['pin_code'])
+
+        self.logger.info('Waiting for branch entries to load...')
+        branch_loaded = False
+
+        for i in range(4):
+            await self.page.keyboard.press('Enter')
+            try:
+                await self.page.locator('.branch-list-entry').first.wait_for(state='visible', timeout=30000*3)
+                self.logger.info('Branch entries loaded successfully!')
+                branch_loaded = True
+                await self.pause('branch_loaded')
+                break
+            except PlaywrightTimeoutError:
+                await self.raise_if_blocked()
+                self.logger.warning('Branch entries did not loaded. Retrying...')
+
+        if not branch_loaded:
+            raise TransientError(f"Branch entries did not load for {self.data['pin_code']}")
+
+        entries = self.page.locator('.branch-list-entry')
+        branches = None
+        try:
+            branches = await entries.evaluate_all(BRANCH_ENTRIES_JS)
+            self.logger.info('Branches for %s: %s', self.data['pin_code'], [b['name'] for b in branches])
+        except Exception as e:
+            self.logger.warning('Could not read branch entries: %s', e)
+
+        await self.click_any_bt(entries.first)
+        if branches:
+            await self.offload(branch_directory.record, self.data['pin_code'], branches,
+                               await self.selected_branch_url())
+
+    async def selected_branch_url(self):
+        try:
+            await self.page.locator(NEXT_PHASE_MARKERS['branch_selection']).first.wait_for(
+                state='visible', timeout=READY_TIMEOUT_MS)
+        except PlaywrightTimeoutError:
+            return None
+        url = self.page.url
+        return url if url.rstrip('/') != ATU_BOOKING_URL.rstrip('/') else None
+
+    async def branch_preselected(self):
+        url, self.preselected_branch = self.preselected_branch, None
+        try:
+            await self.page.locator("button:has-text('Alle akzeptieren')").first.click(timeout=5000)
+        except Exception:
+            pass
+
+        try:
+            await self.page.locator(NEXT_PHASE_MARKERS['branch_selection']).first.wait_for(state='visible', timeout=10000)
+            self.logger.info('Branch preselected from the branch cache')
+            await self.offload(metrics.incr, 'atu_branch_preselect_total', result='ok')
+            return True
+        except PlaywrightTimeoutError:
+            self.logger.warning('Cached branch URL did not select the branch, searching instead')
+            await self.offload(metrics.incr, 'atu_branch_preselect_total', result='failed')
+            await self.offload(branch_directory.deny, url)
+            await self.offload(branch_directory.invalidate, self.data['pin_code'])
+            await self.page.goto(ATU_BOOKING_URL, timeout=60000*3)
+            return False
+
+    @retry(stop=phase_stop, wait=phase_wait, reraise=True)
+    async def service_selection_part(self):
+        self.logger.info("\n###### Service Selection ######\n")
+        await self.settle('service', self.page.locator('.more-entries').first)
+        await self.click_any_bt(self.page.locator('.more-entries').first)
+        vehicle_details_filled = False
+
+        dom = self.selector()
+
+        async def choose_service_group(service_G_name):
+            self.logger.info(f'Choosing service group: {service_G_name}')
+
+            result = await dom.click(dom.locator('.service-name.group'), service_G_name, self.match_mode or 'exact')
+            if not result['ok']:
+                self.logger.error(describe_miss(service_G_name, result))
+                if not result['candidates']:
+                    raise LayoutError('No service groups on the page')
+                raise InputError(f"Service group not found: {service_G_name}")
+
+            # The group's service list is rendered after the click.
+            await self.settle('service_group', dom.locator('.service-list').last)
+
+        async def fill_vehicle_details():
+            nonlocal vehicle_details_filled
+            self.logger.info('\nService page type 1')
+            await self.settle('vehicle', self.page.locator("select").nth(2), state='attached')
+
+            input_field = dom.locator("select")
+            manufacturer = input_field.nth(0)
+            model = input_field.nth(1)
+            year = input_field.nth(2)
+
+            chosen_manufacturer = await self.fill_input_dropdown(manufacturer, self.data["target_manufacturer"], ())
+            chosen_model = await self.fill_input_dropdown(model, self.data["target_model"], (chosen_manufacturer,))
+            await self.fill_input_dropdown(year, self.data["target_year"], (chosen_manufacturer, chosen_model))
+
+            await self.click_any_bt(self.page.get_by_text("Speichern und weiter").first)
+            await self.settle('vehicle_saved', self.page.locator('.service-list').first)
+            vehicle_details_filled = True
+
+        target_service_group = self.data["target_service_group"][0]
+        await choose_service_group(target_service_group)
+
+        if target_service_group in ['Ölwechsel', 'Inspektion', 'Achsvermessung', 'Bremsen', 'Fahrwerk', 'Zahnriemen']:
+            await fill_vehicle_details()
+
+        service_names = dom.locator('.service-list').last.locator('h3.service-name')
+
+        async def choose_service_name(s_name, qty=1):
+            self.logger.info('Service page type 2')
+            self.logger.info(f'Choosing service: {s_name}')
+
+            try:
+                result = await dom.click(service_names, s_name, self.match_mode or 'normalized', fallback=0)
+                if result['ok']:
+                    self.logger.info(f"Selecting: {result['index']}, {result['text']}")
+                else:
+                    self.logger.warning(f"Name not found, Selecting first service...")
+                    self.logger.warning(describe_miss(s_name, result))
+            except Exception:
+                self.logger.error("Service name not found")
+
+            try:
+                quantity = self.page.locator('select[name="service-amount"]').first
+                await quantity.wait_for(state='visible', timeout=5000*3)
+                await quantity.select_option(qty)
+                self.logger.info(f'Quantity changed to {qty}')
+            except Exception:
+                self.logger.warning('Quantity field not found')
+
+            await self.click_any_bt(self.page.locator('.btn.btn-primary.btn-addService').first)
+            await self.settle('add_service')
+
+        # Case 1: Service Group - HU/AU
+        if target_service_group == 'HU/AU':
+            if self.data['engine'] == "electric":
+                await choose_service_name("HU für E-Fahrzeuge")
+
+            elif self.data['engine'] == 'fuel':
+                await choose_service_name("HU/AU")
+
+        else:
+            await choose_service_name(self.data['service_name'][0], self.data['quantity_amount'])
+
+        if len(self.data['service_name']) > 1:
+            for i in range(1, len(self.data['target_service_group'])):
+                await self.click_any_bt(self.page.get_by_text("Service hinzufügen").first)
+                await choose_service_group(self.data['target_service_group'][i])
+
+                if self.data['target_service_group'][i] in ['Ölwechsel', 'Inspektion', 'Achsvermessung', 'Bremsen', 'Fahrwerk', 'Zahnriemen']:
+                    if not vehicle_details_filled:
+                        self.logger.info('Need to fill vehicle details first')
+                        await fill_vehicle_details()
+
+                await choose_service_name(self.data['service_name'][i], self.data['quantity_amount'])
+
+        await self.click_any_bt(self.page.locator('.btn.btn-primary.next').first)
+
+    @retry(stop=phase_stop, wait=phase_wait, reraise=True)
+    async def appointment_selection_part(self):
+        self.logger.info("\n###### Appointment Section ######\n")
+        await self.settle('appointment', self.page.locator('select[aria-label="Tagauswahl"]').first, state='attached')
+
+        async def fill_date_dropdown(select, target):
+            await self.wait_for_options(select, 'date')
+            result = await self.select_awaiting_xhr(select, target, 'contains', 'date', fallback=1)
+            if result['ok']:
+                self.logger.info("Option found %s", result['text'])
+            else:
+                self.logger.warning("Option not found %s", target)
+                self.logger.warning('Choosing first option instead, %s', result['text'])
+                self.logger.info(result['candidates'])
+            await self.settle('date')
+
+        date_selection = self.page.locator('select[aria-label="Tagauswahl"]').first
+        try:
+            await fill_date_dropdown(date_selection, self.data["target_date"])
+        except Exception:
+            self.logger.warning('Date Selection Error, keeping the default date')
+
+        await self.click_any_bt(self.page.locator(".btn.btn-primary.btn-big").first)
+
+    @retry(stop=phase_stop, wait=phase_wait, reraise=True)
+    async def your_data_section(self):
+        self.logger.info("\n###### Your Data Section ######\n")
+        await self.settle('your_data', self.page.locator("#firstName").first)
+
+        typist = self.typist()
+        for id_, value in fields_to_fill(self.data['your_data']):
+            self.logger.info('Filling %s (%s)', id_, typist.mode)
+            await typist.enter(self.page.locator(f"#{id_}").first, value)
+
+    async def offload(self, fn, *args, **kwargs):
+        """Run a blocking call (Redis, disk) on the default executor instead of the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+    async def publish(self, event, **fields):
+        await self.offload(jobs.publish, self.job_id, event, **fields)
+
+    async def run_phase(self, phase, fn):
+        await self.publish('phase_started', status='running', phase=phase)
+        self.logger.info('Phase started: %s', phase)
+        with self.pacer.timed(f'phase:{phase}'):
+            await fn()
+        await self.publish('phase_completed', phase=phase)
+
+    async def run(self, context):
+        try:
+            self.logger.info("Scraper started with data: %s", self.data)
+            # Excel/sidecar I/O stays off the event loop.
+            await self.offload(self.find_fleetlink_services)
+            self.logger.info("Starting ATU automation...")
+
+            self.asset_cache = await CachingRoute().install_async(context)
+            self.request_filter = await RequestFilter(self.data.get('block_resources')).install_async(context)
+            self.page = await context.new_page()
+
+            start_url = await self.offload(self.start_url)
+            with self.pacer.timed(f'page_load_{self.request_filter.mode}'), self.pacer.timed('phase:page_load'):
+                await self.raise_if_blocked(await self.page.goto(start_url, timeout=60000*3))
+            self.logger.info("Page loaded successfully")
+
+            await self.run_phase('branch_selection', self.branch_selection_part)
+            await self.run_phase('service_selection', self.service_selection_part)
+            await self.run_phase('appointment_selection', self.appointment_selection_part)
+            await self.run_phase('your_data', self.your_data_section)
+
+            with self.pacer.timed('phase:screenshot'):
+                captured = await screenshot_delivery.capture_async(
+                    self.page, self.screenshot_path(), self.screenshot_options)
+            self.captured_screenshot = captured
+            # The engine closes this booking's context as soon as run() returns.
+            await self.page.close()
+
+            try:
+                self.send_to_telegram(captured)
+            except Exception:
+                self.logger.warning('Failed to send result to Telegram.')
+
+            self.logger.info('Step timings: %s', self.pacer.format_summary())
+            self.logger.info('Script completed.')
+            await self.publish('done', status='done', phase='', screenshot=captured)
+
+        except Exception as e:
+            kind = failure_kind(e)
+            self.logger.error(f"Booking failed ({kind}): {e}")
+            await self.publish('error', error=f"{type(e).__name__}: {e}", kind=kind)
+            raise
+
+        finally:
+            await self.offload(self.finish_metrics)
+            self.close_logger()
+
+
+class AsyncBookingEngine:
+    """One event loop per worker process that runs up to `max_concurrency`
+    bookings at once, each in its own context of a shared browser."""
+
+    def __init__(self, browser_type='Opera', headless=True, max_concurrency=MAX_CONCURRENCY):
+        self.browser_type = browser_type
+        self.headless = headless
+        self.max_concurrency = max_concurrency
+
+        self.browser = None
+        self.driver = None
+        self._semaphore = None
+        self._browser_lock = None
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name='async-booking-engine', daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(), self.loop).result()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _setup(self):
+        # Created on the engine loop so they bind to it, not the caller's thread.
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._browser_lock = asyncio.Lock()
+
+    async def _launch(self):
+        if self.browser_type == 'Camoufox':
+            from camoufox.async_api import AsyncCamoufox
+            from camoufox import DefaultAddons
+
+            self.driver = AsyncCamoufox(exclude_addons=[DefaultAddons.UBO], humanize=True, headless=self.headless)
+            self.browser = await self.driver.start()
+            reaper.register_launched()
+            return
+
+        self.driver = await async_playwright().start()
+        opera_path = find_opera_path(engine_logger)
+        args = ['--disable-blink-features=AutomationControlled']
+        if opera_path:
+            self.browser = await self.driver.chromium.launch(
+                headless=self.headless, executable_path=opera_path, args=args + ['--enable-vpn'])
+        else:
+            engine_logger.warning("Opera path not found, Fallback to Chromium")
+            self.browser = await self.driver.chromium.launch(headless=self.headless, args=args)
+        reaper.register_launched()
+
+    async def _get_browser(self):
+        async with self._browser_lock:
+            if self.browser is None or not self.browser.is_connected():
+                await self._close_browser()
+                await self._launch()
+            return self.browser
+
+    async def _new_context(self):
+        browser = await self._get_browser()
+        if self.browser_type == 'Camoufox':
+            return await browser.new_context()
+
+        context = await browser.new_context(user_agent=USER_AGENT)
+        await context.add_init_script(INIT_SCRIPT)
+        return context
+
+    async def _close_browser(self):
+        browser, driver = self.browser, self.driver
+        self.browser = self.driver = None
+        try:
+            if browser is not None:
+                await browser.close()
+            if driver is not None:
+                if self.browser_type == 'Camoufox':
+                    await driver.__aexit__(None, None, None)
+                else:
+                    await driver.stop()
+        except Exception as e:
+            engine_logger.warning('Failed to stop async browser: %s', e)
+
+    async def run_booking(self, data, timestamp, job_id=None):
+        async with self._semaphore:
+            context = await self._new_context()
+            try:
+                await AsyncATUScraper(data, timestamp, self.browser_type, job_id).run(context)
+            finally:
+                await context.close()
+
+    def submit(self, data, timestamp, job_id=None):
+        """Schedule a booking on the engine loop; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(self.run_booking(data, timestamp, job_id), self.loop)
+
+    def shutdown(self):
+        asyncio.run_coroutine_threadsafe(self._close_browser(), self.loop).result(timeout=30)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(browser_type='Opera', headless=True):
+    key = (browser_type, headless)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _engines[key] = AsyncBookingEngine(browser_type, headless)
+    return engine
+
+
+def engine_running(browser_type='Opera', headless=True):
+    return (browser_type, headless) in _engines
+
+
+def shutdown_engines():
+    with _engines_lock:
+        engines = list(_engines.values())
+        _engines.clear()
+    for engine in engines:
+        try:
+            engine.shutdown()
+        except Exception as e:
+            engine_logger.warning('Failed to shut down async engine: %s', e)
@@ -1,35 +1,97 @@
 from dotenv import load_dotenv
-import requests
+from contextlib import contextmanager
 from datetime import datetime
 import re
-import platform
-from time import sleep
-import random
-import pandas as pd
-from playwright.sync_api import Locator, sync_playwright
+from playwright.sync_api import Error as PlaywrightError, Locator, TimeoutError as PlaywrightTimeoutError
 import os
-import sys
 import logging
 import threading
+import uuid
+from time import perf_counter
 from tenacity import *
 
+from asset_cache import CachingRoute
+from branch_directory import BRANCH_ENTRIES_JS
+import branch_directory
+from browser_pool import get_pool
+from checkpoints import CheckpointStore
+from dom_select import NEXT_FRAME_JS, OPTIONS_LOADED_JS, DomSelector, describe_miss, is_page_xhr
+from failures import (BLOCK_SELECTOR, BlockedError, BookingError, InputError, LayoutError, TransientError,
+                      blocked_reason, failure_kind, phase_stop, phase_wait)
+from fleetlink_mapping import get_mapping
+import jobs
+import metrics
+from pacing import READY_TIMEOUT_MS, Pacer
+from resource_filter import RequestFilter
+import screenshot_delivery
+from typing_engine import TypingEngine, fields_to_fill, resolve_mode
+import vehicle_catalog
+
+# Point at mock_atu_site.py to run against the local stand-in.
+ATU_BOOKING_URL = os.getenv("ATU_BOOKING_URL", "https://www.atu.de/terminvereinbarung/")
+
+# Element that shows the page has moved past a phase, used to confirm that a
+# checkpointed phase is still in effect after restoring the browser state.
+# your_data has none: the form is filled in again on every attempt.
+NEXT_PHASE_MARKERS = {
+    'branch_selection': '.more-entries, .service-name.group',
+    'service_selection': 'select[aria-label="Tagauswahl"]',
+    'appointment_selection': '#firstName',
+}
+
+DATE_SELECT = 'select[aria-label="Tagauswahl"]'
+DATE_PATTERN = re.compile(r'\d{2}\.\d{2}\.\d{4}')
+# Time slots shown for the selected day, read by availability runs.
+SLOT_SELECTOR = os.getenv('ATU_SLOT_SELECTOR', 'select[aria-label="Uhrzeitauswahl"] option')
+AVAILABILITY_MAX_DAYS = int(os.getenv('AVAILABILITY_MAX_DAYS', '7'))
+
 
 class ATUScraper:
-    def __init__(self, data, timestamp, browser_type):
+    def __init__(self, data, timestamp, browser_type, job_id=None):
         self.data = data
         self.timestamp = timestamp
+        self.job_id = job_id
         self.browser = None 
         self.page = None
         self.playwright = None
+        self.lease = None
+        self.request_filter = None
+        self.asset_cache = None
 
         self.thread_id = threading.get_ident()
 
+        # Bad options are the request's fault: never worth a retry.
+        try:
+            self.pacer = Pacer(data.get('pacing'))
+            self.typing_mode = resolve_mode(data, self.pacer)
+            self.screenshot_options = screenshot_delivery.capture_options(data)
+        except ValueError as e:
+            raise InputError(str(e)) from e
+
         self.logger = self.setup_logger()
+        if job_id:
+            # Read by the log search index (log_search.py)
+            self.logger.info('Job: %s', job_id)
+        # Keyed by job: timestamps only have second resolution and batch
+        # timestamps repeat across batches. A run without a job ID never resumes.
+        self.checkpoints = CheckpointStore(job_id or f'{timestamp}-{uuid.uuid4().hex}', self.logger)
+        self.filled_fields = set()
         self.input_file = "./fleetlink_id_mapping.xlsx"
 
         self.BROWSER_TYPE = browser_type
         self.HEADLESS = True
 
+        # None keeps each choice's own matching (exact / normalized); "fuzzy" relaxes them all.
+        self.match_mode = data.get('match_mode')
+        self.dom = None
+        # Branch URL the page was opened with (from the branch cache), if any.
+        self.preselected_branch = None
+        # True when the page was opened at the branch page of an earlier attempt.
+        self.resumed_branch_page = False
+        # The file the screenshot was written to. A WebP is captured as PNG and
+        # converted by the uploader, which then reports the final path.
+        self.captured_screenshot = None
+
     def setup_logger(self):
         os.makedirs("logs", exist_ok=True)
         os.makedirs("screenshots", exist_ok=True)
@@ -37,12 +99,11 @@ class ATUScraper:
         # thread_id = threading.get_ident()
         log_file = f"logs/run-{self.timestamp}.log"
 
-        logger = logging.getLogger(f'scraper-{self.thread_id}')
+        # One logger per scraper: bookings of a batch share a thread, and a
+        # finished booking may still log while the next one runs.
+        logger = logging.getLogger(f'scraper-{self.thread_id}-{id(self):x}')
         logger.setLevel(logging.INFO)
 
-        if logger.hasHandlers():
-            logger.handlers.clear()
-
         file_handler = logging.FileHandler(log_file)
         console_handler = logging.StreamHandler()
         
@@ -55,77 +116,142 @@ class ATUScraper:
 
         return logger
 
+    def close_logger(self):
+        """Close the log file; pool processes run many jobs and must not keep their descriptors."""
+        for handler in list(self.logger.handlers):
+            handler.close()
+            self.logger.removeHandler(handler)
+        logging.Logger.manager.loggerDict.pop(self.logger.name, None)
+
     def launch_driver(self, browser_type, headless):
         self.logger.info('Launching driver...')
-        if browser_type == 'Camoufox':
+        self.lease = get_pool(browser_type, headless).acquire(
+            self.logger, storage_state=self.checkpoints.latest_storage_state())
+        self.pacer.record('browser_acquire_cold' if self.lease.cold else 'browser_acquire_warm',
+                          self.lease.acquire_seconds)
+        if self.lease.cold:
+            self.pacer.record('browser_cold_launch', self.lease.pool.last_cold_launch_seconds)
+        # Routes run in reverse registration order: the filter sees each
+        # request first and falls back to the shared asset cache.
+        self.asset_cache = CachingRoute().install(self.lease.context)
+        self.request_filter = RequestFilter(self.data.get('block_resources')).install(self.lease.context)
+        page = self.lease.context.new_page()
+        return page, self.lease.browser, self.lease.playwright
+
+    def finish_metrics(self):
+        if self.request_filter is not None:
+            self.logger.info('Request filter: %s', self.request_filter.summary())
+            self.request_filter.record_metrics()
+        if self.asset_cache is not None:
+            self.logger.info('Asset cache: %s', self.asset_cache.summary())
+            self.asset_cache.record_metrics()
+        metrics.record_timings(self.pacer.timings)
+
+    def close_driver(self):
+        """Close the page and hand the context back to the pool; never raises.
+
+        A context that cannot be closed takes its browser and driver down with
+        it (see BrowserPool.release).
+        """
+        lease, page = self.lease, self.page
+        self.lease = self.page = self.browser = self.playwright = None
+        if page is not None:
             try:
-                from camoufox.sync_api import Camoufox
-                from camoufox import DefaultAddons
-            except ImportError:
-                self.logger.warning(
-                    "Camoufox library is not installed. Please ensure it is installed before running this code.")
-
-            browser = Camoufox(exclude_addons=[DefaultAddons.UBO], humanize=True, headless=headless).start()
-            page = browser.new_page()
-
-        elif browser_type == 'Opera':
-            playwright = sync_playwright().start()
-            opera_path = self.find_opera_path()
-
-            if not opera_path:
-                self.logger.warning(f"Opera path not found, Fallback to Chromium")
-                browser_type = 'Chromium'
-                browser = playwright.chromium.launch(
-                    headless=headless, args=['--disable-blink-features=AutomationControlled'])
+                page.close()
+            except Exception as e:
+                self.logger.warning('Failed to close page: %s', e)
+        if lease is not None:
+            lease.release()
+
+    @contextmanager
+    def closing(self):
+        """Release the browser session however the block is left."""
+        try:
+            yield self
+        finally:
+            self.close_driver()
+            self.finish_metrics()
+
+    def wait_ready(self, locator=None, state='visible'):
+        """Wait for `locator` to reach `state`, or for the network to go idle."""
+        try:
+            if locator is not None:
+                locator.wait_for(state=state, timeout=READY_TIMEOUT_MS)
             else:
-                browser = playwright.chromium.launch(headless=headless, executable_path=opera_path, args=[
-                    '--disable-blink-features=AutomationControlled', '--enable-vpn'])
-
-            context = browser.new_context(
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 OPR/106.0.0.0'
-            )
-            context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-            page = context.new_page()
-
-        self.logger.info('Browser Type: %s', browser_type)
-        return page, browser, playwright
-
-    def find_opera_path(self):
-        system = platform.system()
-        possible_paths = []
-
-        if system == 'Windows':
-            possible_paths = [
-                r"C:\Users\{}\AppData\Local\Programs\Opera\opera.exe".format(os.getenv('USERNAME')),
-                r"C:\Program Files\Opera\opera.exe",
-                r"C:\Program Files (x86)\Opera\opera.exe",
-            ]
-        elif system == 'Linux':
-            possible_paths = [
-                "/usr/bin/opera",
-                "/usr/local/bin/opera",
-                "/snap/bin/opera",  # If installed via Snap
-            ]
-
-        for path in possible_paths:
-            if os.path.exists(path):
-                self.logger.info(f"Opera path found: {path}")
-                return path
-
-        self.logger.warning("Opera path not found")
-        return None
-
-    def wait_random(self, min_sec=1, max_sec=3):
-        sleep(random.uniform(min_sec, max_sec))
+                self.page.wait_for_load_state('networkidle', timeout=READY_TIMEOUT_MS)
+        except PlaywrightTimeoutError:
+            self.raise_if_blocked()
+            self.logger.info('Readiness wait timed out, continuing')
+
+    def raise_if_blocked(self, response=None):
+        """Raise BlockedError if the page (or the response that loaded it) is a bot wall."""
+        try:
+            reason = blocked_reason(response.status if response is not None else None,
+                                    self.page.title(), self.page.locator(BLOCK_SELECTOR).count() > 0)
+        except PlaywrightError:
+            return
+        if reason:
+            self.logger.error('Blocked by the site: %s', reason)
+            raise BlockedError(f'Blocked by the site: {reason}')
+
+    def settle(self, step, locator=None, state='visible'):
+        """Wait for the page to be ready, then add the profile's jitter for `step`."""
+        with self.pacer.timed(f'wait:{step}'):
+            self.wait_ready(locator, state)
+            self.pacer.pause(step)
+
+    def wait_for_options(self, select, step):
+        """Wait until `select` is enabled and has options besides its placeholder.
+
+        wait_ready() without a locator returns at once on a loaded page, so it
+        cannot tell when an XHR has filled a select.
+        """
+        with self.pacer.timed(f'wait:{step}_options'):
+            try:
+                select.wait_for(state='attached', timeout=READY_TIMEOUT_MS)
+                self.page.wait_for_function(OPTIONS_LOADED_JS, arg=select.element_handle(), timeout=READY_TIMEOUT_MS)
+            except PlaywrightTimeoutError:
+                self.logger.info('Options of %s did not load in time, continuing', step)
+
+    def select_awaiting_xhr(self, select, target, mode, step, fallback=None):
+        """select_option(), then wait for the XHR the selection triggers to be answered and rendered."""
+        selected = False
+        try:
+            with self.pacer.timed(f'wait:{step}_xhr'):
+                with self.page.expect_response(lambda r: is_page_xhr(r, self.page.url),
+                                               timeout=READY_TIMEOUT_MS) as response:
+                    result = self.selector().select_option(select, target, mode, fallback=fallback)
+                    if result['index'] < 0:
+                        # Nothing was selected, so no XHR is coming.
+                        if len(result['candidates']) <= 1:
+                            raise TransientError(f"Options did not load for {target}")
+                        raise LayoutError(f"Option not found: {target}")
+                    selected = True
+                response.value.finished()
+                self.page.evaluate(NEXT_FRAME_JS)
+        except PlaywrightTimeoutError:
+            if not selected:
+                raise
+            self.logger.info('No XHR after selecting %s, continuing', target)
+        return result
+
+    def typist(self):
+        return TypingEngine(self.page, self.pacer, self.typing_mode)
+
+    def selector(self):
+        if self.dom is None or self.dom.page is not self.page:
+            self.dom = DomSelector(self.page)
+        return self.dom
 
     def click_any_bt(self, elem: Locator):
-        for _ in range(4):
+        for attempt in range(4):
             try:
-                sleep(random.uniform(1, 3))
-                elem.wait_for(state='visible', timeout=5000*3)
-                elem.click()
+                self.pacer.pause('click')
+                with self.pacer.timed('click_attempt' if attempt == 0 else 'click_retry'):
+                    elem.wait_for(state='visible', timeout=5000*3)
+                    elem.click()
                 self.logger.info('Clicked: %s', elem)
-                sleep(random.uniform(1, 3))
+                self.settle('click')
                 return
             except:
                 self.logger.warning('Failed to click bt. Retrying... %s', elem)
@@ -135,29 +261,37 @@ class ATUScraper:
         text = re.sub(r'\s+', ' ', text)
         return text
 
-    def fill_input_dropdown(self, select, target):
-        selector_options = select.locator('option').all_text_contents()
-        self.logger.info(selector_options)
+    def fill_input_dropdown(self, select, target, catalog_path=None):
+        # Option texts only come back from the page when the vehicle catalog lacks this list.
+        collect = catalog_path is not None and vehicle_catalog.options(catalog_path) is None
+        # Model and year are filled by the XHR of the selection above them.
+        self.wait_for_options(select, 'dropdown')
+        result = self.selector().select_option(select, target, self.match_mode or 'exact', collect=collect)
+        if catalog_path is not None and (collect or not result['ok']):
+            vehicle_catalog.record(catalog_path, result['candidates'])
 
-        try:
-            index = selector_options.index(target)
-        except ValueError:
+        if not result['ok']:
             self.logger.warning("Option not found: %s", target)
-            sys.exit()
-
-        selector_target = selector_options[index]
-        self.logger.info(selector_target)
-        select.select_option(selector_target)
-        self.wait_random(2, 6)
-
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=2, min=2, max=10),
-        # before=before_log(self.logger, logging.WARNING),
-        reraise=True
-    )
+            self.logger.warning(describe_miss(target, result))
+            if len(result['candidates']) <= 1:
+                # Only the placeholder: the list's XHR has not answered yet.
+                raise TransientError(f"Options did not load in the dropdown for {target}")
+            raise InputError(f"Option not found: {target}")
+
+        self.logger.info(result['text'])
+        self.settle('dropdown')
+        return result['text']
+
+    @retry(stop=phase_stop, wait=phase_wait, reraise=True)
     def branch_selection_part(self):
-        self.wait_random(2, 5)
+        if self.resumed_branch_page:
+            # The branch page of the earlier attempt did not keep the branch
+            self.resumed_branch_page = False
+            self.page.goto(ATU_BOOKING_URL, timeout=60000*3)
+        elif self.preselected_branch and self.branch_preselected():
+            return
+
+        self.settle('branch', self.page.locator("#locationSearchInput").first)
         try:
             self.click_any_bt(self.page.locator("button:has-text('Alle akzeptieren')").first)
             self.logger.info("Cookies accepted")
@@ -166,12 +300,7 @@ class ATUScraper:
 
         self.logger.info("\n###### Branch Selection ######\n")
         location_input = self.page.locator("#locationSearchInput").first
-        location_input.click()
-        self.page.keyboard.press('Control+a')
-
-        for char in self.data['pin_code']:
-            self.page.keyboard.type(char)
-            sleep(random.uniform(0.1, 0.5))
+        self.typist().enter(location_input, self.data['pin_code'])
 
         self.logger.info('Waiting for branch entries to load...')
         branch_loaded = False
@@ -182,62 +311,109 @@ class ATUScraper:
                 self.page.locator('.branch-list-entry').first.wait_for(state='visible', timeout=30000*3)
                 self.logger.info('Branch entries loaded successfully!')
                 branch_loaded = True
-                sleep(0.5)
+                self.pacer.pause('branch_loaded')
                 break
-            except TimeoutError:
+            except PlaywrightTimeoutError:
+                self.raise_if_blocked()
                 self.logger.warning('Branch entries did not loaded. Retrying...')
 
         if not branch_loaded:
-            self.logger.warning('Exiting the Script...')
-            sys.exit()
+            raise TransientError(f"Branch entries did not load for {self.data['pin_code']}")
+
+        entries = self.page.locator('.branch-list-entry')
+        branches = None
+        try:
+            branches = entries.evaluate_all(BRANCH_ENTRIES_JS)
+            self.logger.info('Branches for %s: %s', self.data['pin_code'], [b['name'] for b in branches])
+        except Exception as e:
+            self.logger.warning('Could not read branch entries: %s', e)
 
-        self.click_any_bt(self.page.locator('.branch-list-entry').first)
+        self.click_any_bt(entries.first)
+        if branches:
+            branch_directory.record(self.data['pin_code'], branches, self.selected_branch_url())
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=2, min=2, max=10),
-        # before=before_log(self.logger, logging.WARNING),
-        reraise=True
-    )
+    def selected_branch_url(self):
+        """The URL the site moved to with the branch selected, or None when it stayed on the search page."""
+        try:
+            self.page.locator(NEXT_PHASE_MARKERS['branch_selection']).first.wait_for(
+                state='visible', timeout=READY_TIMEOUT_MS)
+        except PlaywrightTimeoutError:
+            return None
+        url = self.page.url
+        return url if url.rstrip('/') != ATU_BOOKING_URL.rstrip('/') else None
+
+    def start_url(self):
+        """The branch page of an earlier attempt, the cached branch's direct URL for
+        this PIN code, or the booking page to search from."""
+        url = self.checkpoints.state('branch_selection').get('url')
+        if url and url.rstrip('/') != ATU_BOOKING_URL.rstrip('/'):
+            self.logger.info('Resuming at the branch page of an earlier attempt: %s', url)
+            self.resumed_branch_page = True
+            return url
+        self.preselected_branch = branch_directory.start_url(self.data['pin_code'])
+        return self.preselected_branch or ATU_BOOKING_URL
+
+    def branch_preselected(self):
+        """True if the page opened from start_url() already has the branch selected."""
+        url, self.preselected_branch = self.preselected_branch, None
+        try:
+            self.page.locator("button:has-text('Alle akzeptieren')").first.click(timeout=5000)
+        except Exception:
+            pass
+
+        try:
+            self.page.locator(NEXT_PHASE_MARKERS['branch_selection']).first.wait_for(state='visible', timeout=10000)
+            self.logger.info('Branch preselected from the branch cache')
+            metrics.incr('atu_branch_preselect_total', result='ok')
+            return True
+        except PlaywrightTimeoutError:
+            self.logger.warning('Cached branch URL did not select the branch, searching instead')
+            metrics.incr('atu_branch_preselect_total', result='failed')
+            # Denied first, so the search below does not record it again
+            branch_directory.deny(url)
+            branch_directory.invalidate(self.data['pin_code'])
+            self.page.goto(ATU_BOOKING_URL, timeout=60000*3)
+            return False
+
+    @retry(stop=phase_stop, wait=phase_wait, reraise=True)
     def service_selection_part(self):
         self.logger.info("\n###### Service Selection ######\n")
-        self.wait_random(3, 6)
+        self.settle('service', self.page.locator('.more-entries').first)
         self.click_any_bt(self.page.locator('.more-entries').first)
         vehicle_details_filled = False
 
-        def choose_service_group(service_G_name):
-            nonlocal vehicle_details_filled
+        dom = self.selector()
 
-            services_group_list = self.page.locator('.service-name.group').all()
-            services_group_name = self.page.locator('.service-name.group').all_text_contents()
-            self.logger.info(services_group_name)
+        def choose_service_group(service_G_name):
             self.logger.info(f'Choosing service group: {service_G_name}')
 
-            try:
-                n = services_group_name.index(service_G_name)
-            except:
+            result = dom.click(dom.locator('.service-name.group'), service_G_name, self.match_mode or 'exact')
+            if not result['ok']:
                 self.logger.error(f"Service name not found: {service_G_name}")
-                sys.exit()
+                self.logger.error(describe_miss(service_G_name, result))
+                if not result['candidates']:
+                    raise LayoutError('No service groups on the page')
+                raise InputError(f"Service group not found: {service_G_name}")
 
-            services_group_list[n].click()
-            self.wait_random(2, 5)
+            # The group's service list is rendered after the click.
+            self.settle('service_group', dom.locator('.service-list').last)
 
         def fill_vehicle_details():
             nonlocal vehicle_details_filled
             self.logger.info('\nService page type 1')
-            self.wait_random(2, 3)
+            self.settle('vehicle', self.page.locator("select").nth(2), state='attached')
 
-            input_field = self.page.locator("select").all()
-            manufacturer = input_field[0]
-            model = input_field[1]
-            year = input_field[2]
+            input_field = dom.locator("select")
+            manufacturer = input_field.nth(0)
+            model = input_field.nth(1)
+            year = input_field.nth(2)
 
-            self.fill_input_dropdown(manufacturer, self.data["target_manufacturer"])
-            self.fill_input_dropdown(model, self.data["target_model"])
-            self.fill_input_dropdown(year, self.data["target_year"])
+            chosen_manufacturer = self.fill_input_dropdown(manufacturer, self.data["target_manufacturer"], ())
+            chosen_model = self.fill_input_dropdown(model, self.data["target_model"], (chosen_manufacturer,))
+            self.fill_input_dropdown(year, self.data["target_year"], (chosen_manufacturer, chosen_model))
 
             self.click_any_bt(self.page.get_by_text("Speichern und weiter").first)
-            self.wait_random(3, 6)
+            self.settle('vehicle_saved', self.page.locator('.service-list').first)
             vehicle_details_filled = True
 
         target_service_group = self.data["target_service_group"][0]
@@ -246,26 +422,20 @@ class ATUScraper:
         if target_service_group in ['Ölwechsel', 'Inspektion', 'Achsvermessung', 'Bremsen', 'Fahrwerk', 'Zahnriemen']:
             fill_vehicle_details()
 
+        # Services of the group added last are in the last .service-list
+        service_names = dom.locator('.service-list').last.locator('h3.service-name')
+
         def choose_service_name(s_name, qty=1):
-            services_page = self.page.locator('.service-list').all()
-            self.logger.info(len(services_page))
             self.logger.info('Service page type 2')
+            self.logger.info(f'Choosing service: {s_name}')
 
             try:
-                service_list = services_page[-1].locator('h3.service-name').all()
-                s_list = services_page[-1].locator('h3.service-name').all_text_contents()
-                self.logger.info(s_list)
-                self.logger.info(f'Choosing service: {s_name}')
-
-                for n, s in enumerate(s_list):
-                    if self.clean_text(s) == self.clean_text(s_name):
-                        self.logger.info(f"Selecting: {n}, {s}")
-                        break
+                result = dom.click(service_names, s_name, self.match_mode or 'normalized', fallback=0)
+                if result['ok']:
+                    self.logger.info(f"Selecting: {result['index']}, {result['text']}")
                 else:
-                    n = 0
                     self.logger.warning(f"Name not found, Selecting first service...")
-
-                service_list[n].click()
+                    self.logger.warning(describe_miss(s_name, result))
             except:
                 self.logger.error("Service name not found")
 
@@ -279,7 +449,7 @@ class ATUScraper:
                 pass
 
             self.click_any_bt(self.page.locator('.btn.btn-primary.btn-addService').first)
-            self.wait_random(2, 5)
+            self.settle('add_service')
 
         # Case 1: Service Group - HU/AU
         if target_service_group == 'HU/AU':
@@ -305,34 +475,24 @@ class ATUScraper:
                 choose_service_name(self.data['service_name'][i], self.data['quantity_amount'])
 
         self.click_any_bt(self.page.locator('.btn.btn-primary.next').first)
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=2, min=2, max=10),
-        # before=before_log(self.logger, logging.WARNING),
-        reraise=True
-    )
+    @retry(stop=phase_stop, wait=phase_wait, reraise=True)
     def appointment_selection_part(self):
         self.logger.info("\n###### Appointment Section ######\n")
-        self.wait_random(4, 6)
+        self.settle('appointment', self.page.locator('select[aria-label="Tagauswahl"]').first, state='attached')
 
         def fill_date_dropdown(select, target):
-            selector_options = select.locator('option').all_text_contents()
-            self.logger.info(selector_options)
-
-            for opt in selector_options:
-                if target in opt:
-                    self.logger.info("Option found %s", opt)
-                    index = selector_options.index(opt)
-                    break
+            self.wait_for_options(select, 'date')
+            # Time slots for the chosen day are loaded by an XHR.
+            result = self.select_awaiting_xhr(select, target, 'contains', 'date', fallback=1)
+            if result['ok']:
+                self.logger.info("Option found %s", result['text'])
             else:
-                index = 1
                 self.logger.warning("Option not found %s", target)
-                self.logger.warning('Choosing first option instead, %s', selector_options[index])
-
-            selector_target = selector_options[index]
-            self.logger.info(selector_target)
-            select.select_option(selector_target)
-            self.wait_random(5, 10)
+                self.logger.warning('Choosing first option instead, %s', result['text'])
+                self.logger.info(result['candidates'])
+                jobs.publish(self.job_id, 'date_unavailable', target_date=target, chosen=result['text'],
+                             available=[t for t in result['candidates'] if DATE_PATTERN.search(t)])
+            self.settle('date')
 
         date_selection = self.page.locator('select[aria-label="Tagauswahl"]').first
         try:
@@ -341,108 +501,303 @@ class ATUScraper:
             self.logger.warning('Date Selection Error, keeping the default date')
 
         self.click_any_bt(self.page.locator(".btn.btn-primary.btn-big").first)
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=2, min=2, max=10),
-        # before=before_log(self.logger, logging.WARNING),
-        reraise=True
-    )
+    @retry(stop=phase_stop, wait=phase_wait, reraise=True)
     def your_data_section(self):
         self.logger.info("\n###### Your Data Section ######\n")
-        self.wait_random(2, 4)
-
-        for id_, value in self.data['your_data'].items():
-            self.logger.info('Filling %s', id_)
-            location_input = self.page.locator(f"#{id_}").first
-            location_input.click()
-            self.page.keyboard.press('Control+a')
-
-            for char in value:
-                self.page.keyboard.type(char)
-                sleep(random.uniform(0.1, 0.4))
+        self.settle('your_data', self.page.locator("#firstName").first)
+
+        typist = self.typist()
+        for id_, value in fields_to_fill(self.data['your_data']):
+            if id_ in self.filled_fields:
+                # Filled before a retry of this section; the page still has it.
+                continue
+            self.logger.info('Filling %s (%s)', id_, typist.mode)
+            typist.enter(self.page.locator(f"#{id_}").first, value)
+            self.filled_fields.add(id_)
+
+    def read_availability(self, max_days=AVAILABILITY_MAX_DAYS):
+        """Dates offered at the appointment step and the time slots of the first `max_days`."""
+        date_selection = self.page.locator(DATE_SELECT).first
+        self.settle('appointment', date_selection, state='attached')
+        self.wait_for_options(date_selection, 'date')
+
+        dates = [t.strip() for t in date_selection.locator('option').all_text_contents() if DATE_PATTERN.search(t)]
+        slots = {}
+        for text in dates[:max_days]:
+            # The texts were stripped above; the options' own text may not be.
+            # A date that cannot be selected raises instead of reading the
+            # slots of whichever day is still selected.
+            self.select_awaiting_xhr(date_selection, text, 'normalized', 'date')
+            self.settle('date')
+            times = [s.strip() for s in self.page.locator(SLOT_SELECTOR).all_text_contents() if s.strip()]
+            slots[DATE_PATTERN.search(text).group(0)] = times
+            self.logger.info('%s: %d slots', text, len(times))
+
+        return {'dates': [DATE_PATTERN.search(t).group(0) for t in dates], 'slots': slots}
+
+    def check_availability(self):
+        """Read-only run: branch and services, then the offered dates and slots. Books nothing."""
+        try:
+            with self.closing():
+                self.logger.info("Availability check with data: %s", self.data)
+                self.find_fleetlink_services()
+
+                self.page, self.browser, self.playwright = self.launch_driver(self.BROWSER_TYPE, self.HEADLESS)
+                with self.pacer.timed('phase:page_load'):
+                    self.raise_if_blocked(self.page.goto(self.start_url(), timeout=60000*3))
+                for phase, fn in (('branch_selection', self.branch_selection_part),
+                                  ('service_selection', self.service_selection_part)):
+                    jobs.publish(self.job_id, 'phase_started', status='running', phase=phase)
+                    self.logger.info('Phase started: %s', phase)
+                    with self.pacer.timed(f'phase:{phase}'):
+                        fn()
+
+                with self.pacer.timed('phase:availability'):
+                    result = self.read_availability()
+                self.logger.info('Available dates: %s', result['dates'])
+                return result
+        finally:
+            self.close_logger()
 
     def find_fleetlink_services(self):
-        df = pd.read_excel(self.input_file)
-        df.dropna(subset=["FleetLink ID"], inplace=True)
         fleetlink_found = False
 
         self.logger.info(f"FleetLink ID : {self.data['id_target']}")
 
-        for id_ in self.data["id_target"]:
-            for index, row in df.iterrows():
-                fleetlink_id = row["FleetLink ID"]
-                if fleetlink_id:
-                    if isinstance(fleetlink_id, str):
-                        fleetlink_id = [int(_.replace('?', '')) for _ in fleetlink_id.split("|")]
-                    elif isinstance(fleetlink_id, int):
-                        fleetlink_id = [fleetlink_id]
-
-                if id_ in fleetlink_id:
-                    self.data['target_service_group'].append(row["Service Gruppe"].strip())
-                    self.data['service_name'].append(row["ATU Service"].strip())
+        try:
+            services = get_mapping(self.input_file).lookup(self.data["id_target"])
+        except (TypeError, ValueError) as e:
+            raise InputError(f"Invalid FleetLink ID: {self.data['id_target']}") from e
+        for service_group, atu_service in services:
+            self.data['target_service_group'].append(service_group)
+            self.data['service_name'].append(atu_service)
 
-                    self.logger.info(
-                        f"Row {index+2:<4} | Service Gruppe: {row['Service Gruppe']:<20} | ATU Service: {row['ATU Service']}")
-                    fleetlink_found = True
+            self.logger.info(f"Service Gruppe: {service_group:<20} | ATU Service: {atu_service}")
+            fleetlink_found = True
 
         if not fleetlink_found:
             self.logger.error("Service not found for FleetLink ID: %s", self.data["id_target"])
-            sys.exit(1)
-
-    def send_to_telegram(self, image_path):
-        TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
-        CHAT_ID = '5469717358'
-        url = f'https://api.telegram.org/bot{TOKEN}/sendPhoto'
-
-        with open(image_path, 'rb') as photo:
-            files = {'photo': photo}
-            data = {'chat_id': CHAT_ID, 'caption': str(self.timestamp) }
-            r = requests.post(url, files=files, data=data)
-            print(r.json())
-
-    def run(self):
+            raise InputError(f"Service not found for FleetLink ID: {self.data['id_target']}")
+
+        missing = vehicle_catalog.missing_fields(self.data['target_service_group'], self.data)
+        if missing:
+            raise InputError(f"Missing for the requested services: {', '.join(missing)}")
+
+    def resolve_services(self):
+        """FleetLink IDs -> services, taken from the checkpoint on a retry."""
+        if self.checkpoints.done('services'):
+            state = self.checkpoints.state('services')
+            self.data['target_service_group'] = state['target_service_group']
+            self.data['service_name'] = state['service_name']
+            self.logger.info('Services restored from checkpoint: %s', state['service_name'])
+            self.checkpoints.record_skip('services')
+            return
+
+        start = perf_counter()
+        self.find_fleetlink_services()
+        self.checkpoints.save('services', perf_counter() - start, {
+            'target_service_group': self.data['target_service_group'],
+            'service_name': self.data['service_name'],
+        })
+
+    def phase_state(self, phase):
+        """What a retry restores from a phase's checkpoint besides the browser storage.
+
+        The branch is restored by opening the page it was selected on (see
+        start_url); the services have their own checkpoint (resolve_services).
+        Vehicle and personal details only exist in the page: a retry whose
+        page kept them skips the phase, otherwise it fills them in again.
+        """
+        if phase == 'branch_selection':
+            return {'url': self.page.url}
+        return {}
+
+    def can_skip(self, phase):
+        marker = NEXT_PHASE_MARKERS.get(phase)
+        if not self.checkpoints.done(phase) or marker is None:
+            return False
         try:
-            self.logger.info("Scraper started with data: %s", self.data)
-            self.find_fleetlink_services()
-            self.logger.info("Starting ATU automation...")
-
-            self.page, self.browser, self.playwright = self.launch_driver(self.BROWSER_TYPE, self.HEADLESS)
-
-            self.page.goto("https://www.atu.de/terminvereinbarung/", timeout=60000*3)
-            self.logger.info("Page loaded successfully")
-
-            self.branch_selection_part()
-            self.service_selection_part()
-            self.appointment_selection_part()
-            self.your_data_section()
-
-            # Full-page screenshot
-            self.page.screenshot(path=f"screenshots/{self.timestamp}.png", full_page=True)
-            
+            self.page.locator(marker).first.wait_for(state='visible', timeout=3000)
+            return True
+        except PlaywrightTimeoutError:
+            self.logger.info('Checkpoint for %s found, but the page did not keep it', phase)
+            return False
+
+    def run_phase(self, phase, fn):
+        if self.can_skip(phase):
+            saved = self.checkpoints.record_skip(phase)
+            self.logger.info('Skipping %s, completed in an earlier attempt (saves %.1fs)', phase, saved)
+            jobs.publish(self.job_id, 'phase_skipped', phase=phase)
+            return
+
+        jobs.publish(self.job_id, 'phase_started', status='running', phase=phase)
+        self.logger.info('Phase started: %s', phase)
+        start = perf_counter()
+        with self.pacer.timed(f'phase:{phase}'):
+            fn()
+        seconds = perf_counter() - start
+        self.checkpoints.save(phase, seconds, self.phase_state(phase), self.lease.context.storage_state())
+        jobs.publish(self.job_id, 'phase_completed', phase=phase, seconds=round(seconds, 2))
+
+    def screenshot_path(self):
+        return screenshot_delivery.screenshot_path(self.timestamp, self.screenshot_options)
+
+    def send_to_telegram(self, captured_path):
+        """Queue the screenshot for background upload; returns immediately."""
+        screenshot_delivery.get_uploader().submit(
+            captured_path, self.screenshot_path(), str(self.timestamp), self.screenshot_options, self.job_id)
+
+    def open_session(self):
+        """Launch a browser context, load the booking page and select the branch."""
+        self.page, self.browser, self.playwright = self.launch_driver(self.BROWSER_TYPE, self.HEADLESS)
+
+        start = perf_counter()
+        with self.pacer.timed('phase:page_load'):
+            self.raise_if_blocked(self.page.goto(self.start_url(), timeout=60000*3))
+        # Filtered vs. unfiltered (control) page loads, to see what blocking saves
+        self.pacer.record(f'page_load_{self.request_filter.mode}', perf_counter() - start)
+        self.logger.info("Page loaded successfully")
+
+        self.run_phase('branch_selection', self.branch_selection_part)
+
+    def adopt_session(self, previous):
+        """Take over the page of a finished booking at the same branch.
+
+        Returns False when the page could not be brought back to service
+        selection; the caller then opens a fresh session.
+        """
+        self.page, self.browser, self.playwright, self.lease = (
+            previous.page, previous.browser, previous.playwright, previous.lease)
+        previous.page = previous.browser = previous.playwright = previous.lease = None
+
+        self.logger.info('Reusing browser session of %s', previous.timestamp)
+        with self.pacer.timed('phase:return_to_services'):
+            if self.return_to_service_selection():
+                return True
+
+        self.logger.warning('Could not return to service selection, starting a new session')
+        self.close_driver()
+        return False
+
+    def return_to_service_selection(self):
+        services = self.page.locator('.more-entries, .service-name.group').first
+        for _ in range(4):
             try:
-                self.send_to_telegram(f'./screenshots/{self.timestamp}.png')
-            except:
-                self.logger.warning('Failed to send result to Telegram.')
+                services.wait_for(state='visible', timeout=5000)
+                return True
+            except PlaywrightTimeoutError:
+                self.page.go_back(wait_until='domcontentloaded')
+        return False
+
+    def book(self):
+        """Services, appointment and personal data on a page that has a branch selected."""
+        self.run_phase('service_selection', self.service_selection_part)
+        self.run_phase('appointment_selection', self.appointment_selection_part)
+        self.run_phase('your_data', self.your_data_section)
+
+        with self.pacer.timed('phase:screenshot'):
+            captured = screenshot_delivery.capture(self.page, self.screenshot_path(), self.screenshot_options)
+        self.captured_screenshot = captured
+
+        # Upload runs on the uploader threads, so the caller can close the browser right away.
+        try:
+            self.send_to_telegram(captured)
+        except:
+            self.logger.warning('Failed to send result to Telegram.')
 
-            self.logger.info('Script completed.')
-            self.page.close()
+        self.logger.info('Step timings: %s', self.pacer.format_summary())
 
-            # Close the browser
-            self.browser.close()
-            self.playwright.stop()
+    def run(self, resume=False):
+        """Book; `resume` (a retry of the same job) skips the phases checkpointed by earlier attempts."""
+        try:
+            # The browser goes back to the worker's pool on every way out
+            with self.closing():
+                self.logger.info("Scraper started with data: %s", self.data)
+                if resume:
+                    self.checkpoints.load()
+                self.resolve_services()
+                self.logger.info("Starting ATU automation...")
 
+                self.open_session()
+                self.book()
+                self.checkpoints.clear()
+                self.logger.info('Script completed.')
 
-        except RetryError as e:
-            self.logger.error(f"Retry limit exceeded: {e}")
-            if hasattr(self, 'page') and self.page:
-                self.page.close()
-            sys.exit(1)
+            jobs.publish(self.job_id, 'done', status='done', phase='', screenshot=self.captured_screenshot)
 
         except Exception as e:
-            self.logger.error(f"Unhandled exception: {e}")
-            if hasattr(self, 'page') and self.page:
-                self.page.close()
-            sys.exit(1)
+            # The caller (tasks.retry_or_fail) decides on a retry from the failure kind
+            kind = failure_kind(e)
+            self.logger.error(f"Booking failed ({kind}): {e}")
+            jobs.publish(self.job_id, 'error', error=f"{type(e).__name__}: {e}", kind=kind)
+            raise
+
+        finally:
+            self.close_logger()
+
+
+def run_batch(bookings, browser_type):
+    """Run [(data, timestamp, job_id), ...] for one branch in a single browser session.
+
+    After each booking the page goes back to service selection instead of
+    reloading the booking site and searching the branch again. A failed
+    booking drops the session; the next one starts a fresh one.
+    """
+    results = []
+    previous = None
+    scraper = None
+
+    try:
+        for data, timestamp, job_id in bookings:
+            scraper = None
+            try:
+                scraper = ATUScraper(data, timestamp, browser_type, job_id)
+            except Exception as e:
+                # Bad pacing, typing or screenshot options fail this booking
+                # only; the session of the previous one stays usable.
+                logging.getLogger(__name__).error('Booking %s could not be set up: %r', job_id or timestamp, e)
+                results.append({'timestamp': timestamp, 'job_id': job_id, 'status': 'failed', 'error': repr(e),
+                                'kind': failure_kind(e)})
+                continue
+
+            try:
+                jobs.publish(job_id, 'started', status='running')
+                scraper.logger.info("Scraper started with data: %s", scraper.data)
+                scraper.resolve_services()
+
+                if previous is None or not scraper.adopt_session(previous):
+                    scraper.open_session()
+                scraper.book()
+                scraper.checkpoints.clear()
+                scraper.logger.info('Script completed.')
+
+                results.append({'timestamp': timestamp, 'job_id': job_id, 'status': 'done'})
+                scraper.finish_metrics()
+                jobs.publish(job_id, 'done', status='done', phase='', screenshot=scraper.captured_screenshot)
+                if previous is not None:
+                    previous.close_logger()
+                previous = scraper
+
+            except Exception as e:
+                scraper.logger.error(f"Booking failed: {e!r}")
+                scraper.close_driver()
+                if previous is not None:
+                    # Failed before taking over the session (e.g. resolving
+                    # services): the previous booking still holds the page.
+                    previous.close_driver()
+                    previous.close_logger()
+                results.append({'timestamp': timestamp, 'job_id': job_id, 'status': 'failed', 'error': repr(e),
+                                'kind': failure_kind(e)})
+                scraper.finish_metrics()
+                scraper.close_logger()
+                previous = None
+    finally:
+        # The session ends with the batch, also when a time limit interrupts it
+        for owner in (previous, scraper):
+            if owner is not None:
+                owner.close_driver()
+                owner.close_logger()
+    return results
 
 
 load_dotenv()
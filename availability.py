@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+import metrics
+from redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+AVAILABILITY_TTL = int(os.getenv('AVAILABILITY_TTL_SECONDS', '300'))
+# Beat interval of the background refresh and how many of the most requested
+# (branch, services) pairs it keeps warm.
+REFRESH_SECONDS = int(os.getenv('AVAILABILITY_REFRESH_SECONDS', '120'))
+REFRESH_TOP = int(os.getenv('AVAILABILITY_REFRESH_TOP', '10'))
+# An entry older than this share of its TTL is refreshed ahead of expiry.
+REFRESH_AHEAD = 0.5
+# At most one availability run per query at a time.
+LOCK_SECONDS = 600
+QUERY_TTL = 24 * 3600
+
+# What an availability run depends on: the branch, the services and what
+# the service selection asks for (vehicle, engine).
+QUERY_FIELDS = ('pin_code', 'id_target', 'target_manufacturer', 'target_model', 'target_year', 'engine')
+
+POPULAR_KEY = 'availability:popular'
+
+
+def make_query(data):
+    query = {field: data.get(field) for field in QUERY_FIELDS if data.get(field) not in (None, '')}
+    ids = query.get('id_target')
+    if ids is not None:
+        query['id_target'] = sorted(ids if isinstance(ids, list) else [ids], key=str)
+    return query
+
+
+def query_key(query):
+    digest = hashlib.sha1(json.dumps(query, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return f"{query.get('pin_code', '')}:{digest}"
+
+
+def booking_data(query):
+    """Booking payload that drives ATUScraper up to the appointment step."""
+    return dict(query, target_service_group=[], service_name=[], quantity_amount='1', target_date='',
+                your_data={})
+
+
+def get(query):
+    """Cached availability with its age in seconds, or None."""
+    try:
+        raw = get_redis().get(f'availability:{query_key(query)}')
+    except Exception as e:
+        logger.warning('Could not read availability cache: %s', e)
+        return None
+    if not raw:
+        return None
+    entry = json.loads(raw)
+    entry['age'] = round(time.time() - entry['checked_at'], 1)
+    return entry
+
+
+def store(query, result):
+    entry = dict(result, checked_at=time.time())
+    get_redis().set(f'availability:{query_key(query)}', json.dumps(entry), ex=AVAILABILITY_TTL)
+    return entry
+
+
+def note_request(query):
+    """Count a request, so the refresh knows which queries are worth keeping warm."""
+    key = query_key(query)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.zincrby(POPULAR_KEY, 1, key)
+        pipe.set(f'availability:query:{key}', json.dumps(query), ex=QUERY_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning('Could not count availability request: %s', e)
+
+
+def claim(query):
+    """True if the caller may start an availability run for this query."""
+    return bool(get_redis().set(f'availability:lock:{query_key(query)}', '1', nx=True, ex=LOCK_SECONDS))
+
+
+def extend_lock(query, seconds):
+    """Keep the query locked through a retry that starts in `seconds`."""
+    try:
+        get_redis().expire(f'availability:lock:{query_key(query)}', int(seconds) + LOCK_SECONDS)
+    except Exception as e:
+        logger.warning('Could not extend availability lock: %s', e)
+
+
+def release(query):
+    try:
+        get_redis().delete(f'availability:lock:{query_key(query)}')
+    except Exception as e:
+        logger.warning('Could not release availability lock: %s', e)
+
+
+def queries_to_refresh(limit=REFRESH_TOP):
+    """The most requested queries whose cache entry is missing or past REFRESH_AHEAD of its TTL.
+
+    Request counts are halved on every call, so popularity follows recent traffic.
+    """
+    r = get_redis()
+    keys = r.zrevrange(POPULAR_KEY, 0, limit - 1)
+    pipe = r.pipeline()
+    pipe.zunionstore(POPULAR_KEY, {POPULAR_KEY: 0.5})
+    pipe.zremrangebyscore(POPULAR_KEY, '-inf', 0.1)
+    pipe.execute()
+
+    due = []
+    for key in keys:
+        raw = r.get(f'availability:query:{key}')
+        if not raw:
+            continue
+        query = json.loads(raw)
+        entry = get(query)
+        if entry is None or entry['age'] > AVAILABILITY_TTL * REFRESH_AHEAD:
+            due.append(query)
+    metrics.incr('atu_availability_refreshes_total', len(due))
+    return due
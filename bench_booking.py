@@ -0,0 +1,192 @@
+# bench_booking.py
+# End-to-end throughput benchmark: N bookings against the local mock ATU site
+# (mock_atu_site.py) at a chosen concurrency, one prefork-like worker process
+# per slot. Reports jobs/min, per-phase p50/p95 and peak RSS.
+#
+#   python bench_booking.py --bookings 20 --concurrency 4 --pacing fast
+#   python bench_booking.py --bookings 50 --concurrency 8 --latency-ms 400 --failure-rate 0.05 --json out.json
+#
+# Redis is optional: without it job events and metrics are skipped with a warning.
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+from datetime import date, timedelta
+from time import perf_counter
+
+import psutil
+
+
+def sample_booking(pacing):
+    return {
+        "pin_code": "64347",
+        "id_target": [26],
+        "target_service_group": [],
+        "service_name": [],
+        "target_manufacturer": "FORD",
+        "target_model": "KA",
+        "target_year": "2011",
+        "quantity_amount": "1",
+        "target_date": (date.today() + timedelta(days=3)).strftime('%d.%m.%Y'),
+        "engine": "electric",
+        "pacing": pacing,
+        "your_data": {
+            "firstName": "Bench",
+            "lastName": "Mark",
+            "email": "bench@example.com",
+            "mobile": "11111111111",
+            "licensePlate": "B BM 1",
+        },
+    }
+
+
+def start_mock_site(port, latency_ms, jitter_ms, failure_rate):
+    from werkzeug.serving import make_server
+    import mock_atu_site
+
+    mock_atu_site.CONFIG.update(latency_ms=latency_ms, jitter_ms=jitter_ms, failure_rate=failure_rate)
+    server = make_server('127.0.0.1', port, mock_atu_site.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_booking(job):
+    """One booking in a pool process; the process keeps its pooled browser between bookings."""
+    from atu_scraper import ATUScraper
+
+    index, data, browser_type, run_id = job
+    scraper = ATUScraper(json.loads(json.dumps(data)), f'bench-{run_id}-{index:04d}', browser_type)
+    start = perf_counter()
+    try:
+        scraper.run()
+        ok = True
+    except Exception:
+        ok = False
+    return {'ok': ok, 'seconds': perf_counter() - start, 'timings': scraper.pacer.timings}
+
+
+class RssSampler:
+    """Peak RSS of this process and all its children (pool processes and their browsers)."""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        me = psutil.Process()
+        total = me.memory_info().rss
+        for child in me.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._sample())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(results, wall_seconds, peak_rss):
+    phases = {}
+    for result in results:
+        for step, samples in result['timings'].items():
+            if step.startswith('phase:'):
+                phases.setdefault(step[len('phase:'):], []).extend(samples)
+
+    succeeded = [r for r in results if r['ok']]
+    job_seconds = [r['seconds'] for r in succeeded]
+    return {
+        'bookings': len(results),
+        'succeeded': len(succeeded),
+        'failed': len(results) - len(succeeded),
+        'wall_seconds': round(wall_seconds, 2),
+        'jobs_per_minute': round(len(succeeded) / wall_seconds * 60, 2) if wall_seconds else 0,
+        'job_p50': round(percentile(job_seconds, 0.5), 3),
+        'job_p95': round(percentile(job_seconds, 0.95), 3),
+        'phases': {name: {'p50': round(percentile(s, 0.5), 3), 'p95': round(percentile(s, 0.95), 3), 'n': len(s)}
+                   for name, s in sorted(phases.items())},
+        'peak_rss_mb': round(peak_rss / (1024 * 1024), 1),
+    }
+
+
+def print_report(summary):
+    print(f"bookings:     {summary['bookings']} ({summary['succeeded']} ok, {summary['failed']} failed)")
+    print(f"wall time:    {summary['wall_seconds']:.1f}s")
+    print(f"throughput:   {summary['jobs_per_minute']:.2f} jobs/min")
+    print(f"job time:     p50 {summary['job_p50']:.2f}s   p95 {summary['job_p95']:.2f}s")
+    print(f"peak RSS:     {summary['peak_rss_mb']:.0f} MB")
+    print(f"{'phase':<24}{'p50':>10}{'p95':>10}{'n':>6}")
+    for name, stats in summary['phases'].items():
+        print(f"{name:<24}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['n']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end booking benchmark against the mock ATU site')
+    parser.add_argument('--bookings', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=2)
+    parser.add_argument('--pacing', default='fast')
+    parser.add_argument('--browser', default='Opera', help='Opera falls back to Chromium when not installed')
+    parser.add_argument('--url', help='booking URL of an already running mock site')
+    parser.add_argument('--port', type=int, default=0, help='port for the embedded mock site (0: any free port)')
+    parser.add_argument('--latency-ms', type=float, default=200)
+    parser.add_argument('--jitter-ms', type=float, default=100)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--json', help='also write the summary to this file')
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        url = args.url
+    else:
+        server = start_mock_site(args.port, args.latency_ms, args.jitter_ms, args.failure_rate)
+        url = f'http://127.0.0.1:{server.server_port}/terminvereinbarung/'
+    # Read by atu_scraper at import time in the pool processes.
+    os.environ['ATU_BOOKING_URL'] = url
+    print(f'Benchmarking {args.bookings} bookings at concurrency {args.concurrency} against {url}')
+
+    run_id = time.strftime('%Y%m%d-%H%M%S')
+    booking = sample_booking(args.pacing)
+    jobs = [(i, booking, args.browser, run_id) for i in range(args.bookings)]
+
+    context = multiprocessing.get_context('spawn')
+    with RssSampler() as sampler:
+        start = perf_counter()
+        with context.Pool(args.concurrency) as pool:
+            results = pool.map(run_booking, jobs, chunksize=1)
+        wall_seconds = perf_counter() - start
+
+    summary = summarize(results, wall_seconds, sampler.peak)
+    summary.update(concurrency=args.concurrency, pacing=args.pacing, latency_ms=args.latency_ms,
+                   failure_rate=args.failure_rate)
+    print_report(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
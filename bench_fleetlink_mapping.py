@@ -0,0 +1,80 @@
+# bench_fleetlink_mapping.py
+# Micro-benchmark: old per-job Excel scan vs. the in-memory FleetLink index.
+#
+#   python bench_fleetlink_mapping.py --runs 50 --ids 26 70 69
+import argparse
+import os
+import tempfile
+from time import perf_counter
+
+import pandas as pd
+
+from fleetlink_mapping import DEFAULT_MAPPING_FILE, FleetLinkMapping
+
+
+def old_lookup(path, ids):
+    """The lookup as ATUScraper.find_fleetlink_services used to do it."""
+    df = pd.read_excel(path)
+    df.dropna(subset=["FleetLink ID"], inplace=True)
+    services = []
+
+    for id_ in ids:
+        for index, row in df.iterrows():
+            fleetlink_id = row["FleetLink ID"]
+            if fleetlink_id:
+                if isinstance(fleetlink_id, str):
+                    fleetlink_id = [int(_.replace('?', '')) for _ in fleetlink_id.split("|")]
+                elif isinstance(fleetlink_id, int):
+                    fleetlink_id = [fleetlink_id]
+                else:
+                    fleetlink_id = [int(fleetlink_id)]
+
+            if id_ in fleetlink_id:
+                services.append((row["Service Gruppe"].strip(), row["ATU Service"].strip()))
+    return services
+
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = perf_counter()
+        fn()
+        samples.append(perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2], samples[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--file', default=DEFAULT_MAPPING_FILE)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--ids', type=int, nargs='+', default=[26])
+    args = parser.parse_args()
+
+    sidecar = os.path.join(tempfile.mkdtemp(), 'mapping.index.json')
+
+    expected = old_lookup(args.file, args.ids)
+    assert FleetLinkMapping(args.file, sidecar).lookup(args.ids) == expected, "index disagrees with old lookup"
+
+    def cold_without_sidecar():
+        scratch = sidecar + '.scratch'
+        if os.path.exists(scratch):
+            os.remove(scratch)
+        FleetLinkMapping(args.file, scratch).lookup(args.ids)
+
+    results = {
+        'old (read_excel + iterrows)': timed(lambda: old_lookup(args.file, args.ids), args.runs),
+        'cold, no sidecar (openpyxl)': timed(cold_without_sidecar, args.runs),
+        'cold, sidecar hit': timed(lambda: FleetLinkMapping(args.file, sidecar).lookup(args.ids), args.runs),
+    }
+    warm = FleetLinkMapping(args.file, sidecar)
+    warm.lookup(args.ids)
+    results['warm, in-memory'] = timed(lambda: warm.lookup(args.ids), args.runs * 100)
+
+    print(f"ids={args.ids} matches={len(expected)}")
+    for name, (p50, worst) in results.items():
+        print(f"{name:<30} p50={p50 * 1000:9.3f} ms   max={worst * 1000:9.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import logging
+import os
+
+import metrics
+from redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+BRANCH_TTL = int(os.getenv('BRANCH_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+BRANCH_CACHE_ENABLED = os.getenv('BRANCH_CACHE_ENABLED', '1') == '1'
+
+# A branch URL whose preselect failed is not used or recorded again for this long.
+DENY_TTL = int(os.getenv('BRANCH_DENY_TTL_SECONDS', str(7 * 24 * 3600)))
+
+# URL that opens the booking with a branch already selected, for entries
+# without a confirmed URL. Placeholders: {branch_id}, {pin_code}.
+BRANCH_URL_TEMPLATE = os.getenv('ATU_BRANCH_URL') or None
+
+# Branch list entries as shown after a PIN search, in page order. `href` is
+# only the first link in the entry and is never opened; an entry's `url` is
+# set once the site itself navigated there with the branch selected.
+BRANCH_ENTRIES_JS = """entries => entries.map(e => {
+    const link = e.querySelector('a[href]') || e.closest('a[href]');
+    const data = Object.assign({}, e.dataset);
+    return {
+        id: data.branchId || data.id || data.storeId || e.id || null,
+        name: (e.innerText || e.textContent || '').trim().split('\\n')[0].trim(),
+        href: link ? link.href : null,
+        data: data,
+    };
+})"""
+
+
+def _key(pin_code):
+    return f'branches:{pin_code}'
+
+
+def lookup(pin_code):
+    """Ordered branch list seen for this PIN code, or None."""
+    if not BRANCH_CACHE_ENABLED:
+        return None
+    try:
+        raw = get_redis().get(_key(pin_code))
+    except Exception as e:
+        logger.warning('Could not read branch cache for %s: %s', pin_code, e)
+        return None
+    return json.loads(raw) if raw else None
+
+
+def record(pin_code, branches, confirmed_url=None):
+    """Store the branch list; `confirmed_url` is the page the site showed with the first branch selected."""
+    if not branches:
+        return
+    if confirmed_url and not denied(confirmed_url):
+        branches[0]['url'] = confirmed_url
+    try:
+        get_redis().set(_key(pin_code), json.dumps(branches), ex=BRANCH_TTL)
+    except Exception as e:
+        logger.warning('Could not store branches for %s: %s', pin_code, e)
+
+
+def _deny_key(url):
+    return f"branches:denied:{hashlib.sha1(url.encode('utf-8')).hexdigest()}"
+
+
+def deny(url):
+    """Remember that `url` did not come up with its branch selected."""
+    try:
+        get_redis().set(_deny_key(url), '1', ex=DENY_TTL)
+    except Exception as e:
+        logger.warning('Could not deny branch URL %s: %s', url, e)
+
+
+def denied(url):
+    try:
+        return bool(get_redis().exists(_deny_key(url)))
+    except Exception as e:
+        logger.warning('Could not check branch URL %s: %s', url, e)
+        return True
+
+
+def invalidate(pin_code):
+    try:
+        get_redis().delete(_key(pin_code))
+    except Exception as e:
+        logger.warning('Could not drop branch cache for %s: %s', pin_code, e)
+
+
+def branch_url(branch, pin_code):
+    if branch.get('url'):
+        return branch['url']
+    if BRANCH_URL_TEMPLATE and branch.get('id'):
+        return BRANCH_URL_TEMPLATE.format(branch_id=branch['id'], pin_code=pin_code)
+    return None
+
+
+def start_url(pin_code):
+    """Direct URL of the first cached branch for this PIN code, or None (search instead)."""
+    branches = lookup(pin_code)
+    if not branches:
+        metrics.incr('atu_branch_cache_total', result='miss')
+        return None
+    url = branch_url(branches[0], pin_code)
+    if url and denied(url):
+        metrics.incr('atu_branch_cache_total', result='denied')
+        return None
+    metrics.incr('atu_branch_cache_total', result='hit' if url else 'no_url')
+    return url
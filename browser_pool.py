@@ -0,0 +1,245 @@
+import atexit
+import logging
+import os
+import platform
+from time import perf_counter
+
+import psutil
+
+import reaper
+
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 OPR/106.0.0.0'
+INIT_SCRIPT = "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+
+# Recycle the browser after this many jobs or once its process tree grows past this RSS.
+MAX_JOBS = int(os.getenv('BROWSER_POOL_MAX_JOBS', '25'))
+MAX_RSS_MB = int(os.getenv('BROWSER_POOL_MAX_RSS_MB', '1500'))
+# Set BROWSER_POOL_ENABLED=0 to get the old launch-per-job behaviour back.
+POOL_ENABLED = os.getenv('BROWSER_POOL_ENABLED', '1') == '1'
+
+
+def find_opera_path(log=logger):
+    system = platform.system()
+    possible_paths = []
+
+    if system == 'Windows':
+        possible_paths = [
+            r"C:\Users\{}\AppData\Local\Programs\Opera\opera.exe".format(os.getenv('USERNAME')),
+            r"C:\Program Files\Opera\opera.exe",
+            r"C:\Program Files (x86)\Opera\opera.exe",
+        ]
+    elif system == 'Linux':
+        possible_paths = [
+            "/usr/bin/opera",
+            "/usr/local/bin/opera",
+            "/snap/bin/opera",  # If installed via Snap
+        ]
+
+    for path in possible_paths:
+        if os.path.exists(path):
+            log.info(f"Opera path found: {path}")
+            return path
+
+    log.warning("Opera path not found")
+    return None
+
+
+def process_tree_rss(pid=None):
+    """RSS in bytes of every child of this process (Playwright driver + browser processes)."""
+    total = 0
+    try:
+        children = psutil.Process(pid or os.getpid()).children(recursive=True)
+    except psutil.Error:
+        return 0
+    for child in children:
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+class BrowserLease:
+    """One job's view of the pooled browser: its own isolated BrowserContext."""
+
+    def __init__(self, pool, context, acquire_seconds, cold, log=logger):
+        self.pool = pool
+        self.log = log
+        self.context = context
+        self.acquire_seconds = acquire_seconds
+        self.cold = cold
+        self.released = False
+
+    @property
+    def browser(self):
+        return self.pool.browser
+
+    @property
+    def playwright(self):
+        return self.pool.driver
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.pool.release(self, self.log)
+
+
+class BrowserPool:
+    """A long-lived browser per worker process that hands out a fresh context per job."""
+
+    def __init__(self, browser_type, headless, max_jobs=MAX_JOBS, max_rss_mb=MAX_RSS_MB):
+        self.browser_type = browser_type
+        self.headless = headless
+        self.max_jobs = max_jobs if POOL_ENABLED else 1
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024
+
+        self.browser = None
+        self.driver = None
+        self.launched_type = None
+        self.jobs_served = 0
+        self.last_cold_launch_seconds = None
+
+    def launch(self, log=logger):
+        start = perf_counter()
+        browser_type = self.browser_type
+
+        if browser_type == 'Camoufox':
+            try:
+                from camoufox.sync_api import Camoufox
+                from camoufox import DefaultAddons
+            except ImportError:
+                log.warning(
+                    "Camoufox library is not installed. Please ensure it is installed before running this code.")
+
+            driver = Camoufox(exclude_addons=[DefaultAddons.UBO], humanize=True, headless=self.headless)
+            browser = driver.start()
+
+        else:
+            from playwright.sync_api import sync_playwright
+
+            driver = sync_playwright().start()
+            opera_path = find_opera_path(log)
+
+            if not opera_path:
+                log.warning(f"Opera path not found, Fallback to Chromium")
+                browser_type = 'Chromium'
+                browser = driver.chromium.launch(
+                    headless=self.headless, args=['--disable-blink-features=AutomationControlled'])
+            else:
+                browser = driver.chromium.launch(headless=self.headless, executable_path=opera_path, args=[
+                    '--disable-blink-features=AutomationControlled', '--enable-vpn'])
+
+        self.browser, self.driver, self.launched_type = browser, driver, browser_type
+        reaper.register_launched()
+        self.jobs_served = 0
+        self.last_cold_launch_seconds = perf_counter() - start
+        log.info('Browser Type: %s (cold launch %.2fs)', browser_type, self.last_cold_launch_seconds)
+
+    def new_context(self, storage_state=None):
+        if self.browser_type == 'Camoufox':
+            return self.browser.new_context(storage_state=storage_state)
+
+        context = self.browser.new_context(user_agent=USER_AGENT, storage_state=storage_state)
+        context.add_init_script(INIT_SCRIPT)
+        return context
+
+    def rss_bytes(self):
+        return process_tree_rss()
+
+    def acquire(self, log=logger, storage_state=None):
+        start = perf_counter()
+        cold = False
+
+        if self.browser is None:
+            self.launch(log)
+            cold = True
+
+        try:
+            context = self.new_context(storage_state)
+        except Exception:
+            # Opening a context is the health check: is_connected() and version
+            # are cached on our side and pass for a hung browser. Retry once on a fresh one.
+            log.warning('Could not open a context on the pooled browser, relaunching')
+            self.shutdown(log)
+            self.launch(log)
+            cold = True
+            context = self.new_context(storage_state)
+
+        acquire_seconds = perf_counter() - start
+        log.info('Browser acquired in %.2fs (%s, cold launch %.2fs)',
+                 acquire_seconds, 'cold' if cold else 'warm', self.last_cold_launch_seconds or 0)
+        return BrowserLease(self, context, acquire_seconds, cold, log)
+
+    def release(self, lease, log=logger):
+        # Size of the browser at the end of a job, for memory admission (admission.py)
+        from admission import learn_browser_rss
+        learn_browser_rss(self.browser_type, self.rss_bytes())
+
+        try:
+            lease.context.close()
+        except Exception as e:
+            # Whatever keeps the context open would leak with it; start over.
+            log.warning('Failed to close browser context, shutting the browser down: %s', e)
+            self.shutdown(log)
+            return
+
+        self.jobs_served += 1
+        if self.jobs_served >= self.max_jobs:
+            log.info('Recycling browser after %d jobs', self.jobs_served)
+            self.shutdown(log)
+        elif self.rss_bytes() > self.max_rss_bytes:
+            log.info('Recycling browser, RSS above %d MB', self.max_rss_bytes // (1024 * 1024))
+            self.shutdown(log)
+
+    def shutdown(self, log=logger):
+        browser, driver = self.browser, self.driver
+        self.browser = self.driver = None
+
+        if browser is not None:
+            try:
+                browser.close()
+            except Exception as e:
+                log.warning('Failed to close browser: %s', e)
+        if driver is not None:
+            try:
+                if self.browser_type == 'Camoufox':
+                    driver.__exit__(None, None, None)
+                else:
+                    driver.stop()
+            except Exception as e:
+                log.warning('Failed to stop Playwright driver: %s', e)
+
+
+_pools = {}
+
+
+def get_pool(browser_type, headless):
+    key = (browser_type, headless)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = _pools[key] = BrowserPool(browser_type, headless)
+    return pool
+
+
+def is_warm(browser_type, headless=True):
+    """True if this process already has a running browser of that type."""
+    pool = _pools.get((browser_type, headless))
+    return pool is not None and pool.browser is not None
+
+
+def shutdown_pools():
+    for pool in list(_pools.values()):
+        pool.shutdown()
+
+
+def _forget_pools_after_fork():
+    # A forked child must not touch the parent's Playwright connection.
+    _pools.clear()
+
+
+atexit.register(shutdown_pools)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pools_after_fork)
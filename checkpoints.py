@@ -0,0 +1,77 @@
+import json
+import logging
+import time
+
+import metrics
+from redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_TTL = 24 * 3600
+
+
+class CheckpointStore:
+    """Completed booking phases of one job, kept in Redis across Celery retries.
+
+    Each phase entry holds its wall time, the state a retry needs to restore
+    (the services, the branch page) and the browser storage state at that point.
+    Redis being unavailable never fails a booking; it only disables resuming.
+    `job_key` must be unique per job (the job ID), never the run timestamp.
+    """
+
+    def __init__(self, job_key, log=logger):
+        self.key = f'checkpoint:{job_key}'
+        self.log = log
+        self.phases = {}
+
+    def load(self):
+        try:
+            raw = get_redis().hgetall(self.key)
+        except Exception as e:
+            self.log.warning('Could not load checkpoints: %s', e)
+            raw = {}
+        self.phases = {phase: json.loads(value) for phase, value in raw.items()}
+        return self.phases
+
+    def save(self, phase, seconds, state=None, storage_state=None):
+        entry = {
+            'completed_at': time.time(),
+            'seconds': seconds,
+            'state': state or {},
+            'storage_state': storage_state,
+        }
+        self.phases[phase] = entry
+        try:
+            pipe = get_redis().pipeline()
+            pipe.hset(self.key, phase, json.dumps(entry))
+            pipe.expire(self.key, CHECKPOINT_TTL)
+            pipe.execute()
+        except Exception as e:
+            self.log.warning('Could not save checkpoint %s: %s', phase, e)
+
+    def done(self, phase):
+        return phase in self.phases
+
+    def state(self, phase):
+        return self.phases.get(phase, {}).get('state', {})
+
+    def latest_storage_state(self):
+        entries = [entry for entry in self.phases.values() if entry.get('storage_state')]
+        if not entries:
+            return None
+        return max(entries, key=lambda entry: entry['completed_at'])['storage_state']
+
+    def record_skip(self, phase):
+        """Count a phase a retry did not have to redo, and the time that saved."""
+        seconds = self.phases.get(phase, {}).get('seconds', 0)
+        metrics.incr('atu_checkpoint_phases_skipped_total', phase=phase)
+        metrics.incr('atu_checkpoint_seconds_saved_total', seconds, phase=phase)
+        return seconds
+
+    def clear(self):
+        try:
+            get_redis().delete(self.key)
+        except Exception:
+            pass
+        self.phases = {}
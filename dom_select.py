@@ -0,0 +1,180 @@
+import os
+from urllib.parse import urlsplit
+
+from pacing import READY_TIMEOUT_MS
+
+
+# "native": the match is found in one evaluate() and clicked with a real
+# Playwright click (trusted input events). "dom": match and element.click()
+# in the same evaluate(), one round trip but an untrusted click event.
+CLICK_MODE = os.getenv('DOM_CLICK_MODE', 'native')
+
+FUZZY_THRESHOLD = float(os.getenv('DOM_FUZZY_THRESHOLD', '0.8'))
+
+MATCH_MODES = ('exact', 'normalized', 'contains', 'fuzzy')
+
+# Shared matcher. `texts` are the candidates; modes:
+#   exact       text === target
+#   normalized  clean_text() equality (commas/dots dropped, whitespace collapsed)
+#   contains    target is a substring of the text
+#   fuzzy       exact, then normalized, then best bigram similarity >= threshold
+_MATCH_JS = """
+function normalize(t) {
+    return (t || '').replace(/[,.]/g, '').replace(/\\s+/g, ' ').trim();
+}
+function bigrams(t) {
+    t = normalize(t).toLowerCase();
+    const grams = [];
+    for (let i = 0; i < t.length - 1; i++) grams.push(t.slice(i, i + 2));
+    return grams;
+}
+function similarity(a, b) {
+    const x = bigrams(a), y = bigrams(b);
+    if (!x.length || !y.length) return normalize(a).toLowerCase() === normalize(b).toLowerCase() ? 1 : 0;
+    const pool = new Map();
+    for (const g of y) pool.set(g, (pool.get(g) || 0) + 1);
+    let common = 0;
+    for (const g of x) {
+        const n = pool.get(g) || 0;
+        if (n) { common++; pool.set(g, n - 1); }
+    }
+    return 2 * common / (x.length + y.length);
+}
+function findMatch(texts, target, mode, threshold) {
+    const exact = texts.indexOf(target);
+    if (mode === 'exact') return {index: exact, score: exact >= 0 ? 1 : 0};
+    if (mode === 'contains') {
+        const i = texts.findIndex(t => t.includes(target));
+        return {index: i, score: i >= 0 ? 1 : 0};
+    }
+    const norm = normalize(target);
+    const n = texts.findIndex(t => normalize(t) === norm);
+    if (mode === 'normalized') return {index: n, score: n >= 0 ? 1 : 0};
+    if (exact >= 0) return {index: exact, score: 1};
+    if (n >= 0) return {index: n, score: 1};
+    let best = -1, bestScore = 0;
+    texts.forEach((t, i) => {
+        const s = similarity(t, target);
+        if (s > bestScore) { best = i; bestScore = s; }
+    });
+    return {index: bestScore >= threshold ? best : -1, score: bestScore, best: best};
+}
+"""
+
+SELECT_OPTION_JS = "(select, args) => {" + _MATCH_JS + """
+    const texts = Array.from(select.options).map(o => o.textContent);
+    let m = findMatch(texts, args.target, args.mode, args.threshold);
+    const matched = m.index >= 0;
+    let index = m.index;
+    if (!matched && args.fallback !== null && args.fallback < texts.length) index = args.fallback;
+    if (index >= 0) {
+        select.selectedIndex = index;
+        select.dispatchEvent(new Event('input', {bubbles: true}));
+        select.dispatchEvent(new Event('change', {bubbles: true}));
+    }
+    return {ok: matched, index: index, text: index >= 0 ? texts[index] : null, score: m.score,
+            closest: m.best !== undefined && m.best >= 0 ? texts[m.best] : null,
+            candidates: matched && !args.collect ? [] : texts};
+}"""
+
+MATCH_ELEMENTS_JS = "(elements, args) => {" + _MATCH_JS + """
+    const texts = elements.map(e => e.textContent);
+    let m = findMatch(texts, args.target, args.mode, args.threshold);
+    const matched = m.index >= 0;
+    let index = m.index;
+    if (!matched && args.fallback !== null && args.fallback < texts.length) index = args.fallback;
+    if (index >= 0 && args.click) elements[index].click();
+    return {ok: matched, index: index, text: index >= 0 ? texts[index] : null, score: m.score,
+            closest: m.best !== undefined && m.best >= 0 ? texts[m.best] : null,
+            candidates: matched && !args.collect ? [] : texts};
+}"""
+
+
+# Readiness signals for selects filled by an XHR: the select is usable and has
+# more than its placeholder option; and a frame has been rendered after the
+# XHR response, so its handler has written the DOM.
+OPTIONS_LOADED_JS = "select => !select.disabled && select.options.length > 1"
+NEXT_FRAME_JS = "() => new Promise(resolve => requestAnimationFrame(() => setTimeout(resolve)))"
+
+
+def is_page_xhr(response, page_url):
+    """True for an XHR/fetch response from the page's own origin."""
+    return (response.request.resource_type in ('xhr', 'fetch')
+            and urlsplit(response.url).netloc == urlsplit(page_url).netloc)
+
+
+def describe_miss(target, result):
+    """One log line explaining why nothing matched `target`."""
+    message = f"No match for {target!r} among {len(result['candidates'])} options"
+    if result.get('closest'):
+        message += f" (closest: {result['closest']!r}, score {result['score']:.2f})"
+    if result['index'] >= 0:
+        message += f", falling back to {result['text']!r}"
+    return message + f": {result['candidates']}"
+
+
+class DomSelector:
+    """Find-and-select / find-and-click in a single evaluate() per choice.
+
+    Locators are cached per selector, so repeated choices (extra service
+    groups, more services) reuse the same Locator objects.
+    """
+
+    def __init__(self, page, click_mode=CLICK_MODE, threshold=FUZZY_THRESHOLD):
+        self.page = page
+        self.click_mode = click_mode
+        self.threshold = threshold
+        self._locators = {}
+
+    def locator(self, selector):
+        loc = self._locators.get(selector)
+        if loc is None:
+            loc = self._locators[selector] = self.page.locator(selector)
+        return loc
+
+    def _args(self, target, mode, fallback, click=False, collect=False):
+        return {'target': target, 'mode': mode, 'fallback': fallback,
+                'threshold': self.threshold, 'click': click, 'collect': collect}
+
+    def select_option(self, select, target, mode='exact', fallback=None, collect=False):
+        """Select the <option> of `select` matching `target`; returns the match diagnostics.
+
+        With `collect`, every option text comes back in `candidates` even on a match.
+        """
+        return select.evaluate(SELECT_OPTION_JS, self._args(target, mode, fallback, collect=collect))
+
+    def click(self, elements, target, mode='exact', fallback=None):
+        """Click the element of `elements` whose text matches `target`.
+
+        evaluate_all() does not wait, so the list is first given until
+        READY_TIMEOUT_MS to render; a list that never does comes back as a miss.
+        """
+        from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+        try:
+            elements.first.wait_for(state='attached', timeout=READY_TIMEOUT_MS)
+        except PlaywrightTimeoutError:
+            pass
+        dom_click = self.click_mode == 'dom'
+        result = elements.evaluate_all(MATCH_ELEMENTS_JS, self._args(target, mode, fallback, dom_click))
+        if result['index'] >= 0 and not dom_click:
+            elements.nth(result['index']).click()
+        return result
+
+
+class AsyncDomSelector(DomSelector):
+    async def select_option(self, select, target, mode='exact', fallback=None, collect=False):
+        return await select.evaluate(SELECT_OPTION_JS, self._args(target, mode, fallback, collect=collect))
+
+    async def click(self, elements, target, mode='exact', fallback=None):
+        from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+        try:
+            await elements.first.wait_for(state='attached', timeout=READY_TIMEOUT_MS)
+        except PlaywrightTimeoutError:
+            pass
+        dom_click = self.click_mode == 'dom'
+        result = await elements.evaluate_all(MATCH_ELEMENTS_JS, self._args(target, mode, fallback, dom_click))
+        if result['index'] >= 0 and not dom_click:
+            await elements.nth(result['index']).click()
+        return result
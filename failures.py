@@ -0,0 +1,131 @@
+import asyncio
+import logging
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class BookingError(Exception):
+    """A booking failure whose class decides how it is retried (see POLICIES)."""
+    kind = 'unknown'
+
+
+class InputError(BookingError):
+    """The booking asks for something the site does not offer: an unmapped
+    FleetLink ID, an unknown vehicle or service group. Retrying cannot help."""
+    kind = 'input'
+
+
+class LayoutError(BookingError):
+    """Elements the scraper relies on are missing; the site layout probably changed."""
+    kind = 'layout'
+
+
+class TransientError(BookingError):
+    """Network trouble or a page that did not come up in time."""
+    kind = 'transient'
+
+
+class BlockedError(BookingError):
+    """The site answered with a bot challenge, an access-denied page or HTTP 403/429."""
+    kind = 'blocked'
+
+
+# Per failure kind: attempts of a phase inside one browser session, Celery
+# retries of the whole booking, and the first delay (seconds) of their
+# exponential backoffs. A blocked session is not hammered again but gets a
+# fresh browser context much later.
+POLICIES = {
+    'input': {'phase_attempts': 1, 'task_retries': 0, 'phase_backoff': 0, 'task_backoff': 0},
+    'layout': {'phase_attempts': 2, 'task_retries': 0, 'phase_backoff': 2, 'task_backoff': 0},
+    'transient': {'phase_attempts': 3, 'task_retries': 3, 'phase_backoff': 2, 'task_backoff': 10},
+    'blocked': {'phase_attempts': 1, 'task_retries': 2, 'phase_backoff': 0, 'task_backoff': 300},
+    'unknown': {'phase_attempts': 3, 'task_retries': 3, 'phase_backoff': 2, 'task_backoff': 10},
+}
+PHASE_MAX_BACKOFF = 10
+TASK_MAX_BACKOFF = 1800
+
+# What every failure got before failures were told apart; the difference is
+# counted in atu_retries_avoided_total.
+BASELINE_PHASE_ATTEMPTS = 3
+BASELINE_TASK_RETRIES = 3
+
+# Playwright errors that mean the network or the browser connection failed.
+NETWORK_MARKERS = ('net::ERR_', 'NS_ERROR_', 'has been closed', 'Connection closed')
+
+# Signs of an anti-bot wall.
+BLOCK_STATUSES = (403, 429)
+BLOCK_SELECTOR = 'iframe[src*="captcha"], .g-recaptcha, .h-captcha, #challenge-form, #cf-challenge-running'
+BLOCK_TITLES = ('access denied', 'attention required', 'just a moment', 'captcha', 'zugriff verweigert')
+
+
+def failure_kind(exc):
+    if isinstance(exc, BookingError):
+        return exc.kind
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return 'transient'
+    try:
+        from playwright.sync_api import Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+    except ImportError:
+        return 'unknown'
+    if isinstance(exc, PlaywrightTimeoutError):
+        return 'transient'
+    if isinstance(exc, PlaywrightError) and any(marker in str(exc) for marker in NETWORK_MARKERS):
+        return 'transient'
+    return 'unknown'
+
+
+def blocked_reason(status=None, title='', challenge=False):
+    """Why a page looks like a bot wall, or None."""
+    if status in BLOCK_STATUSES:
+        return f'HTTP {status}'
+    if challenge:
+        return 'challenge element on the page'
+    title = (title or '').lower()
+    for marker in BLOCK_TITLES:
+        if marker in title:
+            return f'page title "{title}"'
+    return None
+
+
+def _count_gave_up(kind, level, attempts, baseline):
+    metrics.incr('atu_failures_total', kind=kind, level=level)
+    if baseline > attempts:
+        metrics.incr('atu_retries_avoided_total', baseline - attempts, kind=kind, level=level)
+
+
+def _gave_up(kind, level, attempts, baseline):
+    # tenacity calls phase_stop synchronously, also inside the async scraper's
+    # coroutines: there the Redis calls go to the executor, not the event loop.
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _count_gave_up(kind, level, attempts, baseline)
+        return
+    loop.run_in_executor(None, _count_gave_up, kind, level, attempts, baseline)
+
+
+def phase_stop(retry_state):
+    """tenacity stop: give up on a phase once its kind of failure has had its attempts."""
+    kind = failure_kind(retry_state.outcome.exception())
+    if retry_state.attempt_number < POLICIES[kind]['phase_attempts']:
+        return False
+    _gave_up(kind, 'phase', retry_state.attempt_number, BASELINE_PHASE_ATTEMPTS)
+    return True
+
+
+def phase_wait(retry_state):
+    """tenacity wait: exponential backoff starting at the kind's phase_backoff."""
+    policy = POLICIES[failure_kind(retry_state.outcome.exception())]
+    return min(PHASE_MAX_BACKOFF, policy['phase_backoff'] * 2 ** (retry_state.attempt_number - 1))
+
+
+def task_countdown(kind, retries):
+    """Seconds before the next Celery attempt, or None when the booking should fail now."""
+    policy = POLICIES.get(kind, POLICIES['unknown'])
+    if retries < policy['task_retries']:
+        return min(TASK_MAX_BACKOFF, policy['task_backoff'] * 2 ** retries)
+    _gave_up(kind, 'task', retries, BASELINE_TASK_RETRIES)
+    return None
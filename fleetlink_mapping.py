@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAPPING_FILE = "./fleetlink_id_mapping.xlsx"
+SIDECAR_SUFFIX = ".index.json"
+SIDECAR_VERSION = 1
+
+
+def parse_fleetlink_ids(value):
+    """Turn a "FleetLink ID" cell ("70 | 69", "26?", 26, 26.0) into a list of ints."""
+    if value is None or value == "":
+        return []
+    if isinstance(value, str):
+        ids = []
+        for part in value.split("|"):
+            part = part.replace('?', '').strip()
+            if part:
+                ids.append(int(float(part)))
+        return ids
+    try:
+        if value != value:  # NaN
+            return []
+        return [int(value)]
+    except (TypeError, ValueError):
+        return []
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_index_from_excel(path):
+    """Parse the Excel file once and return {fleetlink_id: [(service_group, atu_service), ...]}."""
+    import pandas as pd
+
+    df = pd.read_excel(path)
+    df.dropna(subset=["FleetLink ID"], inplace=True)
+
+    index = {}
+    for fleetlink_id, group, service in zip(df["FleetLink ID"], df["Service Gruppe"], df["ATU Service"]):
+        for id_ in parse_fleetlink_ids(fleetlink_id):
+            index.setdefault(id_, []).append((str(group).strip(), str(service).strip()))
+    return index
+
+
+class FleetLinkMapping:
+    """In-memory FleetLink ID index, reloaded only when the Excel file changes.
+
+    A JSON sidecar next to the Excel file holds the compiled index keyed by the
+    file's sha256, so a cold worker start does not need pandas/openpyxl at all.
+    """
+
+    def __init__(self, path=DEFAULT_MAPPING_FILE, sidecar_path=None):
+        self.path = path
+        self.sidecar_path = sidecar_path or path + SIDECAR_SUFFIX
+        self._index = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _read_sidecar(self, sha256):
+        try:
+            with open(self.sidecar_path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if payload.get('version') != SIDECAR_VERSION or payload.get('sha256') != sha256:
+            return None
+        return {int(k): [tuple(entry) for entry in v] for k, v in payload['index'].items()}
+
+    def _write_sidecar(self, sha256, index):
+        payload = {
+            'version': SIDECAR_VERSION,
+            'sha256': sha256,
+            'index': {str(k): v for k, v in index.items()},
+        }
+        tmp_path = f"{self.sidecar_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp_path, self.sidecar_path)
+        except OSError as e:
+            logger.warning("Could not write FleetLink sidecar cache %s: %s", self.sidecar_path, e)
+
+    def _load(self):
+        sha256 = file_sha256(self.path)
+        index = self._read_sidecar(sha256)
+        if index is not None:
+            logger.info("FleetLink mapping loaded from sidecar cache %s", self.sidecar_path)
+            return index
+
+        index = build_index_from_excel(self.path)
+        self._write_sidecar(sha256, index)
+        logger.info("FleetLink mapping compiled from %s (%d ids)", self.path, len(index))
+        return index
+
+    def index(self):
+        mtime = os.path.getmtime(self.path)
+        if self._index is None or mtime != self._mtime:
+            with self._lock:
+                if self._index is None or mtime != self._mtime:
+                    self._index = self._load()
+                    self._mtime = mtime
+        return self._index
+
+    def sidecar_index(self):
+        """The index if it is loaded or the sidecar is current, else None. Never parses the Excel file."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        if self._index is not None and mtime == self._mtime:
+            return self._index
+        index = self._read_sidecar(file_sha256(self.path))
+        if index is not None:
+            with self._lock:
+                self._index, self._mtime = index, mtime
+        return index
+
+    def lookup(self, ids):
+        """Return [(service_group, atu_service), ...] for the given ids, in request order."""
+        index = self.index()
+        services = []
+        for id_ in ids:
+            services.extend(index.get(int(id_), []))
+        return services
+
+
+_mappings = {}
+
+
+def get_mapping(path=DEFAULT_MAPPING_FILE):
+    """Process-wide mapping instance, so every job in a worker shares one index."""
+    mapping = _mappings.get(path)
+    if mapping is None:
+        mapping = _mappings.setdefault(path, FleetLinkMapping(path))
+    return mapping
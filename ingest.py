@@ -0,0 +1,162 @@
+import hashlib
+import json
+import logging
+import os
+import re
+
+from dom_select import MATCH_MODES
+import jobs
+import metrics
+from pacing import PROFILES
+from redis_client import get_redis
+import scheduler
+import screenshot_delivery
+from typing_engine import TYPING_MODES
+
+
+logger = logging.getLogger(__name__)
+
+# How long a submission is remembered: a repeat within this window returns the first job.
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+
+PIN_PATTERN = re.compile(r'^\d{5}$')
+DATE_PATTERN = re.compile(r'^\d{2}\.\d{2}\.\d{4}$')
+ENGINES = ('electric', 'fuel')
+REQUIRED_PERSONAL_FIELDS = ('firstName', 'lastName', 'email')
+
+# KEYS: idempotency key. ARGV: job it must still point at, new job, ttl.
+_REPLACE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+_replace_script = None
+
+
+def _is_text(value):
+    return isinstance(value, (str, int)) and not isinstance(value, bool)
+
+
+def _is_id(value):
+    """FleetLink IDs are whole numbers, given as numbers or digit strings."""
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, int) or (isinstance(value, str) and value.strip().isdigit())
+
+
+def validate(data):
+    """Problems with a booking payload, as readable messages; empty if it can be queued."""
+    if not isinstance(data, dict):
+        return ['Booking must be a JSON object']
+
+    errors = []
+    if not _is_text(data.get('pin_code')) or not PIN_PATTERN.match(str(data['pin_code'])):
+        errors.append('pin_code must be a 5-digit postal code')
+
+    ids = data.get('id_target')
+    if not isinstance(ids, list):
+        ids = [ids]
+    if not ids or not all(_is_id(i) for i in ids):
+        errors.append('id_target must be a numeric FleetLink ID or a list of them')
+
+    for field in ('target_service_group', 'service_name'):
+        if field in data and not isinstance(data[field], list):
+            errors.append(f'{field} must be a list')
+
+    for field in ('target_manufacturer', 'target_model', 'target_year', 'quantity_amount'):
+        if data.get(field) is not None and not _is_text(data[field]):
+            errors.append(f'{field} must be a string')
+
+    if data.get('target_date') and not DATE_PATTERN.match(str(data['target_date'])):
+        errors.append('target_date must look like DD.MM.YYYY')
+
+    if data.get('engine') and data['engine'] not in ENGINES:
+        errors.append(f"engine must be one of {', '.join(ENGINES)}")
+
+    if data.get('priority') and data['priority'] not in scheduler.LANES:
+        errors.append(f"priority must be one of {', '.join(scheduler.LANES)}")
+
+    # Options the scraper would otherwise only reject once a worker runs it.
+    if data.get('pacing') and data['pacing'] not in PROFILES:
+        errors.append(f"pacing must be one of {', '.join(PROFILES)}")
+    if data.get('typing') and data['typing'] not in TYPING_MODES:
+        errors.append(f"typing must be one of {', '.join(TYPING_MODES)}")
+    if data.get('match_mode') and data['match_mode'] not in MATCH_MODES:
+        errors.append(f"match_mode must be one of {', '.join(MATCH_MODES)}")
+    errors.extend(screenshot_delivery.option_problems(data))
+
+    your_data = data.get('your_data')
+    if not isinstance(your_data, dict):
+        errors.append('your_data must be an object')
+    else:
+        for field in REQUIRED_PERSONAL_FIELDS:
+            if not str(your_data.get(field) or '').strip():
+                errors.append(f'your_data.{field} is required')
+
+    return errors
+
+
+def _normalize(value):
+    return ' '.join(str(value or '').split()).lower()
+
+
+def payload_key(data):
+    """Hash of what makes two submissions the same booking."""
+    your_data = data.get('your_data') or {}
+    ids = data.get('id_target')
+    normalized = {
+        'pin_code': _normalize(data.get('pin_code')),
+        'id_target': sorted(_normalize(i) for i in (ids if isinstance(ids, list) else [ids])),
+        'vehicle': [_normalize(data.get(f)) for f in ('target_manufacturer', 'target_model', 'target_year')],
+        'target_date': _normalize(data.get('target_date')),
+        'license_plate': _normalize(your_data.get('licensePlate')).replace(' ', ''),
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def idempotency_key(data, supplied=None):
+    if supplied:
+        return f'idem:client:{supplied}'
+    return f'idem:payload:{payload_key(data)}'
+
+
+def claim(key, job_id):
+    """Register `job_id` under `key`; returns the job already holding it, or None.
+
+    The job of `job_id` must already be registered (jobs.create_job), so a
+    key whose job cannot be found belongs to a submission still being
+    queued and counts as a duplicate. A key whose job has failed is handed
+    to the new submission, so a client can resend a booking that did not go
+    through.
+    """
+    global _replace_script
+    r = get_redis()
+    while True:
+        if r.set(key, job_id, nx=True, ex=IDEMPOTENCY_TTL):
+            metrics.incr('atu_ingest_total', result='new')
+            return None
+
+        existing_id = r.get(key)
+        if existing_id is None:
+            continue  # Expired in between
+        existing = jobs.get_job(existing_id)
+        if existing is None or existing.get('status') != 'failed':
+            metrics.incr('atu_ingest_total', result='duplicate')
+            return existing or {'job_id': existing_id, 'status': 'queued'}
+
+        # Only one of several resubmissions of a failed job takes the key.
+        if _replace_script is None:
+            _replace_script = r.register_script(_REPLACE_LUA)
+        if int(_replace_script(keys=[key], args=[existing_id, job_id, IDEMPOTENCY_TTL])):
+            metrics.incr('atu_ingest_total', result='resubmitted')
+            return None
+
+
+def release(key, job_id):
+    """Drop the key if it still points at `job_id` (the job could not be queued)."""
+    r = get_redis()
+    if r.get(key) == job_id:
+        r.delete(key)
@@ -0,0 +1,129 @@
+import json
+import logging
+import time
+import uuid
+
+from redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+JOB_TTL = 7 * 24 * 3600
+TERMINAL_STATUSES = ('done', 'failed')
+
+# Seconds between SSE keep-alive comments, and the longest a stream stays open.
+HEARTBEAT_SECONDS = 15
+STREAM_TIMEOUT_SECONDS = 3600
+
+
+def _job_key(job_id):
+    return f'job:{job_id}'
+
+
+def _events_key(job_id):
+    return f'job:{job_id}:events'
+
+
+def _channel(job_id):
+    return f'job:{job_id}:channel'
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def create_job(timestamp, browser_type, data=None, job_id=None):
+    """Register a job before it is queued and return its id."""
+    job_id = job_id or new_job_id()
+    job = {
+        'job_id': job_id,
+        'status': 'queued',
+        'phase': '',
+        'timestamp': timestamp,
+        'browser_type': browser_type,
+        'pin_code': str((data or {}).get('pin_code', '')),
+        'created_at': time.time(),
+        'updated_at': time.time(),
+    }
+    pipe = get_redis().pipeline()
+    pipe.hset(_job_key(job_id), mapping=job)
+    pipe.expire(_job_key(job_id), JOB_TTL)
+    pipe.execute()
+    return job_id
+
+
+def discard_job(job_id):
+    """Forget a registered job that was never queued (a duplicate submission)."""
+    get_redis().delete(_job_key(job_id), _events_key(job_id))
+
+
+def publish(job_id, event, **fields):
+    """Record an event on the job and push it to live subscribers.
+
+    `status` and `phase` in `fields` also update the job hash, so
+    GET /jobs/<id> always shows the latest state without replaying events.
+    Never raises: losing a progress event must not fail a booking.
+    """
+    if not job_id:
+        return
+    try:
+        r = get_redis()
+        payload = dict(fields, event=event, job_id=job_id, at=time.time())
+        payload['seq'] = r.hincrby(_job_key(job_id), 'seq', 1)
+        message = json.dumps(payload)
+
+        update = {k: v for k, v in fields.items() if k in ('status', 'phase', 'screenshot', 'error')}
+        update['updated_at'] = payload['at']
+
+        pipe = r.pipeline()
+        pipe.hset(_job_key(job_id), mapping=update)
+        pipe.rpush(_events_key(job_id), message)
+        pipe.expire(_job_key(job_id), JOB_TTL)
+        pipe.expire(_events_key(job_id), JOB_TTL)
+        pipe.publish(_channel(job_id), message)
+        pipe.execute()
+    except Exception as e:
+        logger.warning('Could not publish %s for job %s: %s', event, job_id, e)
+
+
+def get_job(job_id):
+    job = get_redis().hgetall(_job_key(job_id))
+    return job or None
+
+
+def stream_events(job_id):
+    """Yield server-sent events for a job: past events first, then live ones."""
+    r = get_redis()
+    pubsub = r.pubsub(ignore_subscribe_messages=True)
+    # Subscribe before reading the history so nothing falls in between.
+    pubsub.subscribe(_channel(job_id))
+
+    try:
+        last_seq = 0
+        for message in r.lrange(_events_key(job_id), 0, -1):
+            event = json.loads(message)
+            last_seq = event['seq']
+            yield f"id: {event['seq']}\nevent: {event['event']}\ndata: {message}\n\n"
+            if event.get('status') in TERMINAL_STATUSES:
+                return
+
+        job = r.hgetall(_job_key(job_id))
+        if job.get('status') in TERMINAL_STATUSES:
+            return
+
+        deadline = time.time() + STREAM_TIMEOUT_SECONDS
+        while time.time() < deadline:
+            message = pubsub.get_message(timeout=HEARTBEAT_SECONDS)
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+
+            event = json.loads(message['data'])
+            if event['seq'] <= last_seq:
+                continue
+            last_seq = event['seq']
+            yield f"id: {event['seq']}\nevent: {event['event']}\ndata: {message['data']}\n\n"
+            if event.get('status') in TERMINAL_STATUSES:
+                return
+    finally:
+        pubsub.close()
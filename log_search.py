@@ -0,0 +1,288 @@
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+from log_store import ARCHIVE_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, run a single web process
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+LOG_SEARCH_ENABLED = os.getenv('LOG_SEARCH_ENABLED', '1') == '1'
+INDEX_INTERVAL = float(os.getenv('LOG_SEARCH_INTERVAL_SECONDS', '10'))
+# Fully indexed log files untouched for this long are gzipped into logs/archive/.
+ARCHIVE_AFTER_DAYS = float(os.getenv('LOG_ARCHIVE_AFTER_DAYS', '7'))
+
+INDEX_FILE = 'search.sqlite3'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Lines as written by ATUScraper.setup_logger; lines without the prefix
+# (tracebacks, multi-line messages) belong to the line before them.
+LINE_PATTERN = re.compile(r'^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\] ([A-Z]+) - (.*)$')
+JOB_PATTERN = re.compile(r'^Job: (\S+)$')
+PHASE_PATTERN = re.compile(r'^Phase started: (\w+)$')
+
+SINCE_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)([smhd])$')
+SINCE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+SINCE_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d')
+
+# files keeps how far each log has been read and the job/phase/level it was
+# in at that point, so the next pass carries on mid-run.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    job_id TEXT,
+    phase TEXT,
+    level TEXT,
+    ts REAL,
+    archived INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL,
+    job_id TEXT,
+    level TEXT,
+    phase TEXT,
+    ts REAL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lines_ts ON lines (ts);
+CREATE INDEX IF NOT EXISTS lines_level_ts ON lines (level, ts);
+CREATE INDEX IF NOT EXISTS lines_job ON lines (job_id);
+CREATE INDEX IF NOT EXISTS lines_file ON lines (file);
+CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5(message, content='lines', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS lines_ai AFTER INSERT ON lines BEGIN
+    INSERT INTO lines_fts (rowid, message) VALUES (new.id, new.message);
+END;
+CREATE TRIGGER IF NOT EXISTS lines_ad AFTER DELETE ON lines BEGIN
+    INSERT INTO lines_fts (lines_fts, rowid, message) VALUES ('delete', old.id, old.message);
+END;
+"""
+
+
+def parse_since(value):
+    """Epoch seconds from "1718000000", "2025-06-12", "2025-06-12T10:00" or an age like "2h"; None if empty."""
+    if not value:
+        return None
+    match = SINCE_PATTERN.match(value)
+    if match:
+        return time.time() - float(match.group(1)) * SINCE_UNITS[match.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in SINCE_FORMATS:
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            continue
+    raise ValueError(f'Unrecognised since: {value}')
+
+
+def fts_phrase(q):
+    """Search for the words of `q` in that order, without FTS5 query syntax getting in the way."""
+    return '"' + q.replace('"', '""') + '"'
+
+
+def parse_lines(text, job_id=None, phase=None, level=None, ts=None):
+    """Rows (job_id, level, phase, ts, message) for the complete lines in `text`, and the state after them."""
+    rows = []
+    for raw in text.splitlines():
+        match = LINE_PATTERN.match(raw)
+        if match:
+            ts = time.mktime(time.strptime(match.group(1), TIME_FORMAT))
+            level, message = match.group(2), match.group(3)
+            job = JOB_PATTERN.match(message)
+            if job:
+                job_id = job.group(1)
+            started = PHASE_PATTERN.match(message)
+            if started:
+                phase = started.group(1)
+        else:
+            message = raw
+        if message.strip():
+            rows.append((job_id, level, phase, ts, message))
+    return rows, (job_id, phase, level, ts)
+
+
+class LogSearch:
+    """Full-text index (SQLite FTS5) over the lines of logs/*.log.
+
+    A background pass every INDEX_INTERVAL seconds reads what was appended
+    to each log since the last pass, and gzips logs that have been idle for
+    ARCHIVE_AFTER_DAYS into logs/archive/ once they are indexed. Searches
+    never touch the log files.
+    """
+
+    def __init__(self, log_dir, db_path=None):
+        self.log_dir = log_dir
+        self.db_path = db_path or os.path.join(log_dir, INDEX_FILE)
+        self.archive_dir = os.path.join(log_dir, ARCHIVE_DIR)
+        self._schema_ready = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def connect(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self._schema_ready:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    def _ingest_file(self, conn, name, known):
+        path = os.path.join(self.log_dir, name)
+        offset, state = 0, (None, None, None, None)
+        if known is not None:
+            offset, state = known['offset'], (known['job_id'], known['phase'], known['level'], known['ts'])
+
+        size = os.path.getsize(path)
+        if size < offset:
+            # Replaced by a new file of the same name: index it from scratch.
+            conn.execute('DELETE FROM lines WHERE file = ?', (name,))
+            offset, state = 0, (None, None, None, None)
+        if size == offset:
+            return 0
+
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(size - offset)
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return 0  # Only part of a line so far
+
+        rows, state = parse_lines(data[:end].decode('utf-8', 'replace'), *state)
+        with conn:
+            conn.executemany('INSERT INTO lines (file, job_id, level, phase, ts, message) VALUES (?, ?, ?, ?, ?, ?)',
+                             [(name,) + row for row in rows])
+            conn.execute('INSERT OR REPLACE INTO files (name, offset, job_id, phase, level, ts, archived) '
+                         'VALUES (?, ?, ?, ?, ?, ?, 0)', (name, offset + end) + state)
+        return len(rows)
+
+    def ingest(self):
+        """Index what was appended to the logs since the last pass; returns the number of lines added."""
+        conn = self.connect()
+        try:
+            known = {row['name']: row for row in conn.execute('SELECT * FROM files WHERE archived = 0')}
+            with os.scandir(self.log_dir) as it:
+                names = [entry.name for entry in it if entry.name.endswith('.log') and entry.is_file()]
+            added = 0
+            for name in names:
+                try:
+                    added += self._ingest_file(conn, name, known.get(name))
+                except OSError as e:
+                    logger.warning('Could not index %s: %s', name, e)
+            return added
+        finally:
+            conn.close()
+
+    def archive(self, max_age_days=ARCHIVE_AFTER_DAYS):
+        """gzip fully indexed logs idle for `max_age_days` into the archive directory; returns how many."""
+        cutoff = time.time() - max_age_days * 86400
+        conn = self.connect()
+        archived = 0
+        try:
+            for row in conn.execute('SELECT name, offset FROM files WHERE archived = 0').fetchall():
+                path = os.path.join(self.log_dir, row['name'])
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime > cutoff or stat.st_size != row['offset']:
+                    continue
+
+                os.makedirs(self.archive_dir, exist_ok=True)
+                with open(path, 'rb') as src, gzip.open(os.path.join(self.archive_dir, row['name'] + '.gz'), 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(path)
+                with conn:
+                    conn.execute('UPDATE files SET archived = 1 WHERE name = ?', (row['name'],))
+                archived += 1
+        finally:
+            conn.close()
+        if archived:
+            logger.info('Archived %d log files', archived)
+        return archived
+
+    def search(self, q=None, level=None, since=None, job_id=None, limit=100):
+        """Newest matching lines first, as dicts."""
+        clauses, params = [], []
+        if q:
+            source = 'lines_fts JOIN lines l ON l.id = lines_fts.rowid'
+            clauses.append('lines_fts MATCH ?')
+            params.append(fts_phrase(q))
+        else:
+            source = 'lines l'
+        if level:
+            clauses.append('l.level = ?')
+            params.append(level.upper())
+        if since is not None:
+            clauses.append('l.ts >= ?')
+            params.append(since)
+        if job_id:
+            clauses.append('l.job_id = ?')
+            params.append(job_id)
+
+        sql = (f'SELECT l.file, l.job_id, l.level, l.phase, l.ts, l.message, f.archived '
+               f'FROM {source} LEFT JOIN files f ON f.name = l.file')
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY l.ts DESC, l.id DESC LIMIT ?'
+        params.append(limit)
+
+        conn = self.connect()
+        try:
+            return [{
+                'file': row['file'],
+                'job_id': row['job_id'],
+                'level': row['level'],
+                'phase': row['phase'],
+                'time': time.strftime(TIME_FORMAT, time.localtime(row['ts'])) if row['ts'] else None,
+                'message': row['message'],
+                'archived': bool(row['archived']),
+            } for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def _loop(self, interval):
+        os.makedirs(self.log_dir, exist_ok=True)
+        with open(self.db_path + '.lock', 'w') as lock:
+            while not self._stop.is_set():
+                try:
+                    # Every web process starts an indexer; only one works at a time.
+                    if fcntl is not None:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    self._stop.wait(interval)
+                    continue
+                try:
+                    self.ingest()
+                    self.archive()
+                except Exception as e:
+                    logger.warning('Log indexing pass failed: %s', e)
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+                self._stop.wait(interval)
+
+    def start(self, interval=INDEX_INTERVAL):
+        if not LOG_SEARCH_ENABLED or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name='log-indexer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
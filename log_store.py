@@ -0,0 +1,139 @@
+import gzip
+import os
+import threading
+import time
+import zlib
+
+
+# A directory listing is reused for this long unless the directory itself changes.
+INDEX_TTL_SECONDS = float(os.getenv('LOG_INDEX_TTL_SECONDS', '5'))
+
+FOLLOW_POLL_SECONDS = 0.5
+# A follow stream ends after this long without new lines.
+FOLLOW_IDLE_TIMEOUT = float(os.getenv('LOG_FOLLOW_IDLE_TIMEOUT', '120'))
+READ_CHUNK = 64 * 1024
+
+
+# Where log_search.LogSearch.archive() moves idle logs, gzipped.
+ARCHIVE_DIR = 'archive'
+
+
+def archived_path(log_dir, name):
+    """Path of the gzipped copy of log `name`, or None when it is not archived."""
+    path = os.path.join(log_dir, ARCHIVE_DIR, name + '.gz')
+    return path if os.path.isfile(path) else None
+
+
+class LogIndex:
+    """Cached newest-first listing of *.log files with size and mtime.
+
+    Archived logs (logs/archive/*.log.gz) are listed under their original
+    name with `archived` set. The directory is only rescanned when its mtime
+    changes (a file was added or removed, which archiving also does) or the
+    cached listing is older than INDEX_TTL_SECONDS (so growing files report
+    a fresh size).
+    """
+
+    def __init__(self, log_dir, suffix='.log', ttl=INDEX_TTL_SECONDS):
+        self.log_dir = log_dir
+        self.archive_dir = os.path.join(log_dir, ARCHIVE_DIR)
+        self.suffix = suffix
+        self.ttl = ttl
+        self._entries = []
+        self._dir_mtime = None
+        self._scanned_at = 0
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        entries = []
+        with os.scandir(self.log_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(self.suffix) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append({'name': entry.name, 'size': stat.st_size, 'mtime': stat.st_mtime, 'archived': False})
+        live = {e['name'] for e in entries}
+        try:
+            with os.scandir(self.archive_dir) as it:
+                for entry in it:
+                    name = entry.name[:-len('.gz')]
+                    if not entry.name.endswith(self.suffix + '.gz') or name in live or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    # size is the compressed size
+                    entries.append({'name': name, 'size': stat.st_size, 'mtime': stat.st_mtime, 'archived': True})
+        except FileNotFoundError:
+            pass
+        entries.sort(key=lambda e: (e['mtime'], e['name']), reverse=True)
+        return entries
+
+    def entries(self):
+        try:
+            dir_mtime = os.stat(self.log_dir).st_mtime
+        except FileNotFoundError:
+            return []
+
+        now = time.monotonic()
+        if dir_mtime != self._dir_mtime or now - self._scanned_at > self.ttl:
+            with self._lock:
+                if dir_mtime != self._dir_mtime or now - self._scanned_at > self.ttl:
+                    self._entries = self._scan()
+                    self._dir_mtime = dir_mtime
+                    self._scanned_at = now
+        return self._entries
+
+    def page(self, page=1, per_page=50):
+        entries = self.entries()
+        start = (page - 1) * per_page
+        return entries[start:start + per_page], len(entries)
+
+
+def read_from(path, offset=0, limit=None):
+    """Bytes of `path` from `offset` on (at most `limit`), plus the offset to resume from.
+
+    A .gz file is read decompressed; offsets count uncompressed bytes.
+    """
+    with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read() if limit is None else f.read(limit)
+    return data, offset + len(data)
+
+
+def follow(path, offset=0, idle_timeout=FOLLOW_IDLE_TIMEOUT):
+    """Yield the file from `offset`, then whole new lines as they are written."""
+    idle_since = time.monotonic()
+    pending = b''
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if chunk:
+                idle_since = time.monotonic()
+                pending += chunk
+                complete, _, pending = pending.rpartition(b'\n')
+                if complete:
+                    yield complete + b'\n'
+                continue
+
+            if time.monotonic() - idle_since > idle_timeout:
+                if pending:
+                    yield pending
+                return
+            time.sleep(FOLLOW_POLL_SECONDS)
+
+
+def gzip_stream(chunks):
+    """gzip-encode a chunk generator, flushing after every chunk so lines arrive live."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def gzip_bytes(data):
+    return gzip.compress(data, compresslevel=6)
+
+
+def accepts_gzip(req):
+    return 'gzip' in req.headers.get('Accept-Encoding', '').lower()
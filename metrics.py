@@ -0,0 +1,203 @@
+import logging
+import os
+
+from redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets.
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Celery queues whose depth /metrics reports.
+QUEUES = [q for q in os.getenv('METRICS_QUEUES', 'urgent,celery,bulk,async').split(',') if q]
+# The Redis transport keeps one list per message priority: <queue>, <queue>:1 .. <queue>:9.
+PRIORITY_SUFFIXES = [''] + [f':{p}' for p in range(1, 10)]
+
+HIST_INDEX_KEY = 'metrics:histograms'
+COUNTERS_KEY = 'metrics:counters'
+INFLIGHT_KEY = 'metrics:inflight'
+GAUGES_KEY = 'metrics:gauges'
+
+
+def _labels_key(labels):
+    return ','.join(f'{k}={v}' for k, v in sorted(labels.items()))
+
+
+def _parse_labels(key):
+    if not key:
+        return {}
+    return dict(part.split('=', 1) for part in key.split(','))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in sorted(labels.items())) + '}'
+
+
+def _hist_key(name, labels):
+    return f'metrics:hist:{name}:{_labels_key(labels)}'
+
+
+def _observe(pipe, name, seconds, labels):
+    key = _hist_key(name, labels)
+    pipe.sadd(HIST_INDEX_KEY, key)
+    for bound in BUCKETS:
+        if seconds <= bound:
+            pipe.hincrby(key, str(bound), 1)
+            break
+    else:
+        pipe.hincrby(key, '+Inf', 1)
+    pipe.hincrby(key, 'count', 1)
+    pipe.hincrbyfloat(key, 'sum', seconds)
+
+
+def observe(name, seconds, **labels):
+    """Add one sample to a histogram shared by every worker through Redis."""
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        _observe(pipe, name, seconds, labels)
+        pipe.execute()
+    except Exception as e:
+        logger.warning('Could not record metric %s: %s', name, e)
+
+
+def incr(name, amount=1, **labels):
+    try:
+        get_redis().hincrbyfloat(COUNTERS_KEY, name + _format_labels(labels), amount)
+    except Exception as e:
+        logger.warning('Could not record metric %s: %s', name, e)
+
+
+def set_gauge(name, value, **labels):
+    try:
+        get_redis().hset(GAUGES_KEY, name + _format_labels(labels), value)
+    except Exception as e:
+        logger.warning('Could not record metric %s: %s', name, e)
+
+
+def inflight(delta):
+    try:
+        get_redis().incrby(INFLIGHT_KEY, delta)
+    except Exception as e:
+        logger.warning('Could not update in-flight gauge: %s', e)
+
+
+def record_timings(timings):
+    """Push a Pacer's {step: [seconds, ...]} in one round trip.
+
+    "phase:<name>" entries go to the per-phase histogram, everything else
+    (readiness waits, clicks, typing, browser acquire) to the per-step one.
+    """
+    if not timings:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for step, samples in timings.items():
+            if step.startswith('phase:'):
+                name, labels = 'atu_phase_duration_seconds', {'phase': step[len('phase:'):]}
+            else:
+                name, labels = 'atu_step_duration_seconds', {'step': step}
+            for seconds in samples:
+                _observe(pipe, name, seconds, labels)
+        pipe.execute()
+    except Exception as e:
+        logger.warning('Could not record timings: %s', e)
+
+
+def quantile(buckets, count, q):
+    """Estimate a quantile from cumulative bucket counts by linear interpolation."""
+    if not count:
+        return 0.0
+    rank = q * count
+    previous_bound, previous_count = 0.0, 0
+    for bound, cumulative in buckets:
+        if cumulative >= rank:
+            if bound == float('inf'):
+                return previous_bound
+            in_bucket = cumulative - previous_count
+            if not in_bucket:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / in_bucket
+        previous_bound, previous_count = bound, cumulative
+    return previous_bound
+
+
+def read_histograms():
+    """{(name, labels_key): (cumulative [(bound, count)], count, sum)}"""
+    r = get_redis()
+    keys = sorted(r.smembers(HIST_INDEX_KEY))
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.hgetall(key)
+
+    histograms = {}
+    for key, raw in zip(keys, pipe.execute()):
+        _, _, name, labels_key = key.split(':', 3)
+        cumulative, running = [], 0
+        for bound in BUCKETS:
+            running += int(raw.get(str(bound), 0))
+            cumulative.append((float(bound), running))
+        running += int(raw.get('+Inf', 0))
+        cumulative.append((float('inf'), running))
+        histograms[(name, labels_key)] = (cumulative, int(raw.get('count', 0)), float(raw.get('sum', 0)))
+    return histograms
+
+
+def render_prometheus():
+    r = get_redis()
+    lines = []
+
+    lines.append('# TYPE atu_queue_depth gauge')
+    for queue in QUEUES:
+        depth = sum(r.llen(queue + suffix) for suffix in PRIORITY_SUFFIXES)
+        lines.append(f'atu_queue_depth{_format_labels({"queue": queue})} {depth}')
+
+    lines.append('# TYPE atu_jobs_in_flight gauge')
+    lines.append(f'atu_jobs_in_flight {int(r.get(INFLIGHT_KEY) or 0)}')
+
+    gauges = r.hgetall(GAUGES_KEY)
+    seen = set()
+    for series, value in sorted(gauges.items()):
+        name = series.split('{', 1)[0]
+        if name not in seen:
+            lines.append(f'# TYPE {name} gauge')
+            seen.add(name)
+        lines.append(f'{series} {float(value):g}')
+
+    counters = r.hgetall(COUNTERS_KEY)
+    seen = set()
+    for series, value in sorted(counters.items()):
+        name = series.split('{', 1)[0]
+        if name not in seen:
+            lines.append(f'# TYPE {name} counter')
+            seen.add(name)
+        lines.append(f'{series} {float(value):g}')
+
+    histograms = sorted(read_histograms().items())
+    seen = set()
+    for (name, labels_key), (cumulative, count, total) in histograms:
+        labels = _parse_labels(labels_key)
+        if name not in seen:
+            lines.append(f'# TYPE {name} histogram')
+            seen.add(name)
+        for bound, cumulative_count in cumulative:
+            le = '+Inf' if bound == float('inf') else f'{bound:g}'
+            lines.append(f'{name}_bucket{_format_labels(dict(labels, le=le))} {cumulative_count}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {total:g}')
+        lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+    seen = set()
+    for (name, labels_key), (cumulative, count, _) in histograms:
+        labels = _parse_labels(labels_key)
+        gauge = f'{name}_quantile'
+        if gauge not in seen:
+            lines.append(f'# TYPE {gauge} gauge')
+            seen.add(gauge)
+        for q in QUANTILES:
+            value = quantile(cumulative, count, q)
+            lines.append(f'{gauge}{_format_labels(dict(labels, quantile=f"{q:g}"))} {value:.3f}')
+
+    return '\n'.join(lines) + '\n'
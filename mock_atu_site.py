@@ -0,0 +1,314 @@
+# mock_atu_site.py
+# Local stand-in for the ATU appointment booking page, with the DOM the
+# scraper relies on, configurable latency and failure injection.
+#
+#   python mock_atu_site.py --port 5001 --latency-ms 300 --failure-rate 0.05
+#   ATU_BOOKING_URL=http://127.0.0.1:5001/terminvereinbarung/ python atu_scraper.py
+import argparse
+import logging
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from flask import Flask, abort, jsonify, render_template_string, request
+
+
+logger = logging.getLogger(__name__)
+
+# Every knob can also be changed at runtime with POST /__mock/config.
+CONFIG = {
+    'latency_ms': float(os.getenv('MOCK_LATENCY_MS', '200')),   # added to every API call and page load
+    'jitter_ms': float(os.getenv('MOCK_JITTER_MS', '100')),     # uniform extra on top of latency_ms
+    'failure_rate': float(os.getenv('MOCK_FAILURE_RATE', '0')),  # share of API calls answered with 503
+    'page_failure_rate': float(os.getenv('MOCK_PAGE_FAILURE_RATE', '0')),
+}
+
+WEEKDAYS = ['Mo.', 'Di.', 'Mi.', 'Do.', 'Fr.', 'Sa.', 'So.']
+
+VEHICLES = {
+    'FORD': {'KA': range(1996, 2017), 'FIESTA': range(2002, 2024), 'FOCUS': range(1998, 2024)},
+    'VW': {'GOLF': range(1997, 2025), 'POLO': range(2001, 2025), 'PASSAT': range(2000, 2025)},
+    'BMW': {'3ER': range(1998, 2025), '5ER': range(2003, 2025)},
+    'OPEL': {'CORSA': range(2000, 2025), 'ASTRA': range(1998, 2022)},
+}
+
+VEHICLE_GROUPS = ['Ölwechsel', 'Inspektion', 'Achsvermessung', 'Bremsen', 'Fahrwerk', 'Zahnriemen']
+
+# Used when the FleetLink mapping cannot be loaded.
+DEFAULT_SERVICES = {
+    'HU/AU': ['HU/AU', 'HU für E-Fahrzeuge', 'AU'],
+    'Ölwechsel': ['Ölwechsel inkl. Ölfilter', 'Ölwechsel ohne Filter'],
+    'Inspektion': ['Inspektion nach Herstellervorgabe', 'Urlaubscheck'],
+    'Bremsen': ['Bremsbeläge vorne wechseln', 'Bremsflüssigkeit wechseln'],
+    'Reifen': ['Räderwechsel', 'Reifenmontage'],
+}
+
+
+def service_catalog():
+    """Service groups and names: those of the FleetLink mapping, so mapped bookings find their services."""
+    try:
+        from fleetlink_mapping import get_mapping
+        groups = {}
+        for entries in get_mapping().index().values():
+            for group, service in entries:
+                names = groups.setdefault(group, [])
+                if service not in names:
+                    names.append(service)
+        if groups:
+            for group, names in DEFAULT_SERVICES.items():
+                groups.setdefault(group, list(names))
+            return groups
+    except Exception as e:
+        logger.warning('FleetLink mapping not available, using the built-in services: %s', e)
+    return {group: list(names) for group, names in DEFAULT_SERVICES.items()}
+
+
+def branches_for(pin_code):
+    rng = random.Random(pin_code)
+    return [{'id': f'{pin_code}{i:02d}', 'name': f'ATU Filiale {pin_code}-{i}',
+             'street': f'Hauptstraße {rng.randint(1, 200)}'} for i in range(1, rng.randint(2, 5))]
+
+
+def available_days(count=21):
+    today = date.today()
+    days = [today + timedelta(days=i) for i in range(1, count + 1)]
+    return [f'{WEEKDAYS[d.weekday()]}, {d:%d.%m.%Y}' for d in days if d.weekday() < 6]
+
+
+def slots_for(day):
+    rng = random.Random(day)
+    return [f'{hour:02d}:{minute:02d}' for hour in range(8, 18) for minute in (0, 30) if rng.random() < 0.4]
+
+
+def simulate(failure_rate):
+    delay = CONFIG['latency_ms'] + random.uniform(0, CONFIG['jitter_ms'])
+    time.sleep(delay / 1000)
+    if random.random() < failure_rate:
+        abort(503)
+
+
+app = Flask(__name__)
+SERVICES = service_catalog()
+
+
+@app.route('/__mock/config', methods=['GET', 'POST'])
+def mock_config():
+    if request.method == 'POST':
+        for key, value in (request.get_json(silent=True) or {}).items():
+            if key in CONFIG:
+                CONFIG[key] = float(value)
+    return jsonify(CONFIG)
+
+
+@app.route('/api/branches')
+def api_branches():
+    simulate(CONFIG['failure_rate'])
+    return jsonify(branches_for(request.args.get('pin', '')))
+
+
+@app.route('/api/models')
+def api_models():
+    simulate(CONFIG['failure_rate'])
+    return jsonify(sorted(VEHICLES.get(request.args.get('manufacturer'), {})))
+
+
+@app.route('/api/years')
+def api_years():
+    simulate(CONFIG['failure_rate'])
+    years = VEHICLES.get(request.args.get('manufacturer'), {}).get(request.args.get('model'), [])
+    return jsonify([str(y) for y in reversed(years)])
+
+
+@app.route('/api/slots')
+def api_slots():
+    simulate(CONFIG['failure_rate'])
+    return jsonify(slots_for(request.args.get('day', '')))
+
+
+@app.route('/')
+@app.route('/terminvereinbarung/')
+def booking_page():
+    simulate(CONFIG['page_failure_rate'])
+    return render_template_string(PAGE, services=SERVICES, vehicle_groups=VEHICLE_GROUPS,
+                                  manufacturers=sorted(VEHICLES), days=available_days(),
+                                  branch=request.args.get('branch'))
+
+
+PAGE = '''<!DOCTYPE html>
+<html lang="de">
+<head>
+  <meta charset="UTF-8">
+  <title>Termin vereinbaren (mock)</title>
+  <style>
+    body { font-family: sans-serif; margin: 2rem; }
+    .hidden { display: none; }
+    .branch-list-entry, .service-name { cursor: pointer; padding: .3rem; border-bottom: 1px solid #ddd; }
+    .selected { background: #cde; }
+    #cookie-banner { position: fixed; bottom: 0; left: 0; right: 0; background: #eee; padding: 1rem; }
+  </style>
+</head>
+<body>
+  <div id="cookie-banner"><button type="button" onclick="this.parentNode.remove()">Alle akzeptieren</button></div>
+
+  <section id="step-branch" class="{{ 'hidden' if branch }}">
+    <input id="locationSearchInput" placeholder="PLZ oder Ort">
+    <div id="branch-list"></div>
+    <div id="branch-error"></div>
+  </section>
+
+  <section id="step-services" class="{{ '' if branch else 'hidden' }}">
+    <button type="button" class="more-entries">Service auswählen</button>
+    <div id="groups" class="hidden">
+      {% for group in services %}<div class="service-name group">{{ group }}</div>
+      {% endfor %}
+    </div>
+    <div id="vehicle" class="hidden">
+      <select name="manufacturer"><option>Hersteller wählen</option>
+        {% for m in manufacturers %}<option>{{ m }}</option>{% endfor %}</select>
+      <select name="model"><option>Modell wählen</option></select>
+      <select name="year"><option>Baujahr wählen</option></select>
+      <button type="button" id="save-vehicle">Speichern und weiter</button>
+    </div>
+    <div id="service-lists"></div>
+    <div id="cart-actions" class="hidden">
+      <button type="button" id="add-more">Service hinzufügen</button>
+      <button type="button" class="btn btn-primary next">Weiter</button>
+    </div>
+  </section>
+
+  <section id="step-appointment" class="hidden">
+    <select aria-label="Tagauswahl"><option>Tag wählen</option>
+      {% for day in days %}<option>{{ day }}</option>{% endfor %}</select>
+    <select aria-label="Uhrzeitauswahl"></select>
+    <button type="button" class="btn btn-primary btn-big">Termin wählen</button>
+  </section>
+
+  <section id="step-data" class="hidden">
+    {% for field in ["firstName", "lastName", "email", "mobile", "Erreichbarkeit", "licensePlate", "HSN", "TSN",
+                     "mileage", "Radeinlagerungsnummer", "Firmenname", "Kundennummer", "Anmerkung"] %}
+    <label>{{ field }} <input id="{{ field }}"></label><br>
+    {% endfor %}
+  </section>
+
+  <script>
+    const SERVICES = {{ services | tojson }};
+    const VEHICLE_GROUPS = {{ vehicle_groups | tojson }};
+    let vehicleSaved = false, pendingGroup = null;
+    const $ = s => document.querySelector(s);
+    const show = (s, on = true) => $(s).classList.toggle('hidden', !on);
+
+    async function getJSON(url) {
+      const res = await fetch(url);
+      if (!res.ok) throw new Error(res.status);
+      return res.json();
+    }
+
+    function fillSelect(select, placeholder, values) {
+      select.innerHTML = '';
+      [placeholder, ...values].forEach(v => select.add(new Option(v, v)));
+    }
+
+    function gotoStep(step) {
+      ['#step-branch', '#step-services', '#step-appointment', '#step-data'].forEach(s => show(s, s === step));
+    }
+
+    $('#locationSearchInput').addEventListener('keydown', async e => {
+      if (e.key !== 'Enter') return;
+      $('#branch-error').textContent = '';
+      try {
+        const branches = await getJSON('/api/branches?pin=' + encodeURIComponent(e.target.value));
+        $('#branch-list').innerHTML = branches.map(b =>
+          `<div class="branch-list-entry" data-branch-id="${b.id}"><a href="?branch=${b.id}">${b.name}</a><br>${b.street}</div>`
+        ).join('');
+      } catch (err) {
+        $('#branch-error').textContent = 'Filialen konnten nicht geladen werden';
+      }
+    });
+
+    $('#branch-list').addEventListener('click', e => {
+      const entry = e.target.closest('.branch-list-entry');
+      if (!entry) return;
+      e.preventDefault();
+      gotoStep('#step-services');
+    });
+
+    $('.more-entries').addEventListener('click', () => show('#groups'));
+
+    function showServiceList(group) {
+      document.querySelectorAll('.service-list').forEach(l => l.classList.add('hidden'));
+      const list = document.createElement('div');
+      list.className = 'service-list';
+      list.innerHTML = SERVICES[group].map(s => `<h3 class="service-name">${s}</h3>`).join('') +
+        '<select name="service-amount" class="hidden">' + [1, 2, 3, 4, 5].map(n => `<option>${n}</option>`).join('') +
+        '</select><button type="button" class="btn btn-primary btn-addService hidden">Hinzufügen</button>';
+      list.addEventListener('click', e => {
+        if (e.target.matches('h3.service-name')) {
+          list.querySelectorAll('h3').forEach(h => h.classList.remove('selected'));
+          e.target.classList.add('selected');
+          list.querySelector('select').classList.remove('hidden');
+          list.querySelector('.btn-addService').classList.remove('hidden');
+        } else if (e.target.matches('.btn-addService')) {
+          list.classList.add('hidden');
+          show('#cart-actions');
+        }
+      });
+      $('#service-lists').appendChild(list);
+    }
+
+    $('#groups').addEventListener('click', e => {
+      if (!e.target.matches('.service-name.group')) return;
+      const group = e.target.textContent;
+      show('#groups', false);
+      show('#cart-actions', false);
+      if (VEHICLE_GROUPS.includes(group) && !vehicleSaved) {
+        pendingGroup = group;
+        show('#vehicle');
+      } else {
+        showServiceList(group);
+      }
+    });
+
+    const [manufacturer, model, year] = document.querySelectorAll('#vehicle select');
+    manufacturer.addEventListener('change', async () => {
+      fillSelect(model, 'Modell wählen', await getJSON('/api/models?manufacturer=' + encodeURIComponent(manufacturer.value)));
+    });
+    model.addEventListener('change', async () => {
+      fillSelect(year, 'Baujahr wählen', await getJSON('/api/years?manufacturer=' + encodeURIComponent(manufacturer.value) +
+                                                        '&model=' + encodeURIComponent(model.value)));
+    });
+    $('#save-vehicle').addEventListener('click', () => {
+      vehicleSaved = true;
+      show('#vehicle', false);
+      showServiceList(pendingGroup);
+    });
+
+    $('#add-more').addEventListener('click', () => { show('#cart-actions', false); show('#groups'); });
+    $('.next').addEventListener('click', () => gotoStep('#step-appointment'));
+
+    const daySelect = $('select[aria-label="Tagauswahl"]');
+    daySelect.addEventListener('change', async () => {
+      const slots = $('select[aria-label="Uhrzeitauswahl"]');
+      slots.innerHTML = '';
+      (await getJSON('/api/slots?day=' + encodeURIComponent(daySelect.value))).forEach(t => slots.add(new Option(t, t)));
+    });
+    $('.btn-big').addEventListener('click', () => gotoStep('#step-data'));
+  </script>
+</body>
+</html>
+'''
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock ATU booking site')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--latency-ms', type=float, default=CONFIG['latency_ms'])
+    parser.add_argument('--jitter-ms', type=float, default=CONFIG['jitter_ms'])
+    parser.add_argument('--failure-rate', type=float, default=CONFIG['failure_rate'])
+    parser.add_argument('--page-failure-rate', type=float, default=CONFIG['page_failure_rate'])
+    args = parser.parse_args()
+
+    CONFIG.update(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                  failure_rate=args.failure_rate, page_failure_rate=args.page_failure_rate)
+    app.run(host=args.host, port=args.port, threaded=True)
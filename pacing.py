@@ -0,0 +1,94 @@
+import asyncio
+import os
+import random
+from contextlib import contextmanager
+from time import perf_counter, sleep
+
+
+# Jitter ranges (seconds) per pacing step. "stealth" is the timing the scraper
+# always used; the other profiles trade anti-bot caution for throughput.
+PROFILES = {
+    'stealth': {
+        'branch': (2, 5),
+        'service': (3, 6),
+        'appointment': (4, 6),
+        'your_data': (2, 4),
+        'click': (1, 3),
+        'dropdown': (2, 6),
+        'date': (5, 10),
+        'service_group': (2, 5),
+        'vehicle': (2, 3),
+        'vehicle_saved': (3, 6),
+        'add_service': (2, 5),
+        'branch_loaded': (0.5, 0.5),
+        'keystroke': (0.1, 0.5),
+    },
+    'balanced': {
+        'branch': (0.5, 1.5),
+        'service': (0.5, 1.5),
+        'appointment': (0.5, 1.5),
+        'your_data': (0.5, 1),
+        'click': (0.3, 1),
+        'dropdown': (0.5, 1.5),
+        'date': (1, 2),
+        'service_group': (0.5, 1.5),
+        'vehicle': (0.3, 0.8),
+        'vehicle_saved': (0.5, 1.5),
+        'add_service': (0.5, 1.5),
+        'branch_loaded': (0.2, 0.5),
+        'keystroke': (0.05, 0.15),
+    },
+    'fast': {},
+}
+
+DEFAULT_PROFILE = os.getenv('PACING_PROFILE', 'stealth')
+
+# How long a step waits for its readiness signal before carrying on anyway.
+READY_TIMEOUT_MS = int(os.getenv('PACING_READY_TIMEOUT_MS', '15000'))
+
+
+class Pacer:
+    """Human-like jitter from a named profile plus per-step wall-time records."""
+
+    def __init__(self, profile=None):
+        profile = profile or DEFAULT_PROFILE
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown pacing profile: {profile} (expected one of {', '.join(PROFILES)})")
+        self.profile = profile
+        self.ranges = PROFILES[profile]
+        self.timings = {}
+
+    def jitter(self, step):
+        low, high = self.ranges.get(step, (0, 0))
+        if high <= 0:
+            return 0
+        return random.uniform(low, high)
+
+    def pause(self, step):
+        delay = self.jitter(step)
+        if delay:
+            sleep(delay)
+
+    async def async_pause(self, step):
+        delay = self.jitter(step)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def record(self, step, seconds):
+        self.timings.setdefault(step, []).append(seconds)
+
+    @contextmanager
+    def timed(self, step):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(step, perf_counter() - start)
+
+    def summary(self):
+        """{step: (count, total_seconds)} for the log line at the end of a run."""
+        return {step: (len(samples), sum(samples)) for step, samples in self.timings.items()}
+
+    def format_summary(self):
+        parts = [f"{step}={total:.2f}s/{count}" for step, (count, total) in sorted(self.summary().items())]
+        return f"profile={self.profile} " + ' '.join(parts)
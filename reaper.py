@@ -0,0 +1,220 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import psutil
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+REAPER_ENABLED = os.getenv('REAPER_ENABLED', '1') == '1'
+REAPER_INTERVAL = int(os.getenv('REAPER_INTERVAL_SECONDS', '120'))
+# Profiles younger than this are left alone (their browser may still be starting up).
+GRACE_SECONDS = int(os.getenv('REAPER_GRACE_SECONDS', '60'))
+
+# Only processes started by Playwright carry these: the browser talks to the
+# driver over a pipe, and the driver is started with run-driver. A browser the
+# user opened by hand never matches.
+PLAYWRIGHT_MARKERS = ('--remote-debugging-pipe', '-juggler-pipe', 'run-driver')
+# Every process that launches a browser records the Playwright processes it
+# started here (one file per owner PID). Only those are ever reaped, never the
+# browsers of other Playwright users (test runners) on the same machine.
+REGISTRY_DIR = os.getenv('REAPER_REGISTRY_DIR', os.path.join(tempfile.gettempdir(), 'atu-browser-owners'))
+# Throwaway profile directories Playwright creates per launched browser.
+PROFILE_PREFIXES = ('playwright_chromiumdev_profile-', 'playwright_firefoxdev_profile-')
+
+_stop = threading.Event()
+_thread = None
+
+
+def _cmdline(proc):
+    try:
+        return proc.cmdline()
+    except psutil.Error:
+        return []
+
+
+def is_playwright_process(proc):
+    args = _cmdline(proc)
+    return any(marker in arg for arg in args for marker in PLAYWRIGHT_MARKERS)
+
+
+def register_launched():
+    """Record the Playwright processes this process has started so far; call after each launch."""
+    try:
+        me = psutil.Process()
+        processes = [{'pid': p.pid, 'created': p.create_time()}
+                     for p in me.children(recursive=True) if is_playwright_process(p)]
+        os.makedirs(REGISTRY_DIR, exist_ok=True)
+        path = os.path.join(REGISTRY_DIR, str(me.pid))
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'created': me.create_time(), 'processes': processes}, f)
+        os.replace(path + '.tmp', path)
+    except (OSError, psutil.Error) as e:
+        logger.warning('Could not register launched browser processes: %s', e)
+
+
+def _same_process(pid, created):
+    """The process `pid` if it is still the one started at `created` (PIDs get reused), else None."""
+    try:
+        proc = psutil.Process(pid)
+        return proc if abs(proc.create_time() - created) < 1 else None
+    except psutil.Error:
+        return None
+
+
+def find_orphans():
+    """Registered Playwright browsers and drivers whose owner process is gone.
+
+    The registry file of a dead owner is removed once its processes are
+    collected; the caller kills them in the same pass.
+    """
+    try:
+        names = [name for name in os.listdir(REGISTRY_DIR) if name.isdigit()]
+    except FileNotFoundError:
+        return []
+
+    orphans = []
+    for name in names:
+        path = os.path.join(REGISTRY_DIR, name)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if _same_process(int(name), entry['created']) is not None:
+            continue  # Owner alive: its pool closes its own browsers
+        for recorded in entry['processes']:
+            proc = _same_process(recorded['pid'], recorded['created'])
+            if proc is not None and is_playwright_process(proc):
+                orphans.append(proc)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return orphans
+
+
+def _tree(proc):
+    try:
+        return [proc] + proc.children(recursive=True)
+    except psutil.Error:
+        return [proc]
+
+
+def reap_processes(orphans):
+    """Kill each orphaned tree; returns (processes killed, RSS reclaimed in bytes)."""
+    victims, seen = [], set()
+    for root in orphans:
+        for proc in _tree(root):
+            # A driver and its browser are both registered
+            if proc.pid not in seen:
+                seen.add(proc.pid)
+                victims.append(proc)
+
+    rss = 0
+    for proc in victims:
+        try:
+            rss += proc.memory_info().rss
+            proc.terminate()
+        except psutil.Error:
+            pass
+    _, alive = psutil.wait_procs(victims, timeout=5)
+    for proc in alive:
+        try:
+            proc.kill()
+        except psutil.Error:
+            pass
+    return len(victims), rss
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def stale_profiles(tmp_dir=None, now=None):
+    """Playwright profile directories that no running process uses."""
+    tmp_dir = tmp_dir or tempfile.gettempdir()
+    now = now or time.time()
+    try:
+        candidates = [os.path.join(tmp_dir, name) for name in os.listdir(tmp_dir)
+                      if name.startswith(PROFILE_PREFIXES)]
+    except OSError:
+        return []
+    if not candidates:
+        return []
+
+    in_use = ' '.join(' '.join(_cmdline(proc)) for proc in psutil.process_iter())
+    stale = []
+    for path in candidates:
+        try:
+            if now - os.path.getmtime(path) < GRACE_SECONDS:
+                continue
+        except OSError:
+            continue
+        if path not in in_use:
+            stale.append(path)
+    return stale
+
+
+def reap_profiles(paths):
+    """Delete the directories; returns bytes freed."""
+    freed = 0
+    for path in paths:
+        size = _dir_size(path)
+        shutil.rmtree(path, ignore_errors=True)
+        if not os.path.exists(path):
+            freed += size
+    return freed
+
+
+def reap():
+    """One pass: kill orphaned browser trees, then delete the profiles they left."""
+    killed, rss = reap_processes(find_orphans())
+    profiles = stale_profiles()
+    freed = reap_profiles(profiles)
+
+    if killed or profiles:
+        logger.warning('Reaped %d orphaned browser processes (%.0f MB RSS) and %d profiles (%.0f MB)',
+                       killed, rss / (1024 * 1024), len(profiles), freed / (1024 * 1024))
+        metrics.incr('atu_reaper_processes_total', killed)
+        metrics.incr('atu_reaper_reclaimed_rss_bytes_total', rss)
+        metrics.incr('atu_reaper_profiles_total', len(profiles))
+        metrics.incr('atu_reaper_reclaimed_disk_bytes_total', freed)
+    return {'processes': killed, 'rss_bytes': rss, 'profiles': len(profiles), 'disk_bytes': freed}
+
+
+def _loop(interval):
+    while not _stop.is_set():
+        try:
+            reap()
+        except Exception as e:
+            logger.warning('Reaper pass failed: %s', e)
+        _stop.wait(interval)
+
+
+def start(interval=REAPER_INTERVAL):
+    """Run reap() now and then every `interval` seconds on a daemon thread."""
+    global _thread
+    if not REAPER_ENABLED or (_thread is not None and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, args=(interval,), name='browser-reaper', daemon=True)
+    _thread.start()
+
+
+def stop():
+    _stop.set()
@@ -0,0 +1,16 @@
+import os
+
+import redis
+
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+_client = None
+
+
+def get_redis():
+    """Shared client for app state kept next to the Celery broker."""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _client
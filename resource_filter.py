@@ -0,0 +1,139 @@
+import os
+import random
+from urllib.parse import urlsplit
+
+import metrics
+
+
+def _env_list(name, default):
+    return {item.strip().lower() for item in os.getenv(name, default).split(',') if item.strip()}
+
+
+FILTER_ENABLED = os.getenv('RESOURCE_FILTER_ENABLED', '1') == '1'
+
+# Resource types the booking flow never needs. Stylesheets stay: visibility
+# checks (wait_for state='visible') depend on layout.
+BLOCKED_RESOURCE_TYPES = _env_list('FILTER_BLOCK_TYPES', 'image,media,font')
+
+# Tracking and third-party tag hosts, matched with their subdomains.
+BLOCKED_DOMAINS = _env_list('FILTER_BLOCK_DOMAINS', ','.join([
+    'google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'googleadservices.com',
+    'googlesyndication.com', 'facebook.net', 'facebook.com', 'hotjar.com', 'criteo.com',
+    'criteo.net', 'bing.com', 'clarity.ms', 'tiktok.com', 'pinterest.com', 'adnxs.com',
+    'trbo.com', 'kameleoon.eu', 'youtube.com', 'ytimg.com',
+]))
+
+# Never blocked, whatever the rules above say: anti-bot and consent checks live here.
+ALLOWED_DOMAINS = _env_list('FILTER_ALLOW_DOMAINS', ','.join([
+    'challenges.cloudflare.com', 'recaptcha.net', 'gstatic.com', 'hcaptcha.com',
+    'usercentrics.eu', 'cookiebot.com',
+]))
+
+# Share of jobs that run unfiltered, so filtered and unfiltered page loads
+# (and the sizes of what gets blocked) can be compared from real traffic.
+CONTROL_SAMPLE_RATE = float(os.getenv('FILTER_CONTROL_SAMPLE_RATE', '0.05'))
+
+# Running average body size per resource type, learned from responses that
+# carried a Content-Length; used to estimate the bytes a block saved.
+_average_sizes = {}
+
+
+def _host_matches(host, domains):
+    return any(host == d or host.endswith('.' + d) for d in domains)
+
+
+def learn_size(resource_type, size):
+    count, average = _average_sizes.get(resource_type, (0, 0.0))
+    count += 1
+    _average_sizes[resource_type] = (count, average + (size - average) / count)
+
+
+def estimated_size(resource_type):
+    return _average_sizes.get(resource_type, (0, 0.0))[1]
+
+
+class RequestFilter:
+    """Per-job request filter installed with BrowserContext.route.
+
+    Blocks by resource type and domain, honours the allowlist, and counts
+    what was blocked so the rules can be tuned from data.
+    """
+
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = FILTER_ENABLED and random.random() >= CONTROL_SAMPLE_RATE
+        self.enabled = enabled
+        self.blocked_requests = 0
+        self.blocked_bytes_estimate = 0.0
+        self.blocked_by_type = {}
+        self.blocked_by_domain = {}
+        self.allowed_requests = 0
+        self.allowed_bytes = 0
+
+    @property
+    def mode(self):
+        return 'filtered' if self.enabled else 'unfiltered'
+
+    def should_block(self, url, resource_type):
+        if not self.enabled:
+            return False
+        host = (urlsplit(url).hostname or '').lower()
+        if _host_matches(host, ALLOWED_DOMAINS):
+            return False
+        return resource_type in BLOCKED_RESOURCE_TYPES or _host_matches(host, BLOCKED_DOMAINS)
+
+    def _count_block(self, url, resource_type):
+        host = (urlsplit(url).hostname or '').lower()
+        self.blocked_requests += 1
+        self.blocked_bytes_estimate += estimated_size(resource_type)
+        self.blocked_by_type[resource_type] = self.blocked_by_type.get(resource_type, 0) + 1
+        self.blocked_by_domain[host] = self.blocked_by_domain.get(host, 0) + 1
+
+    def on_response(self, response):
+        self.allowed_requests += 1
+        length = response.headers.get('content-length')
+        if length and length.isdigit():
+            self.allowed_bytes += int(length)
+            learn_size(response.request.resource_type, int(length))
+
+    def handle(self, route):
+        request = route.request
+        if self.should_block(request.url, request.resource_type):
+            self._count_block(request.url, request.resource_type)
+            route.abort('blockedbyclient')
+        else:
+            route.fallback()
+
+    async def handle_async(self, route):
+        request = route.request
+        if self.should_block(request.url, request.resource_type):
+            self._count_block(request.url, request.resource_type)
+            await route.abort('blockedbyclient')
+        else:
+            await route.fallback()
+
+    def install(self, context):
+        if self.enabled:
+            context.route('**/*', self.handle)
+        context.on('response', self.on_response)
+        return self
+
+    async def install_async(self, context):
+        if self.enabled:
+            await context.route('**/*', self.handle_async)
+        context.on('response', self.on_response)
+        return self
+
+    def summary(self):
+        top_domains = sorted(self.blocked_by_domain.items(), key=lambda kv: kv[1], reverse=True)[:5]
+        return (f"mode={self.mode} blocked={self.blocked_requests} "
+                f"(~{self.blocked_bytes_estimate / 1024:.0f} KiB, by type {self.blocked_by_type}, "
+                f"top domains {dict(top_domains)}) allowed={self.allowed_requests} "
+                f"({self.allowed_bytes / 1024:.0f} KiB)")
+
+    def record_metrics(self):
+        metrics.incr('atu_filter_jobs_total', mode=self.mode)
+        for resource_type, count in self.blocked_by_type.items():
+            metrics.incr('atu_filter_blocked_requests_total', count, type=resource_type)
+        metrics.incr('atu_filter_blocked_bytes_estimated_total', round(self.blocked_bytes_estimate))
+        metrics.incr('atu_filter_allowed_bytes_total', self.allowed_bytes, mode=self.mode)
@@ -0,0 +1,172 @@
+import logging
+import os
+import random
+import time
+from datetime import date, datetime
+
+import metrics
+from redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+# Lane -> Celery queue.
+LANES = {'urgent': 'urgent', 'normal': 'celery', 'bulk': 'bulk'}
+
+# Bookings whose target_date is at most this many days away go to the urgent lane.
+URGENT_DAYS = int(os.getenv('SCHED_URGENT_DAYS', '2'))
+
+# Messages are ordered by priority 0 (first) .. 9. The Redis transport fetches
+# by priority step first and only then by queue, so queue order alone does not
+# drain lanes in order: each lane gets its own band of steps, and within the
+# band nearer target dates come first, one step per `days_per_step` days.
+PRIORITY_STEPS = list(range(10))
+# lane: (first step, last step, days_per_step)
+PRIORITY_BANDS = {'urgent': (0, 2, 1), 'normal': (3, 6, 7), 'bulk': (7, 9, 7)}
+
+# Token buckets per ATU branch (PIN code) and for the whole site: at most
+# *_CONCURRENCY jobs at once, and *_PER_MINUTE job starts per minute (bursts
+# up to one minute's worth).
+BRANCH_CONCURRENCY = int(os.getenv('RATE_BRANCH_CONCURRENCY', '2'))
+BRANCH_PER_MINUTE = float(os.getenv('RATE_BRANCH_PER_MINUTE', '6'))
+SITE_CONCURRENCY = int(os.getenv('RATE_SITE_CONCURRENCY', '16'))
+SITE_PER_MINUTE = float(os.getenv('RATE_SITE_PER_MINUTE', '60'))
+# A slot of a worker that died is freed after this long.
+SLOT_TTL = 1800
+# Seconds to come back after when the concurrency limit is reached.
+CONCURRENCY_BACKOFF = 15
+
+# KEYS: bucket and slots key per scope. ARGV: now, slot ttl, holder, then
+# concurrency and per-minute rate per scope. Returns the seconds to wait,
+# '0' when a slot and a token were taken in every scope.
+_ACQUIRE_LUA = """
+local now, ttl, holder = tonumber(ARGV[1]), tonumber(ARGV[2]), ARGV[3]
+local wait = 0
+for i = 1, #KEYS / 2 do
+    local bucket, slots = KEYS[2 * i - 1], KEYS[2 * i]
+    local limit, rate = tonumber(ARGV[2 + 2 * i]), tonumber(ARGV[3 + 2 * i])
+    redis.call('ZREMRANGEBYSCORE', slots, '-inf', now)
+    if redis.call('ZSCORE', slots, holder) == false and redis.call('ZCARD', slots) >= limit then
+        wait = math.max(wait, tonumber(ARGV[#ARGV]))
+    end
+    local tokens = tonumber(redis.call('HGET', bucket, 'tokens') or rate)
+    local ts = tonumber(redis.call('HGET', bucket, 'ts') or now)
+    tokens = math.min(rate, tokens + (now - ts) * rate / 60)
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) * 60 / rate)
+    end
+    redis.call('HSET', bucket, 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', bucket, 3600)
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i = 1, #KEYS / 2 do
+    redis.call('HINCRBYFLOAT', KEYS[2 * i - 1], 'tokens', -1)
+    redis.call('ZADD', KEYS[2 * i], now + ttl, holder)
+    redis.call('EXPIRE', KEYS[2 * i], ttl)
+end
+return '0'
+"""
+
+_acquire_script = None
+
+
+def days_until(target_date):
+    try:
+        return (datetime.strptime(str(target_date), '%d.%m.%Y').date() - date.today()).days
+    except ValueError:
+        return None
+
+
+def lane_for(data, default='normal'):
+    """Explicit data['priority'] if valid, urgent for near target dates, else `default`."""
+    if data.get('priority') in LANES:
+        return data['priority']
+    days = days_until(data.get('target_date'))
+    if days is not None and days <= URGENT_DAYS:
+        return 'urgent'
+    return default
+
+
+def priority_for(data, lane=None):
+    """Priority step of the booking inside its lane's band; no target_date sorts last in the band."""
+    first, last, days_per_step = PRIORITY_BANDS[lane or lane_for(data)]
+    days = days_until(data.get('target_date'))
+    if days is None:
+        return last
+    return first + min(max(days, 0) // days_per_step, last - first)
+
+
+def booking_group_key(data):
+    """Bookings with the same key can share one browser session."""
+    return (
+        str(data.get('pin_code', '')),
+        str(data.get('target_manufacturer', '')),
+        str(data.get('target_model', '')),
+        str(data.get('target_year', '')),
+    )
+
+
+def enqueue(task, args, data, lane=None, queue=None, countdown=None, enqueued_at=None, retries=0, task_id=None):
+    """Send `task` to its lane's queue at its lane's priority; returns (AsyncResult, lane).
+
+    A deferred task is sent again with its `retries` and `task_id`, so the
+    deferral neither resets its retry budget nor loses its checkpoints.
+    """
+    lane = lane or lane_for(data)
+    result = task.apply_async(
+        args, {'lane': lane, 'enqueued_at': enqueued_at or time.time()},
+        queue=queue or LANES[lane], priority=priority_for(data, lane), countdown=countdown,
+        retries=retries, task_id=task_id)
+    return result, lane
+
+
+def _scopes(data):
+    return [
+        (f"rate:branch:{data.get('pin_code', '')}", BRANCH_CONCURRENCY, BRANCH_PER_MINUTE),
+        ('rate:site:atu', SITE_CONCURRENCY, SITE_PER_MINUTE),
+    ]
+
+
+def acquire(data, holder):
+    """Take a slot and a token for the booking's branch and the site.
+
+    Returns 0 on success, otherwise the seconds to wait before trying again.
+    Redis being unavailable lets the job through.
+    """
+    global _acquire_script
+    keys, args = [], [time.time(), SLOT_TTL, holder]
+    for scope, concurrency, per_minute in _scopes(data):
+        keys += [f'{scope}:bucket', f'{scope}:slots']
+        args += [concurrency, per_minute]
+    args.append(CONCURRENCY_BACKOFF)
+
+    try:
+        if _acquire_script is None:
+            _acquire_script = get_redis().register_script(_ACQUIRE_LUA)
+        wait = float(_acquire_script(keys=keys, args=args))
+    except Exception as e:
+        logger.warning('Rate limiter unavailable, not limiting: %s', e)
+        return 0
+
+    if wait:
+        metrics.incr('atu_rate_limited_total')
+        # Spread the retries of a burst instead of waking them all together.
+        wait += random.uniform(0, 2)
+    return wait
+
+
+def release(data, holder):
+    try:
+        pipe = get_redis().pipeline()
+        for scope, _, _ in _scopes(data):
+            pipe.zrem(f'{scope}:slots', holder)
+        pipe.execute()
+    except Exception as e:
+        logger.warning('Could not release rate limit slot of %s: %s', holder, e)
+
+
+def record_wait(lane, enqueued_at):
+    if enqueued_at:
+        metrics.observe('atu_queue_wait_seconds', max(time.time() - enqueued_at, 0), lane=lane)
@@ -0,0 +1,270 @@
+import atexit
+import importlib.util
+import logging
+import os
+import queue
+import threading
+import time
+from time import perf_counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import jobs
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+SCREENSHOT_DIR = 'screenshots'
+
+# Capture defaults; a booking can override them with data['screenshot'].
+DEFAULT_OPTIONS = {
+    'format': os.getenv('SCREENSHOT_FORMAT', 'jpeg'),      # png | jpeg | webp
+    'quality': int(os.getenv('SCREENSHOT_QUALITY', '70')),  # jpeg / webp only
+    'full_page': os.getenv('SCREENSHOT_FULL_PAGE', '1') == '1',
+    'selector': os.getenv('SCREENSHOT_SELECTOR') or None,   # capture a single element
+    'clip': os.getenv('SCREENSHOT_CLIP') or None,           # "x,y,width,height"
+}
+
+UPLOAD_WORKERS = int(os.getenv('SCREENSHOT_UPLOAD_WORKERS', '2'))
+UPLOAD_QUEUE_SIZE = int(os.getenv('SCREENSHOT_UPLOAD_QUEUE_SIZE', '100'))
+UPLOAD_RETRIES = int(os.getenv('SCREENSHOT_UPLOAD_RETRIES', '4'))
+UPLOAD_TIMEOUT = 30
+
+RETENTION_DAYS = float(os.getenv('SCREENSHOT_RETENTION_DAYS', '14'))
+RETENTION_MAX_FILES = int(os.getenv('SCREENSHOT_MAX_FILES', '5000'))
+CLEANUP_INTERVAL_SECONDS = 3600
+
+TELEGRAM_CHAT_ID = '5469717358'
+
+EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+
+
+def option_problems(data):
+    """Problems with a booking's screenshot options, as readable messages."""
+    overrides = (data or {}).get('screenshot') or {}
+    if not isinstance(overrides, dict):
+        return ['screenshot must be an object']
+    options = dict(DEFAULT_OPTIONS, **overrides)
+
+    problems = []
+    if options['format'] not in EXTENSIONS:
+        problems.append(f"screenshot.format must be one of {', '.join(EXTENSIONS)}")
+    elif options['format'] == 'webp' and importlib.util.find_spec('PIL') is None:
+        problems.append('screenshot.format webp needs Pillow, which is not installed')
+    quality = options['quality']
+    if isinstance(quality, bool) or not isinstance(quality, int) or not 0 <= quality <= 100:
+        problems.append('screenshot.quality must be a whole number from 0 to 100')
+    clip = options['clip']
+    if clip:
+        try:
+            values = [float(v) for v in clip.split(',')] if isinstance(clip, str) else list(clip)
+            ok = len(values) == 4
+        except (TypeError, ValueError):
+            ok = False
+        if not ok:
+            problems.append('screenshot.clip must be "x,y,width,height"')
+    return problems
+
+
+def capture_options(data):
+    problems = option_problems(data)
+    if problems:
+        raise ValueError('; '.join(problems))
+    options = dict(DEFAULT_OPTIONS)
+    options.update((data or {}).get('screenshot') or {})
+    return options
+
+
+def screenshot_path(timestamp, options):
+    return f"{SCREENSHOT_DIR}/{timestamp}.{EXTENSIONS[options['format']]}"
+
+
+def _screenshot_kwargs(options):
+    # Playwright encodes PNG and JPEG itself; WebP is converted from PNG afterwards.
+    kwargs = {'type': 'jpeg' if options['format'] == 'jpeg' else 'png'}
+    if options['format'] == 'jpeg':
+        kwargs['quality'] = options['quality']
+    if options.get('clip'):
+        clip = options['clip']
+        if isinstance(clip, str):
+            clip = [float(v) for v in clip.split(',')]
+        if isinstance(clip, (list, tuple)):
+            clip = dict(zip(('x', 'y', 'width', 'height'), clip))
+        kwargs['clip'] = clip
+    elif not options.get('selector'):
+        kwargs['full_page'] = options['full_page']
+    return kwargs
+
+
+def capture(page, path, options):
+    """Take the screenshot described by `options` and write it to `path`."""
+    kwargs = _screenshot_kwargs(options)
+    target = path if options['format'] != 'webp' else path + '.png'
+    if options.get('selector'):
+        page.locator(options['selector']).first.screenshot(path=target, **kwargs)
+    else:
+        page.screenshot(path=target, **kwargs)
+    return target
+
+
+async def capture_async(page, path, options):
+    kwargs = _screenshot_kwargs(options)
+    target = path if options['format'] != 'webp' else path + '.png'
+    if options.get('selector'):
+        await page.locator(options['selector']).first.screenshot(path=target, **kwargs)
+    else:
+        await page.screenshot(path=target, **kwargs)
+    return target
+
+
+def to_webp(source, path, quality):
+    """Convert a captured PNG to WebP; keeps the PNG if Pillow is not installed."""
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.warning("Pillow is not installed, keeping PNG instead of WebP for %s", path)
+        return source
+
+    with Image.open(source) as image:
+        image.save(path, 'WEBP', quality=quality)
+    os.remove(source)
+    return path
+
+
+def cleanup_screenshots(directory=SCREENSHOT_DIR, max_age_days=RETENTION_DAYS, max_files=RETENTION_MAX_FILES):
+    """Delete screenshots past the retention age, then the oldest beyond max_files."""
+    try:
+        entries = [e for e in os.scandir(directory) if e.is_file()]
+    except FileNotFoundError:
+        return 0
+
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    cutoff = time.time() - max_age_days * 86400
+    excess = len(entries) - max_files
+    removed = 0
+    for i, entry in enumerate(entries):
+        if entry.stat().st_mtime >= cutoff and i >= excess:
+            break
+        try:
+            os.remove(entry.path)
+            removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info('Removed %d old screenshots from %s', removed, directory)
+    return removed
+
+
+class ScreenshotUploader:
+    """Background delivery of screenshots to Telegram.
+
+    A bounded queue feeds a few daemon threads that share one pooled
+    requests.Session with retries and exponential backoff, so a worker slot
+    is free as soon as the screenshot is on disk. The same threads run the
+    retention cleanup of the screenshots directory.
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS, queue_size=UPLOAD_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.session = requests.Session()
+        retry = Retry(total=UPLOAD_RETRIES, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=None, respect_retry_after_header=True)
+        self.session.mount('https://', HTTPAdapter(max_retries=retry, pool_maxsize=workers))
+        self._last_cleanup = 0
+        self._cleanup_lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, name=f'screenshot-uploader-{i}', daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, source, path, caption, options, job_id=None):
+        try:
+            self.queue.put_nowait((source, path, caption, options, job_id))
+            return True
+        except queue.Full:
+            logger.warning('Screenshot upload queue full, not sending %s', path)
+            metrics.incr('atu_screenshot_uploads_total', status='dropped')
+            return False
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._deliver(*item)
+            except Exception as e:
+                logger.warning('Failed to deliver screenshot %s: %s', item[1], e)
+                metrics.incr('atu_screenshot_uploads_total', status='failed')
+            finally:
+                self.queue.task_done()
+            self._maybe_cleanup()
+
+    def _deliver(self, source, path, caption, options, job_id):
+        if options['format'] == 'webp':
+            path = to_webp(source, path, options['quality'])
+
+        start = perf_counter()
+        self.send_to_telegram(path, caption)
+        metrics.observe('atu_phase_duration_seconds', perf_counter() - start, phase='telegram_upload')
+        metrics.incr('atu_screenshot_uploads_total', status='sent')
+        jobs.publish(job_id, 'screenshot_delivered', screenshot=path)
+
+    def send_to_telegram(self, image_path, caption):
+        token = os.environ['TELEGRAM_BOT_TOKEN']
+        url = f'https://api.telegram.org/bot{token}/sendPhoto'
+
+        with open(image_path, 'rb') as photo:
+            files = {'photo': photo}
+            data = {'chat_id': TELEGRAM_CHAT_ID, 'caption': caption}
+            r = self.session.post(url, files=files, data=data, timeout=UPLOAD_TIMEOUT)
+            r.raise_for_status()
+            return r.json()
+
+    def _maybe_cleanup(self):
+        now = time.monotonic()
+        if now - self._last_cleanup < CLEANUP_INTERVAL_SECONDS:
+            return
+        with self._cleanup_lock:
+            if now - self._last_cleanup < CLEANUP_INTERVAL_SECONDS:
+                return
+            self._last_cleanup = now
+        cleanup_screenshots()
+
+    def drain(self, timeout=30):
+        """Wait (up to `timeout` seconds) for queued uploads before the process exits."""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+
+_uploader = None
+_uploader_lock = threading.Lock()
+
+
+def get_uploader():
+    global _uploader
+    with _uploader_lock:
+        if _uploader is None:
+            _uploader = ScreenshotUploader()
+    return _uploader
+
+
+def drain_uploader():
+    if _uploader is not None:
+        _uploader.drain()
+
+
+def _forget_uploader_after_fork():
+    # Threads do not survive fork; the child starts its own uploader lazily.
+    global _uploader, _uploader_lock
+    _uploader = None
+    _uploader_lock = threading.Lock()
+
+
+atexit.register(drain_uploader)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_uploader_after_fork)
@@ -1,6 +1,20 @@
 # tasks.py
+from datetime import datetime
+import logging
+import os
+from time import perf_counter
 from celery import Celery
-from atu_scraper import ATUScraper
+from celery.signals import (task_postrun, task_prerun, worker_process_init, worker_process_shutdown,
+                            worker_ready, worker_shutdown)
+from browser_pool import get_pool, is_warm, shutdown_pools
+from screenshot_delivery import drain_uploader
+import admission
+import availability
+import failures
+import jobs
+import metrics
+import reaper
+import scheduler
 
 celery = Celery(
     'tasks',
@@ -8,10 +22,282 @@ celery = Celery(
     backend='redis://localhost:6379/0'
 )
 
+# Async bookings go to their own queue, consumed by a thread-pool worker whose
+# threads all feed the same per-process event loop (see async_scraper.py).
+celery.conf.task_routes = {
+    'tasks.run_scraper_async': {'queue': 'async'},
+}
+
+# Lower priority runs first across all queues a worker consumes; the lanes
+# are kept apart by their priority bands (scheduler.PRIORITY_BANDS), not by
+# the order of -Q.
+celery.conf.broker_transport_options = {
+    'queue_order_strategy': 'priority',
+    'priority_steps': scheduler.PRIORITY_STEPS,
+    'sep': ':',
+}
+celery.conf.task_default_priority = scheduler.PRIORITY_STEPS[-1]
+
+# With --autoscale=max,min the pool size also follows memory headroom (admission.py).
+celery.conf.worker_autoscaler = 'admission:MemoryAutoscaler'
+
+# Keeps the availability of the most requested branches warm (needs `celery beat`).
+celery.conf.beat_schedule = {
+    'refresh-availability': {
+        'task': 'tasks.refresh_availability',
+        'schedule': availability.REFRESH_SECONDS,
+    },
+}
+
+# app.py imports this module too, so the scraper (Playwright, tenacity, the
+# FleetLink mapping) is imported inside the tasks and pre-warmed per worker process.
+PREWARM_ENABLED = os.getenv('WORKER_PREWARM', '1') == '1'
+# Browser type to launch before the first task (e.g. Opera); empty launches none.
+PREWARM_BROWSER = os.getenv('WORKER_PREWARM_BROWSER', '')
+# A pool process has this long to finish worker_process_init (Celery's default
+# of 4s is too short for a browser launch) before it is killed.
+celery.conf.worker_proc_alive_timeout = int(os.getenv('WORKER_PREWARM_TIMEOUT', '60'))
+
+MAX_RETRIES = 3
+
+logger = logging.getLogger(__name__)
+
+_process_started = None
+_first_task_started = None
+
+
+def retry_or_fail(task, exc, job_id):
+    """Retry the task as its kind of failure allows (failures.POLICIES), or fail it.
+
+    Returns the exception to raise, telling the job registry whether another
+    attempt is coming.
+    """
+    kind = failures.failure_kind(exc)
+    countdown = failures.task_countdown(kind, task.request.retries)
+    if countdown is None:
+        metrics.incr('atu_jobs_total', status='failure')
+        jobs.publish(job_id, 'failed', status='failed', error=str(exc), kind=kind)
+        return exc
+
+    metrics.incr('atu_jobs_total', status='retry')
+    jobs.publish(job_id, 'retrying', status='retrying', attempt=task.request.retries + 1, error=str(exc), kind=kind)
+    return task.retry(exc=exc, countdown=countdown, max_retries=MAX_RETRIES)
+
+
+def admit(task, args, data, holder, lane, enqueued_at, browser_type, warm, queue=None):
+    """Take the branch/site rate-limit slot and check memory, or send the task back to its lane for later."""
+    wait = scheduler.acquire(data, holder)
+    if not wait and not admission.admit(browser_type, warm):
+        scheduler.release(data, holder)
+        wait = admission.DEFER_SECONDS
+    if wait:
+        scheduler.enqueue(task, args, data, lane, queue=queue, countdown=wait, enqueued_at=enqueued_at,
+                          retries=task.request.retries, task_id=task.request.id)
+        return False
+    if not task.request.retries:
+        scheduler.record_wait(lane, enqueued_at)
+    return True
+
+
+@celery.task(bind=True)
+def run_scraper(self, data, timestamp, browser_type, job_id=None, lane='normal', enqueued_at=None):
+    holder = job_id or timestamp
+    if not admit(self, (data, timestamp, browser_type, job_id), data, holder, lane, enqueued_at,
+                 browser_type, is_warm(browser_type)):
+        jobs.publish(job_id, 'deferred')
+        return
+
+    from atu_scraper import ATUScraper
+
+    metrics.inflight(1)
+    jobs.publish(job_id, 'started', status='running', attempt=self.request.retries)
+    try:
+        scraper = ATUScraper(data, timestamp, browser_type, job_id)
+        scraper.run(resume=self.request.retries > 0)
+        metrics.incr('atu_jobs_total', status='success')
+    except Exception as e:
+        raise retry_or_fail(self, e, job_id)
+    finally:
+        scheduler.release(data, holder)
+        metrics.inflight(-1)
+
+
+@celery.task(bind=True)
+def run_scraper_batch(self, bookings, browser_type, lane='bulk', enqueued_at=None):
+    """Run a group of bookings for one branch in a single browser session.
+
+    Failed bookings are not retried as a group (that would repeat the ones
+    that went through); each is re-queued on its own as run_scraper.
+    """
+    data, timestamp, job_id = bookings[0]
+    holder = job_id or timestamp
+    if not admit(self, (bookings, browser_type), data, holder, lane, enqueued_at,
+                 browser_type, is_warm(browser_type)):
+        return []
+
+    from atu_scraper import run_batch
+
+    metrics.inflight(1)
+    try:
+        results = run_batch(bookings, browser_type)
+    finally:
+        scheduler.release(data, holder)
+        metrics.inflight(-1)
+
+    for (data, timestamp, job_id), result in zip(bookings, results):
+        if result['status'] != 'failed':
+            metrics.incr('atu_jobs_total', status='success')
+            continue
+
+        countdown = failures.task_countdown(result['kind'], 0)
+        if countdown is None:
+            metrics.incr('atu_jobs_total', status='failure')
+            jobs.publish(job_id, 'failed', status='failed', error=result['error'], kind=result['kind'])
+            continue
+
+        # Counts as the booking's first retry: it resumes from its checkpoints
+        # and has one retry less left.
+        scheduler.enqueue(run_scraper, (data, timestamp, browser_type, job_id), data, lane, countdown=countdown,
+                          retries=1)
+        result['status'] = 'requeued'
+        metrics.incr('atu_jobs_total', status='retry')
+        jobs.publish(job_id, 'retrying', status='retrying', attempt=1, error=result['error'], kind=result['kind'])
+    return results
+
+
+@celery.task(bind=True)
+def run_scraper_async(self, data, timestamp, browser_type, job_id=None, lane='normal', enqueued_at=None):
+    from async_scraper import engine_running, get_engine
+
+    holder = job_id or timestamp
+    if not admit(self, (data, timestamp, browser_type, job_id), data, holder, lane, enqueued_at,
+                 browser_type, engine_running(browser_type), queue='async'):
+        jobs.publish(job_id, 'deferred')
+        return
+
+    metrics.inflight(1)
+    jobs.publish(job_id, 'started', status='running', attempt=self.request.retries)
+    try:
+        get_engine(browser_type).submit(data, timestamp, job_id).result()
+        metrics.incr('atu_jobs_total', status='success')
+    except Exception as e:
+        raise retry_or_fail(self, e, job_id)
+    finally:
+        scheduler.release(data, holder)
+        metrics.inflight(-1)
+
+
 @celery.task(bind=True)
-def run_scraper(self, data, timestamp, browser_type):
+def check_availability(self, query, timestamp, browser_type, job_id=None, lane='normal', enqueued_at=None):
+    """Read the dates and slots for an availability query and cache them."""
+    data = availability.booking_data(query)
+    holder = job_id or timestamp
+    if not admit(self, (query, timestamp, browser_type, job_id), data, holder, lane, enqueued_at,
+                 browser_type, is_warm(browser_type)):
+        return None
+
+    from atu_scraper import ATUScraper
+
+    metrics.inflight(1)
+    jobs.publish(job_id, 'started', status='running', attempt=self.request.retries)
+    # The query stays locked while retries are pending, so no second run is
+    # queued for it; only the final outcome unlocks it.
+    final = True
     try:
-        scraper = ATUScraper(data, timestamp, browser_type)
-        scraper.run()
+        scraper = ATUScraper(data, timestamp, browser_type, job_id)
+        entry = availability.store(query, scraper.check_availability())
+        metrics.incr('atu_jobs_total', status='success')
+        jobs.publish(job_id, 'done', status='done', phase='', dates=entry['dates'])
+        return entry
     except Exception as e:
-        raise self.retry(exc=e, countdown=10, max_retries=3)
+        countdown = failures.task_countdown(failures.failure_kind(e), self.request.retries)
+        final = countdown is None
+        if not final:
+            availability.extend_lock(query, countdown)
+        raise retry_or_fail(self, e, job_id)
+    finally:
+        if final:
+            availability.release(query)
+        scheduler.release(data, holder)
+        metrics.inflight(-1)
+
+
+@celery.task
+def refresh_availability(browser_type='Opera'):
+    """Re-check popular availability queries before their cache entries expire."""
+    for query in availability.queries_to_refresh():
+        if availability.claim(query):
+            timestamp = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-avail-{availability.query_key(query)[-8:]}"
+            scheduler.enqueue(check_availability, (query, timestamp, browser_type), query, 'bulk')
+
+
+@worker_process_init.connect
+def prewarm(**kwargs):
+    """Load what the first booking would otherwise pay for, before the process takes tasks."""
+    global _process_started
+    _process_started = perf_counter()
+    if not PREWARM_ENABLED:
+        return
+
+    stages = []
+    start = perf_counter()
+    import atu_scraper  # noqa: F401 (Playwright, tenacity and the scraper's helpers)
+    stages.append(('imports', perf_counter() - start))
+
+    start = perf_counter()
+    try:
+        from fleetlink_mapping import get_mapping
+        get_mapping().index()
+    except Exception as e:
+        logger.warning('Could not preload the FleetLink mapping: %s', e)
+    stages.append(('mapping', perf_counter() - start))
+
+    if PREWARM_BROWSER:
+        start = perf_counter()
+        try:
+            # Headless, like ATUScraper, so the first task finds it in the pool.
+            get_pool(PREWARM_BROWSER, True).launch(logger)
+        except Exception as e:
+            logger.warning('Could not pre-launch %s: %s', PREWARM_BROWSER, e)
+        stages.append(('browser', perf_counter() - start))
+
+    logger.info('Worker process %d pre-warmed in %.2fs (%s)', os.getpid(), perf_counter() - _process_started,
+                ', '.join(f'{name} {seconds:.2f}s' for name, seconds in stages))
+
+
+@task_prerun.connect
+def note_first_task(**kwargs):
+    global _first_task_started
+    if _process_started is not None and _first_task_started is None:
+        _first_task_started = perf_counter()
+
+
+@task_postrun.connect
+def log_first_task(task=None, **kwargs):
+    global _process_started
+    if _process_started is not None and _first_task_started is not None:
+        logger.info('First task %s in process %d took %.2fs (started %.2fs after process init)',
+                    task.name, os.getpid(), perf_counter() - _first_task_started,
+                    _first_task_started - _process_started)
+        _process_started = None
+
+
+@worker_ready.connect
+def start_reaper(**kwargs):
+    # In the main worker process: kills browsers left behind by pool processes that died.
+    reaper.start()
+
+
+@worker_shutdown.connect
+def stop_reaper(**kwargs):
+    reaper.stop()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_pooled_browsers(**kwargs):
+    shutdown_pools()
+    drain_uploader()
+
+    from async_scraper import shutdown_engines
+    shutdown_engines()
@@ -0,0 +1,73 @@
+import os
+
+
+# fill:  one locator.fill() per field, no key events
+# type:  one press_sequentially() call per field with Playwright's native per-key delay
+# human: one keyboard.type() per character with the pacing profile's keystroke jitter
+TYPING_MODES = ('fill', 'type', 'human')
+
+# Used when a request does not pick a mode, so the pacing profile drives it.
+PROFILE_TYPING_MODES = {
+    'stealth': 'human',
+    'balanced': 'type',
+    'fast': 'fill',
+}
+
+
+def resolve_mode(data, pacer):
+    mode = data.get('typing') or os.getenv('TYPING_MODE') or PROFILE_TYPING_MODES.get(pacer.profile, 'human')
+    if mode not in TYPING_MODES:
+        raise ValueError(f"Unknown typing mode: {mode} (expected one of {', '.join(TYPING_MODES)})")
+    return mode
+
+
+def fields_to_fill(your_data):
+    """The (field id, value) pairs worth visiting; empty fields are left untouched."""
+    return [(id_, value) for id_, value in your_data.items() if value is not None and str(value).strip()]
+
+
+class TypingEngine:
+    def __init__(self, page, pacer, mode):
+        self.page = page
+        self.pacer = pacer
+        self.mode = mode
+
+    def key_delay_ms(self):
+        low, high = self.pacer.ranges.get('keystroke', (0, 0))
+        return (low + high) / 2 * 1000
+
+    def enter(self, locator, value):
+        value = str(value)
+        with self.pacer.timed(f'typing:{self.mode}'):
+            if self.mode == 'fill':
+                locator.fill(value)
+                return
+
+            locator.click()
+            self.page.keyboard.press('Control+a')
+
+            if self.mode == 'type':
+                locator.press_sequentially(value, delay=self.key_delay_ms())
+            else:
+                for char in value:
+                    self.page.keyboard.type(char)
+                    self.pacer.pause('keystroke')
+
+
+class AsyncTypingEngine(TypingEngine):
+    async def enter(self, locator, value):
+        value = str(value)
+        with self.pacer.timed(f'typing:{self.mode}'):
+            if self.mode == 'fill':
+                await locator.fill(value)
+                return
+
+            await locator.click()
+            await self.page.keyboard.press('Control+a')
+
+            if self.mode == 'type':
+                await locator.press_sequentially(value, delay=self.key_delay_ms())
+            else:
+                for char in value:
+                    await self.page.keyboard.type(char)
+                    await self.pacer.async_pause('keystroke')
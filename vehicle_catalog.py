@@ -0,0 +1,125 @@
+import difflib
+import json
+import logging
+import os
+
+from fleetlink_mapping import get_mapping
+import metrics
+from redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+CATALOG_TTL = int(os.getenv('VEHICLE_CATALOG_TTL_SECONDS', str(7 * 24 * 3600)))
+
+# reject: 422 before enqueuing; warn: enqueue but return the problems; off: no check.
+VALIDATION_MODE = os.getenv('VEHICLE_CATALOG_VALIDATION', 'reject')
+
+# Service groups whose booking flow asks for the vehicle.
+VEHICLE_SERVICE_GROUPS = ['Ölwechsel', 'Inspektion', 'Achsvermessung', 'Bremsen', 'Fahrwerk', 'Zahnriemen']
+
+# Dropdown levels in page order; each list is keyed by the values chosen above it.
+LEVELS = ('target_manufacturer', 'target_model', 'target_year')
+
+# A list with fewer texts is only the placeholder (its options had not loaded yet).
+MIN_OPTIONS = 2
+
+
+def _key(path):
+    return 'vehicle_catalog:' + '|'.join(path)
+
+
+def options(path):
+    """Cached option texts of the dropdown under `path` (manufacturer, model), or None."""
+    try:
+        raw = get_redis().get(_key(path))
+    except Exception as e:
+        logger.warning('Could not read vehicle catalog %s: %s', path, e)
+        return None
+    texts = json.loads(raw) if raw else None
+    return texts if texts and len(texts) >= MIN_OPTIONS else None
+
+
+def record(path, texts):
+    """Store the option texts seen on the page for the dropdown under `path`."""
+    texts = [t for t in texts if t and t.strip()]
+    if len(texts) < MIN_OPTIONS:
+        return
+    try:
+        get_redis().set(_key(path), json.dumps(texts), ex=CATALOG_TTL)
+        metrics.incr('atu_vehicle_catalog_updates_total', level=str(len(path)))
+    except Exception as e:
+        logger.warning('Could not update vehicle catalog %s: %s', path, e)
+
+
+def service_groups(data):
+    """The booking's service groups: given in the payload, or resolved from its FleetLink IDs
+    through the mapping sidecar. None when they cannot be told without the Excel file."""
+    groups = data.get('target_service_group') or []
+    if isinstance(groups, str):
+        groups = [groups]
+    if groups:
+        return groups
+
+    index = get_mapping().sidecar_index()
+    if index is None:
+        return None
+    ids = data.get('id_target')
+    groups = []
+    for id_ in ids if isinstance(ids, list) else [ids]:
+        try:
+            groups.extend(group for group, _ in index.get(int(id_), []))
+        except (TypeError, ValueError):
+            continue
+    return groups
+
+
+def missing_fields(groups, data):
+    """Fields the service groups need that `data` does not give: the vehicle for
+    VEHICLE_SERVICE_GROUPS, and the engine (electric/fuel) for HU/AU."""
+    missing = []
+    if any(group in VEHICLE_SERVICE_GROUPS for group in groups):
+        missing += [field for field in LEVELS if not data.get(field)]
+    if 'HU/AU' in groups and data.get('engine') not in ('electric', 'fuel'):
+        missing.append('engine')
+    return missing
+
+
+def needs_vehicle(data):
+    groups = service_groups(data)
+    if groups is None:
+        # Unknown services: check the vehicle whenever one is given
+        return any(data.get(field) for field in LEVELS)
+    return any(group in VEHICLE_SERVICE_GROUPS for group in groups)
+
+
+def suggest(value, texts):
+    """Closest valid values for `value`: case/whitespace-insensitive equals first, then difflib."""
+    folded = ' '.join(str(value).split()).lower()
+    same = [t for t in texts if ' '.join(t.split()).lower() == folded]
+    return same or difflib.get_close_matches(str(value), texts, n=3, cutoff=0.6)
+
+
+def validate(data):
+    """Problems with the booking's vehicle against the cached catalog.
+
+    Levels that are not in the catalog yet are accepted: the catalog only
+    knows what earlier runs have seen, so an unknown list is not an error.
+    """
+    if not needs_vehicle(data):
+        return []
+
+    problems = []
+    path = []
+    for field in LEVELS:
+        value = data.get(field)
+        texts = options(tuple(path))
+        if texts is None:
+            break
+        if value is None or str(value) not in texts:
+            problems.append({'field': field, 'value': value, 'suggestions': suggest(value or '', texts)})
+            break
+        path.append(str(value))
+
+    metrics.incr('atu_vehicle_catalog_checks_total', result='rejected' if problems else 'ok')
+    return problems